@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""
+Request Admission Control
+
+The network processes check requests against per-key rate limits and the
+global task queue limit before sending them to the task manager.  Requests
+that are not admitted are answered immediately with a "busy" response that
+tells the client when to try again, so a flood of requests never reaches the
+task manager (or its log).
+
+Rate limits use a token bucket for each auth key.  Each request costs one
+token per operation (a start_many request costs one token per task, and a
+batch costs one token per request in the batch).  A bucket may go into debt
+for a large request, as long as it was full enough when the request arrived.
+
+The queue limit is checked against the number of active tasks in the most
+recent status snapshot, plus the tasks this process has admitted since the
+snapshot was published.  Several network processes may each admit tasks
+before the next snapshot, so the limit is approximate.
+"""
+
+
+import time
+
+import codec
+
+
+#=============================================================================
+RATE  = 'rate'                      # rejected by a rate limit
+QUEUE = 'queue'                     # rejected by the queue limit
+
+_messages = {
+    RATE  : 'rate limit exceeded',
+    QUEUE : 'task queue is full'
+}
+
+_queue_retry = 1.0                  # retry hint when the queue is full
+
+
+#=============================================================================
+class Admission( object ):
+    """
+    Admission control for one network process.
+    """
+
+
+    #=========================================================================
+    def __init__( self, config ):
+        """
+        Constructor.
+        @param config   Application configuration object
+        """
+
+        self.config   = config
+        self.rate     = float( config.ratelimit )
+        self.burst    = float( config.rateburst )
+        self.rates    = config.ratelimits
+        self.maxqueue = config.maxqueue
+
+        # token buckets ( tokens, time of last refill ) by auth key
+        self.buckets = {}
+
+        # rejection counters by auth key and reason
+        self.rejected = {}
+        self.changed  = False
+
+        # tasks admitted since the last snapshot
+        self._admitted = 0
+        self._version  = None
+
+        # busy responses are only encoded once
+        self._responses = {}
+
+
+    #=========================================================================
+    def check( self, req, snap ):
+        """
+        Checks if a request may be sent to the task manager.
+        @param req      The parsed request object
+        @param snap     The current status snapshot (None if unavailable)
+        @return         None if the request is admitted, otherwise a tuple of
+                        the rejection reason, and the retry hint (seconds)
+        """
+
+        # unknown keys share one bucket (the manager rejects their requests)
+        key = req.key
+        if ( self.config.is_user( key ) == False ) \
+            and ( self.config.is_admin( key ) == False ):
+            key = None
+
+        # check the task queue limit
+        starts = get_starts( req )
+        if ( self.maxqueue > 0 ) and ( starts > 0 ) and ( snap is not None ):
+            if snap[ 'version' ] != self._version:
+                self._admitted = 0
+                self._version  = snap[ 'version' ]
+            if ( snap[ 'queued' ] + self._admitted + starts ) > self.maxqueue:
+                return self._reject( key, QUEUE, _queue_retry )
+
+        # check the key's rate limit
+        rate = self.rates.get( key, self.rate )
+        if rate > 0:
+            now = time.time()
+            ( tokens, stamp ) = self.buckets.get( key, ( self.burst, now ) )
+            tokens = min( self.burst, tokens + ( ( now - stamp ) * rate ) )
+            cost   = get_cost( req )
+            if tokens < min( cost, self.burst ):
+                self.buckets[ key ] = ( tokens, now )
+                return self._reject(
+                    key,
+                    RATE,
+                    ( min( cost, self.burst ) - tokens ) / rate
+                )
+            self.buckets[ key ] = ( tokens - cost, now )
+
+        # the request is admitted
+        self._admitted += starts
+        return None
+
+
+    #=========================================================================
+    def get_response( self, reason, retry, encoding = codec.JSON ):
+        """
+        Builds a busy response.
+        @param reason   The rejection reason (RATE or QUEUE)
+        @param retry    The retry hint (seconds)
+        @param encoding The response encoding
+        @return         The encoded response
+        """
+
+        # encode the constant part of the response once
+        if ( reason, encoding ) not in self._responses:
+            self._responses[ ( reason, encoding ) ] = codec.dumps(
+                { 'status' : 'busy', 'message' : _messages[ reason ] },
+                encoding
+            )
+
+        # add the retry hint (rounded up to milliseconds)
+        return codec.add_field(
+            self._responses[ ( reason, encoding ) ],
+            'retry',
+            int( retry * 1000.0 + 0.999 ) / 1000.0,
+            encoding
+        )
+
+
+    #=========================================================================
+    def _reject( self, key, reason, retry ):
+        """
+        Counts a rejected request.
+        @param key      The requester's auth key
+        @param reason   The rejection reason
+        @param retry    The retry hint (seconds)
+        @return         A tuple of the rejection reason, and the retry hint
+        """
+
+        counts = self.rejected.setdefault( key, { RATE : 0, QUEUE : 0 } )
+        counts[ reason ] += 1
+        self.changed = True
+        return ( reason, retry )
+
+
+#=============================================================================
+def is_enabled( config ):
+    """
+    Checks if any limits are configured.
+    @param config       Application configuration object
+    @return             True if requests need to be checked
+    """
+
+    return ( config.ratelimit > 0 ) or ( len( config.ratelimits ) > 0 ) \
+        or ( config.maxqueue > 0 )
+
+
+#=============================================================================
+def get_cost( req ):
+    """
+    Determines the number of operations in a request.
+    @param req          The parsed request object
+    @return             The number of operations (at least 1)
+    """
+
+    if ( req.request == 'start_many' ) and ( type( req.arguments ) is list ):
+        return max( 1, len( req.arguments ) )
+    if ( req.request == 'batch' ) and ( type( req.requests ) is list ):
+        return max( 1, len( req.requests ) )
+    return 1
+
+
+#=============================================================================
+def get_starts( req ):
+    """
+    Determines the number of tasks a request may start.
+    @param req          The parsed request object (or request dict)
+    @return             The number of tasks
+    """
+
+    if type( req ) is dict:
+        name      = req.get( 'request' )
+        arguments = req.get( 'arguments' )
+        requests  = None
+    else:
+        name      = req.request
+        arguments = req.arguments
+        requests  = req.requests
+
+    if name == 'start':
+        return 1
+    if ( name == 'start_many' ) and ( type( arguments ) is list ):
+        return len( arguments )
+    if ( name == 'batch' ) and ( type( requests ) is list ):
+        return sum(
+            get_starts( sub ) for sub in requests if type( sub ) is dict
+        )
+    return 0
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import configuration
+    import request
+
+    config = configuration.load_configuration( 'aptaskd.json' )
+    config.ratelimit = 10
+    config.rateburst = 5
+    config.maxqueue  = 8
+
+    adm  = Admission( config )
+    snap = { 'version' : 1, 'queued' : 0 }
+    key  = config.keys[ 'users' ][ 0 ]
+
+    for index in range( 7 ):
+        req = request.Request( { 'key' : key, 'request' : 'stop' } )
+        print 'stop %d:' % index, adm.check( req, snap )
+
+    req = request.Request(
+        { 'key' : key, 'request' : 'start_many', 'arguments' : [ [] ] * 9 }
+    )
+    print 'start 9:', adm.check( req, snap )
+    print 'busy:', adm.get_response( RATE, 0.1234 )
+    print 'rejected:', adm.rejected
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
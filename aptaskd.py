@@ -12,11 +12,17 @@ import os
 import signal
 import sys
 import time
+import traceback
 
+import codec
 import configuration
 import log
 import manager
 import net
+import poller
+import ring
+import session
+import zygote
 
 
 #=============================================================================
@@ -50,54 +56,144 @@ def start( config ):
     # add tasks directory to import path list
     sys.path.append( config.get_path( 'tasks' ) )
 
+    # start the worker forkserver before opening any sockets or log files
+    zyg = zygote.Zygote( config )
+    zyg.start()
+
     # initialize the logging facility
     logger = log.Log( config.get_log_file(), config.loglevel )
     logger.append_message( 'initializing daemon' )
 
-    # create the network server control and communications pipe
-    ( p_pipe, c_pipe ) = multiprocessing.Pipe( True )
+    # create the listening sockets shared by all network processes
+    listeners = [
+        net.listen( address, config.backlog )
+            for address in config.get_addresses()
+    ]
 
-    # create network server in its own process
-    netd = multiprocessing.Process(
-        target = net.net,
-        args   = ( c_pipe, config.get_address() ),
-        name   = 'aptasknetd'
-    )
+    # create the network servers, each with its own process, pipe and rings
+    netds = []
+    pipes = []
+    rings = []
+    for shard in range( config.netprocs ):
+
+        # create the network server control pipe
+        ( p_pipe, c_pipe ) = multiprocessing.Pipe( True )
+
+        # create the network server request and response rings
+        ( p_ring, c_ring ) = ring.channel( config.ringsize )
+
+        # create network server in its own process
+        netd = multiprocessing.Process(
+            target = net.net,
+            args   = ( c_pipe, listeners, shard, config, c_ring ),
+            name   = 'aptasknetd'
+        )
+
+        netds.append( netd )
+        pipes.append( p_pipe )
+        rings.append( p_ring )
 
     # create and start the task manager
-    man = manager.Manager( config, logger )
+    man = manager.Manager( config, logger, zyg )
     man.start()
 
     # set running flag
     _is_running = True
 
-    # start the network server process
-    netd.start()
+    # start the network server processes
+    for netd in netds:
+        netd.start()
+
+    # only the network processes need the listening sockets
+    for listener in listeners:
+        listener.close()
 
     # enter daemon loop
     while _is_running == True:
 
-        # check for requests from netd
-        if p_pipe.poll() == True:
-
-            # get message data and send to message handler
-            message = p_pipe.recv()
-            message.data = man.handle_request( message.data )
-            p_pipe.send( message )
+        # block until a request arrives, a worker needs attention, or the
+        #   manager's next timer is due
+        try:
+            ready = poller.wait(
+                rings + pipes + man.get_waitables(),
+                man.get_timeout()
+            )
+
+        # the wait was interrupted by a signal (check the running flag)
+        except IOError as e:
+            if poller.is_interrupt( e ) == True:
+                continue
+            raise
+
+        # check for requests from each ready netd
+        responses = []
+        for p_ring in rings:
+            if p_ring not in ready:
+                continue
+
+            # handle all requests waiting in the ring
+            for ( sid, encoding, data ) in p_ring.receive():
+                data = _handle_request( man, logger, data, encoding )
+                responses.append( ( sid, encoding, data ) )
+
+        # check for statistics, and requests too large for the rings
+        for p_pipe in pipes:
+            if p_pipe not in ready:
+                continue
+
+            # handle all messages waiting in the pipe
+            while p_pipe.poll() == True:
+                message = p_pipe.recv()
+
+                # store the network process' statistics
+                if message.mid == net.Message.STATS:
+                    man.set_net_stats( message.data )
+
+                # get message data and send to message handler
+                else:
+                    data = _handle_request(
+                        man,
+                        logger,
+                        message.data,
+                        message.encoding
+                    )
+                    responses.append( ( message.sid, message.encoding, data ) )
 
         # allow manager to process worker queues
         man.process()
 
-        # poll interval (may not be needed, or could be adaptive)
-        #if _is_running == True:
-        #    time.sleep( 0.005 )
+        # publish changes to the task table before clients see the responses
+        published = man.publish_snapshot()
 
-    # shut down task manager
-    man.stop()
+        # route each response to the process that owns the session (through
+        #   its ring, unless the response is too large for the ring)
+        for ( sid, encoding, data ) in responses:
+            shard = session.get_shard( sid )
+            if rings[ shard ].send( sid, encoding, data ) == False:
+                pipes[ shard ].send( net.Message( sid = sid, data = data ) )
 
-    # shut down network server
-    p_pipe.send( net.QUIT )
-    netd.join()
+        # tell the network processes about the new snapshot
+        if published == True:
+            for p_pipe in pipes:
+                p_pipe.send( net.SNAPSHOT )
+
+    # shut down task manager, and the worker forkserver
+    man.stop()
+    zyg.close()
+
+    # shut down network servers
+    for p_pipe in pipes:
+        p_pipe.send( net.QUIT )
+    for netd in netds:
+        netd.join()
+
+    # remove the Unix domain socket
+    path = config.get_socket_path()
+    if path is not None:
+        try:
+            os.unlink( path )
+        except OSError:
+            pass
 
     # indicate shut down and close log
     logger.append_message( 'shutting down daemon' )
@@ -120,6 +216,31 @@ def stop():
     _is_running = False
 
 
+#=============================================================================
+def _handle_request( man, logger, data, encoding ):
+    """
+    Passes a request to the task manager.  A request that the manager fails
+    to handle is answered with an error, so one client can not stop the
+    daemon.
+    @param man          The task manager
+    @param logger       The daemon's log
+    @param data         The encoded request
+    @param encoding     The encoding of the request (see the codec module)
+    @return             The encoded response
+    """
+
+    try:
+        return man.handle_request( data, encoding )
+    except Exception:
+        message = traceback.format_exc()
+        sys.stderr.write( message )
+        logger.log( log.SERVER_ERROR, message )
+        return codec.dumps(
+            { 'status' : 'error', 'message' : 'internal error' },
+            encoding
+        )
+
+
 #=============================================================================
 def main( argv ):
     """
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+"""
+Task Result Cache
+
+Tasks that declare themselves cacheable (see task.Task) have their results
+remembered by the task's name and its normalized arguments.  A request to
+start the same task with the same arguments is answered with a finished task
+that has the remembered result, without executing the task again.
+
+Each entry holds a link to its result in the result store (see the store
+module), so cached results are kept when the tasks that produced them are
+forgotten.  Entries are evicted when they expire, and the least recently
+used entries are evicted when the cache's results exceed its size limit.
+The cache's entries may be saved when the daemon stops, and loaded when it
+starts again.
+"""
+
+
+import collections
+import hashlib
+import json
+import os
+import time
+
+import output
+import store
+
+
+#=============================================================================
+_BLOCK = 4096                       # minimum size charged for an entry (one
+                                    #   file system block)
+_LINKS = 'cache'                    # directory of links to cached results
+
+
+#=============================================================================
+class Cache( object ):
+    """
+    LRU cache of task results, with an optional time limit for entries.
+    """
+
+
+    #=========================================================================
+    def __init__( self, directory, size, ttl = 0.0, path = None ):
+        """
+        Constructor.
+        @param directory
+                        The path of the result store's directory
+        @param size     The maximum total size of the cached results (bytes)
+        @param ttl      The time an entry is kept (seconds, 0 for no limit)
+        @param path     The path of the file the entries are saved in (None
+                        to forget the entries when the daemon stops)
+        """
+
+        self.directory = directory
+        self.size      = size
+        self.ttl       = ttl
+        self.path      = path
+
+        # entries as [ digest, size, expiration time, message ] lists, by
+        #   key (least recently used first)
+        self._entries = collections.OrderedDict()
+        self._used    = 0
+
+        # lifetime counters
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+        # links to cached results
+        self._links = os.path.join( directory, _LINKS )
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Saves the entries (if the cache is persistent).
+        """
+
+        if self.path is None:
+            return
+
+        self._expire()
+        temp = self.path + '.new'
+        with open( temp, 'wb' ) as index:
+            json.dump(
+                [ [ key ] + entry for key, entry in self._entries.items() ],
+                index
+            )
+        os.rename( temp, self.path )
+
+
+    #=========================================================================
+    def get( self, key ):
+        """
+        Looks up a task's result.
+        @param key      The task's cache key (see get_key())
+        @return         A tuple of the result's digest, and the task's final
+                        status message (None if the result is not cached)
+        """
+
+        entry = self._entries.pop( key, None )
+        if ( entry is not None ) and ( self._is_expired( entry ) == True ):
+            self._evict( key, entry )
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        # the entry is now the most recently used
+        self._entries[ key ] = entry
+        self.hits += 1
+        return ( entry[ 0 ], entry[ 3 ] )
+
+
+    #=========================================================================
+    def get_stats( self ):
+        """
+        Get the cache's statistics.
+        @return         A dict of entry and lookup counts
+        """
+
+        return {
+            'entries'   : len( self._entries ),
+            'size'      : self._used,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'evictions' : self.evictions
+        }
+
+
+    #=========================================================================
+    def open( self ):
+        """
+        Loads the saved entries (if the cache is persistent), and removes
+        links to results that are no longer cached.
+        """
+
+        if os.path.isdir( self._links ) == False:
+            os.makedirs( self._links )
+
+        # load the saved entries
+        saved = []
+        if self.path is not None:
+            try:
+                with open( self.path, 'rb' ) as index:
+                    saved = json.load( index )
+            except ( IOError, ValueError ):
+                saved = []
+
+        # keep the entries that have not expired, and still have a result
+        for item in saved:
+            ( key, entry ) = ( str( item[ 0 ] ), item[ 1 : ] )
+            if ( self._is_expired( entry ) == False ) \
+                and ( os.path.isfile( self._get_link( key ) ) == True ):
+                self._entries[ key ] = entry
+                self._used += entry[ 1 ]
+
+        # links that are not used by an entry are removed
+        for name in os.listdir( self._links ):
+            if name not in self._entries:
+                output.remove( os.path.join( self._links, name ) )
+
+        self._trim()
+
+
+    #=========================================================================
+    def put( self, key, digest, message = None ):
+        """
+        Remembers a task's result.
+        @param key      The task's cache key (see get_key())
+        @param digest   The result's digest
+        @param message  The task's final status message
+        """
+
+        if key in self._entries:
+            self._evict( key, self._entries.pop( key ) )
+
+        # link the result, so it is kept as long as the entry
+        link = self._get_link( key )
+        if store.link( self.directory, digest, link ) == False:
+            return
+        size = max( os.stat( link ).st_size, _BLOCK )
+        if size > self.size:
+            self._evict( key, [ digest, 0, None, message ] )
+            return
+
+        if self.ttl > 0.0:
+            expires = time.time() + self.ttl
+        else:
+            expires = None
+        self._entries[ key ] = [ digest, size, expires, message ]
+        self._used += size
+        self._trim()
+
+
+    #=========================================================================
+    def remove( self, key ):
+        """
+        Forgets a task's result.
+        @param key      The task's cache key
+        """
+
+        entry = self._entries.pop( key, None )
+        if entry is not None:
+            self._evict( key, entry )
+
+
+    #=========================================================================
+    def _evict( self, key, entry ):
+        """
+        Releases an entry that has been removed from the cache.
+        @param key      The entry's key
+        @param entry    The entry
+        """
+
+        self._used     -= entry[ 1 ]
+        self.evictions += 1
+        store.remove( self.directory, self._get_link( key ), entry[ 0 ] )
+
+
+    #=========================================================================
+    def _expire( self ):
+        """
+        Evicts all the expired entries.
+        """
+
+        for key, entry in self._entries.items():
+            if self._is_expired( entry ) == True:
+                del self._entries[ key ]
+                self._evict( key, entry )
+
+
+    #=========================================================================
+    def _get_link( self, key ):
+        """
+        Get the path of an entry's link to its result.
+        @param key      The entry's key
+        @return         The path of the link
+        """
+
+        return os.path.join( self._links, key )
+
+
+    #=========================================================================
+    def _is_expired( self, entry ):
+        """
+        Checks if an entry has expired.
+        @param entry    The entry
+        @return         True if the entry has expired
+        """
+
+        return ( entry[ 2 ] is not None ) and ( entry[ 2 ] <= time.time() )
+
+
+    #=========================================================================
+    def _trim( self ):
+        """
+        Evicts the least recently used entries until the cache's results fit
+        in its size limit.
+        """
+
+        while ( self._used > self.size ) and ( len( self._entries ) > 0 ):
+            ( key, entry ) = self._entries.popitem( last = False )
+            self._evict( key, entry )
+
+
+#=============================================================================
+def get_key( name, arguments ):
+    """
+    Builds the cache key of a task.
+    @param name         The task's name
+    @param arguments    The task's normalized arguments (see
+                        task.normalize_args())
+    @return             The key (string)
+    """
+
+    text = json.dumps( [ name, arguments ], sort_keys = True )
+    return hashlib.sha1( text ).hexdigest()
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp( prefix = 'aptask' )
+    store.clear( directory )
+    index = os.path.join( directory, 'cache.json' )
+
+    # cache the results of three tasks in room for two
+    results = Cache( directory, 2 * _BLOCK, path = index )
+    results.open()
+    keys = []
+    for number in range( 3 ):
+        path   = store.get_path( directory, str( number + 1 ), 'userkey' )
+        digest = store.put( directory, path, { 'number' : number } )
+        keys.append( get_key( 'Number', { 'number' : number } ) )
+        results.put( keys[ -1 ], digest, 'done' )
+        results.get( keys[ 0 ] )
+    print 'lookups:', [ results.get( key ) is not None for key in keys ]
+    print 'stats:', results.get_stats()
+
+    # the task links are gone after a restart, but cached results are kept
+    results.close()
+    store.clear( directory )
+    results = Cache( directory, 2 * _BLOCK, path = index )
+    results.open()
+    print 'reloaded:', [ results.get( key ) is not None for key in keys ]
+
+    # entries expire (and a cache that is not persistent starts empty)
+    results = Cache( directory, 2 * _BLOCK, ttl = 0.1 )
+    results.open()
+    print 'not persistent:', results.get( keys[ 2 ] )
+    path = store.get_path( directory, '1', 'userkey' )
+    results.put( keys[ 2 ], store.put( directory, path, 2 ), 'done' )
+    print 'expired before:', results.get( keys[ 2 ] ) is not None
+    time.sleep( 0.2 )
+    print 'expired after:', results.get( keys[ 2 ] ) is not None
+
+    shutil.rmtree( directory )
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
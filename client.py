@@ -5,10 +5,17 @@ aptask Development Client
 """
 
 
+import base64
 import json
 import socket
 
+import codec
 import configuration
+import frame
+
+
+#=============================================================================
+RECV_SIZE = 65536                   # size of each socket read
 
 
 #=============================================================================
@@ -19,15 +26,29 @@ class Client( object ):
 
 
     #=========================================================================
-    def __init__( self, address, key ):
+    def __init__( self, address, key, keepalive = False,
+        encoding = codec.JSON ):
         """
         Constructor.
-        @param address
+        @param address  The server's TCP address (tuple), or the path of its
+                        Unix domain socket (string)
         @param key
+        @param keepalive
+                        Set to keep one connection open for all requests
+        @param encoding The message encoding (see the codec module).  The
+                        binary encoding always keeps the connection open.
         """
 
-        self.address = address
-        self.key     = key
+        self.address   = address
+        self.key       = key
+        self.keepalive = keepalive or ( encoding != codec.JSON )
+        self.encoding  = encoding
+
+        # persistent connection state
+        self._sock      = None
+        self._reader    = None
+        self._next_id   = 1
+        self._responses = {}
 
 
     #=========================================================================
@@ -36,7 +57,36 @@ class Client( object ):
         Destructor.
         """
 
-        pass
+        self.close()
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Closes the persistent connection (if open).
+        """
+
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+    #=========================================================================
+    def batch( self, requests ):
+        """
+        Performs a list of requests in one round trip.  Requests that do not
+        specify a key use the client's key.
+        @param requests A list of request dicts
+        @return         The batch response (with a list of responses)
+        """
+
+        return self.request(
+            {
+                'key'      : self.key,
+                'request'  : 'batch',
+                'requests' : requests
+            }
+        )
 
 
     #=========================================================================
@@ -49,6 +99,16 @@ class Client( object ):
         return self.request( { 'key' : self.key, 'request' : 'active' } )
 
 
+    #=========================================================================
+    def get_stats( self ):
+        """
+        Retrieves server statistics (requires an admin key).
+        @return
+        """
+
+        return self.request( { 'key' : self.key, 'request' : 'stats' } )
+
+
     #=========================================================================
     def get_task_index( self ):
         """
@@ -59,6 +119,104 @@ class Client( object ):
         return self.request( { 'key' : self.key, 'request' : 'index' } )
 
 
+    #=========================================================================
+    def get_output( self, taskid, offset = 0, length = None ):
+        """
+        Retrieves a range of a task's output.
+        @param taskid
+        @param offset   The offset of the range (negative to count back from
+                        the end of the output)
+        @param length   The maximum size of the range (default is the
+                        server's default)
+        @return         The response (the data is always a byte string, and
+                        the next offset in the output is given in its "next"
+                        field)
+        """
+
+        request = {
+            'key'     : self.key,
+            'request' : 'output',
+            'taskid'  : taskid,
+            'offset'  : offset
+        }
+        if length is not None:
+            request[ 'length' ] = length
+        res = self.request( request )
+
+        # JSON responses carry the data as base64 text
+        if ( res is not None ) and ( 'data' in res ):
+            if self.encoding == codec.JSON:
+                res[ 'data' ] = base64.b64decode( res[ 'data' ] )
+        return res
+
+
+    #=========================================================================
+    def get_result( self, taskid, offset = 0, length = None ):
+        """
+        Retrieves a range of a task's result.
+        @param taskid
+        @param offset   The offset of the range
+        @param length   The maximum size of the range (default is the
+                        server's default)
+        @return         The response (the data is always a byte string, and
+                        the next offset in the result is given in its "next"
+                        field)
+        """
+
+        request = {
+            'key'     : self.key,
+            'request' : 'result',
+            'taskid'  : taskid,
+            'offset'  : offset
+        }
+        if length is not None:
+            request[ 'length' ] = length
+        res = self.request( request )
+
+        # JSON responses carry the data as base64 text
+        if ( res is not None ) and ( 'data' in res ):
+            if self.encoding == codec.JSON:
+                res[ 'data' ] = base64.b64decode( res[ 'data' ] )
+        return res
+
+
+    #=========================================================================
+    def get_response( self, request_id ):
+        """
+        Waits for the response to a request sent with send_request().
+        @param request_id
+                        The ID returned by send_request()
+        @return
+        """
+
+        # wait until the response with this ID has been received
+        while request_id not in self._responses:
+
+            try:
+                payload = self._sock.recv( RECV_SIZE )
+            except socket.timeout:
+                self.close()
+                print 'receive timed out'
+                return None
+
+            # the server closed the connection
+            if len( payload ) == 0:
+                self.close()
+                return None
+
+            # store every complete response by its request ID
+            self._reader.feed( payload )
+            for response in self._reader.frames():
+                try:
+                    res = codec.loads( response, self.encoding )
+                except ValueError:
+                    continue
+                self._responses[ res.get( 'id' ) ] = res
+
+        # return the response
+        return self._responses.pop( request_id )
+
+
     #=========================================================================
     def request( self, request ):
         """
@@ -67,27 +225,35 @@ class Client( object ):
         @return
         """
 
+        # persistent connections send the request, and wait for its response
+        if self.keepalive == True:
+            return self.get_response( self.send_request( request ) )
+
         if type( request ) is dict:
             request = json.dumps( request )
 
-        # create a TCP socket object
-        sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
-        sock.settimeout( 60.0 )
-        sock.connect( self.address )
+        # connect to the server
+        sock = self._connect()
 
         sock.sendall( request )
 
-        try:
-            response = sock.recv( 4096 )
-        except socket.timeout:
-            sock.close()
-            print 'receive timed out'
-            return None
+        # the server closes the connection after sending the response
+        chunks = []
+        while True:
+            try:
+                chunk = sock.recv( RECV_SIZE )
+            except socket.timeout:
+                sock.close()
+                print 'receive timed out'
+                return None
+            if len( chunk ) == 0:
+                break
+            chunks.append( chunk )
 
         sock.close()
 
         try:
-            res = json.loads( response )
+            res = json.loads( ''.join( chunks ) )
         except ValueError:
             return None
         else:
@@ -95,22 +261,90 @@ class Client( object ):
 
 
     #=========================================================================
-    def start_task( self, name, arguments ):
+    def resize( self, workers ):
+        """
+        Resizes the server's worker pool (requires an admin key).
+        @param workers  The number of worker processes, or 'auto'
+        @return         The response (with the new number of workers)
+        """
+
+        return self.request(
+            { 'key' : self.key, 'request' : 'resize', 'workers' : workers }
+        )
+
+
+    #=========================================================================
+    def send_request( self, request ):
+        """
+        Sends a request on the persistent connection without waiting for the
+        response.  Any number of requests may be sent before fetching their
+        responses with get_response().
+        @param request
+        @return         The ID assigned to the request
+        """
+
+        # open the persistent connection, and select framed mode
+        if self._sock is None:
+            self._sock = self._connect()
+            self._sock.sendall( self._get_handshake() )
+            self._reader = frame.FrameReader()
+
+        if type( request ) is not dict:
+            request = json.loads( request )
+
+        # assign an ID to match the response to this request
+        request_id = self._next_id
+        self._next_id += 1
+        request = dict( request, id = request_id )
+
+        self._sock.sendall(
+            frame.pack( codec.dumps( request, self.encoding ) )
+        )
+
+        return request_id
+
+
+    #=========================================================================
+    def start_task( self, name, arguments, priority = None ):
         """
         Requests the start of a task.
         @param name
         @param arguments
+        @param priority The task's priority (higher values start first)
         @return
         """
 
-        return self.request(
-            {
-                'key'       : self.key,
-                'request'   : 'start',
-                'name'      : name,
-                'arguments' : arguments
-            }
-        )
+        req = {
+            'key'       : self.key,
+            'request'   : 'start',
+            'name'      : name,
+            'arguments' : arguments
+        }
+        if priority is not None:
+            req[ 'priority' ] = priority
+        return self.request( req )
+
+
+    #=========================================================================
+    def start_tasks( self, name, argument_sets, priority = None ):
+        """
+        Requests the start of many instances of a task.
+        @param name
+        @param argument_sets
+                        A list of arguments (one per task)
+        @param priority The tasks' priority (higher values start first)
+        @return         The response (with a list of task IDs)
+        """
+
+        req = {
+            'key'       : self.key,
+            'request'   : 'start_many',
+            'name'      : name,
+            'arguments' : list( argument_sets )
+        }
+        if priority is not None:
+            req[ 'priority' ] = priority
+        return self.request( req )
 
 
     #=========================================================================
@@ -130,6 +364,72 @@ class Client( object ):
         )
 
 
+    #=========================================================================
+    def watch( self, taskids = None ):
+        """
+        Subscribes to task status updates.  The subscription uses its own
+        connection, and lasts until the generator is closed.
+        @param taskids  A list of task IDs to watch (default is all tasks)
+        @return         A generator of status updates (the first update
+                        contains the status of every watched task)
+        """
+
+        request = { 'key' : self.key, 'request' : 'watch' }
+        if taskids is not None:
+            request[ 'taskids' ] = list( taskids )
+
+        # connect to the server, select framed mode, and subscribe
+        sock = self._connect()
+        sock.settimeout( None )
+        sock.sendall( self._get_handshake() )
+        sock.sendall( frame.pack( codec.dumps( request, self.encoding ) ) )
+
+        reader = frame.FrameReader()
+
+        # deliver updates until the server hangs up or the caller stops
+        try:
+            while True:
+                payload = sock.recv( RECV_SIZE )
+                if len( payload ) == 0:
+                    break
+                reader.feed( payload )
+                for update in reader.frames():
+                    yield codec.loads( update, self.encoding )
+        finally:
+            sock.close()
+
+
+    #=========================================================================
+    def _connect( self ):
+        """
+        Opens a new connection to the server.
+        @return         The connected socket
+        """
+
+        # create a Unix domain socket object for local servers
+        if isinstance( self.address, basestring ) == True:
+            sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+
+        # create a TCP socket object
+        else:
+            sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        sock.settimeout( 60.0 )
+        sock.connect( self.address )
+        return sock
+
+
+    #=========================================================================
+    def _get_handshake( self ):
+        """
+        Selects the handshake for opening a framed connection.
+        @return         The handshake byte for the client's encoding
+        """
+
+        if self.encoding == codec.BINARY:
+            return frame.BINARY_HANDSHAKE
+        return frame.HANDSHAKE
+
+
 #=============================================================================
 def main( argv ):
     """
@@ -140,7 +440,10 @@ def main( argv ):
 
     config = configuration.load_configuration( 'aptaskd.json' )
 
-    address = ( 'localhost', config.get_address()[ 1 ] )
+    # prefer the local Unix domain socket, if the server provides one
+    address = config.get_socket_path()
+    if address is None:
+        address = ( 'localhost', config.get_address()[ 1 ] )
 
     client = Client( address, config.keys[ 'users' ][ 0 ] )
 
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+
+"""
+Message Encoding
+
+All messages are JSON text by default.  Framed connections may select a
+compact binary encoding instead (see the frame module).  The binary encoding
+is the subset of MessagePack needed to represent JSON data: nil, booleans,
+integers, floats, strings, arrays, and maps (binary strings are also
+decoded).  Any MessagePack implementation can be used to talk to the server.
+
+Binary data (such as task results) is given as buffer objects.  The binary
+encoding sends it as binary strings, and JSON sends it as base64 text.
+Binary data in a message encoded with dump_chunks() is never copied.
+
+Decoded strings are always unicode, the same as the json module.
+"""
+
+
+import base64
+import json
+import struct
+
+
+#=============================================================================
+JSON   = 0                          # JSON text encoding (the default)
+BINARY = 1                          # MessagePack binary encoding
+
+
+#=============================================================================
+_int8    = struct.Struct( '!b' )
+_int16   = struct.Struct( '!h' )
+_int32   = struct.Struct( '!i' )
+_int64   = struct.Struct( '!q' )
+_uint8   = struct.Struct( '!B' )
+_uint16  = struct.Struct( '!H' )
+_uint32  = struct.Struct( '!I' )
+_uint64  = struct.Struct( '!Q' )
+_float32 = struct.Struct( '!f' )
+_float64 = struct.Struct( '!d' )
+
+
+#=============================================================================
+def add_field( data, key, value, encoding = JSON ):
+    """
+    Adds a field to an encoded map without decoding the rest of the map.
+    This allows a large, pre-encoded message to be sent with a field that is
+    different for each recipient (such as a request ID).
+    @param data         The encoded map (must not contain the key)
+    @param key          The key of the field to add
+    @param value        The value of the field to add
+    @param encoding     The map's encoding (JSON or BINARY)
+    @return             The encoded map with the new field
+    """
+
+    # JSON objects have the new field inserted before the first field
+    if encoding == JSON:
+        field = '%s:%s' % ( json.dumps( key ), json.dumps( value ) )
+        if data.rstrip().endswith( '{}' ) == True:
+            return '{%s}' % field
+        return '{%s,%s' % ( field, data.lstrip()[ 1 : ] )
+
+    # binary maps have their size updated, and the new field inserted
+    field = dumps( key, encoding ) + dumps( value, encoding )
+    code  = ord( data[ 0 ] )
+    if ( code & 0xf0 ) == 0x80:
+        size   = ( code & 0x0f ) + 1
+        offset = 1
+    elif code == 0xde:
+        size   = _uint16.unpack_from( data, 1 )[ 0 ] + 1
+        offset = 3
+    elif code == 0xdf:
+        size   = _uint32.unpack_from( data, 1 )[ 0 ] + 1
+        offset = 5
+    else:
+        raise ValueError( 'encoded data is not a map' )
+    if size < 16:
+        header = _fixmap[ size ]
+    elif size < 0x10000:
+        header = '\xde' + _uint16.pack( size )
+    else:
+        header = '\xdf' + _uint32.pack( size )
+    return header + field + data[ offset : ]
+
+
+#=============================================================================
+def dumps( obj, encoding = JSON ):
+    """
+    Encodes a message.
+    @param obj          The message data (JSON-able types only)
+    @param encoding     The message encoding (JSON or BINARY)
+    @return             The encoded message (string)
+    @throws TypeError
+                        The message contains a type that can not be encoded
+    """
+
+    if encoding == JSON:
+        return json.dumps( obj, default = _encode_json )
+
+    # binary data is copied into the message (only when there is some)
+    chunks = dump_chunks( obj, encoding )
+    try:
+        return ''.join( chunks )
+    except TypeError:
+        return ''.join( str( chunk ) for chunk in chunks )
+
+
+#=============================================================================
+def dump_chunks( obj, encoding = JSON ):
+    """
+    Encodes a message as a list of chunks.  In the binary encoding, binary
+    data (buffer objects) are chunks of their own, so they are never copied.
+    @param obj          The message data (JSON-able types, and buffers)
+    @param encoding     The message encoding (JSON or BINARY)
+    @return             A list of encoded chunks (strings or buffers)
+    @throws TypeError
+                        The message contains a type that can not be encoded
+    """
+
+    if encoding == JSON:
+        return [ dumps( obj, encoding ) ]
+
+    chunks = []
+    _encode( obj, chunks.append )
+    return chunks
+
+
+#=============================================================================
+def loads( data, encoding = JSON ):
+    """
+    Decodes a message.
+    @param data         The encoded message (string)
+    @param encoding     The message encoding (JSON or BINARY)
+    @return             The message data
+    @throws ValueError
+                        The message can not be decoded
+    """
+
+    if encoding == JSON:
+        return json.loads( data )
+
+    # unhashable map keys raise TypeError, and deep nesting RuntimeError
+    try:
+        obj, offset = _decode( data, 0 )
+    except ( IndexError, struct.error, UnicodeDecodeError, TypeError,
+        RuntimeError ):
+        raise ValueError( 'truncated or invalid binary message' )
+    if offset != len( data ):
+        raise ValueError( 'extra data after binary message' )
+    return obj
+
+
+#=============================================================================
+_fixstr   = [ chr( 0xa0 | size ) for size in range( 32 ) ]
+_fixarray = [ chr( 0x90 | size ) for size in range( 16 ) ]
+_fixmap   = [ chr( 0x80 | size ) for size in range( 16 ) ]
+_fixint   = [ chr( value ) for value in range( 0x80 ) ]
+
+
+#=============================================================================
+def _encode( obj, write ):
+    """
+    Encodes one value in the binary encoding.
+    @param obj          The value to encode
+    @param write        Function that accepts each encoded chunk
+    """
+
+    kind = type( obj )
+
+    # strings (unicode strings are sent as UTF-8)
+    if ( kind is unicode ) or ( kind is str ):
+        if kind is unicode:
+            obj = obj.encode( 'utf-8' )
+        size = len( obj )
+        if size < 32:
+            write( _fixstr[ size ] + obj )
+        elif size < 0x100:
+            write( '\xd9' + chr( size ) + obj )
+        elif size < 0x10000:
+            write( '\xda' + _uint16.pack( size ) + obj )
+        else:
+            write( '\xdb' + _uint32.pack( size ) )
+            write( obj )
+
+    # binary data is written without copying
+    elif kind is buffer:
+        size = len( obj )
+        if size < 0x100:
+            write( '\xc4' + chr( size ) )
+        elif size < 0x10000:
+            write( '\xc5' + _uint16.pack( size ) )
+        else:
+            write( '\xc6' + _uint32.pack( size ) )
+        write( obj )
+
+    # nil and booleans (bool must be checked before int)
+    elif obj is None:
+        write( '\xc0' )
+    elif kind is bool:
+        write( '\xc3' if obj == True else '\xc2' )
+
+    # integers use the smallest representation
+    elif ( kind is int ) or ( kind is long ):
+        if obj >= 0:
+            if obj < 0x80:
+                write( _fixint[ obj ] )
+            elif obj < 0x100:
+                write( '\xcc' + chr( obj ) )
+            elif obj < 0x10000:
+                write( '\xcd' + _uint16.pack( obj ) )
+            elif obj < 0x100000000:
+                write( '\xce' + _uint32.pack( obj ) )
+            else:
+                write( '\xcf' + _uint64.pack( obj ) )
+        else:
+            if obj >= -32:
+                write( chr( obj & 0xff ) )
+            elif obj >= -0x80:
+                write( '\xd0' + _int8.pack( obj ) )
+            elif obj >= -0x8000:
+                write( '\xd1' + _int16.pack( obj ) )
+            elif obj >= -0x80000000:
+                write( '\xd2' + _int32.pack( obj ) )
+            else:
+                write( '\xd3' + _int64.pack( obj ) )
+
+    # floats are always sent with double precision
+    elif kind is float:
+        write( '\xcb' + _float64.pack( obj ) )
+
+    # arrays
+    elif ( kind is list ) or ( kind is tuple ):
+        size = len( obj )
+        if size < 16:
+            write( _fixarray[ size ] )
+        elif size < 0x10000:
+            write( '\xdc' + _uint16.pack( size ) )
+        else:
+            write( '\xdd' + _uint32.pack( size ) )
+        for item in obj:
+            _encode( item, write )
+
+    # maps (string keys are by far the most common, so they are inlined)
+    elif kind is dict:
+        size = len( obj )
+        if size < 16:
+            write( _fixmap[ size ] )
+        elif size < 0x10000:
+            write( '\xde' + _uint16.pack( size ) )
+        else:
+            write( '\xdf' + _uint32.pack( size ) )
+        for key, value in obj.iteritems():
+            if type( key ) is unicode:
+                key = key.encode( 'utf-8' )
+            if ( type( key ) is str ) and ( len( key ) < 32 ):
+                write( _fixstr[ len( key ) ] + key )
+            else:
+                _encode( key, write )
+            _encode( value, write )
+
+    # nothing else can be represented in JSON either
+    else:
+        raise TypeError( '%r can not be encoded' % obj )
+
+
+#=============================================================================
+def _encode_json( obj ):
+    """
+    Encodes values the json module does not support.
+    @param obj          The value to encode
+    @return             A JSON-able value (binary data as base64 text)
+    @throws TypeError
+                        The value can not be encoded
+    """
+
+    if type( obj ) is buffer:
+        return base64.b64encode( obj )
+    raise TypeError( '%r can not be encoded' % obj )
+
+
+#=============================================================================
+def _decode( data, offset ):
+    """
+    Decodes one value in the binary encoding.
+    @param data         The encoded data
+    @param offset       The offset of the value in the data
+    @return             A tuple of the value, and the offset after the value
+    """
+
+    code    = ord( data[ offset ] )
+    offset += 1
+
+    # positive fixint
+    if code < 0x80:
+        return code, offset
+
+    # fixmap, fixarray, and fixstr
+    if code < 0x90:
+        return _decode_map( data, offset, code & 0x0f )
+    if code < 0xa0:
+        return _decode_array( data, offset, code & 0x0f )
+    if code < 0xc0:
+        return _decode_str( data, offset, code & 0x1f )
+
+    # negative fixint
+    if code >= 0xe0:
+        return code - 0x100, offset
+
+    # nil and booleans
+    if code == 0xc0:
+        return None, offset
+    if code == 0xc2:
+        return False, offset
+    if code == 0xc3:
+        return True, offset
+
+    # formats with a fixed-size value or size field
+    if code not in _formats:
+        raise ValueError( 'unsupported binary type 0x%02x' % code )
+    ( field, handler ) = _formats[ code ]
+    value   = field.unpack_from( data, offset )[ 0 ]
+    offset += field.size
+    if handler is None:
+        return value, offset
+    return handler( data, offset, value )
+
+
+#=============================================================================
+def _decode_array( data, offset, size ):
+    """
+    Decodes the items of an array.
+    @param data         The encoded data
+    @param offset       The offset of the first item in the data
+    @param size         The number of items in the array
+    @return             A tuple of the list, and the offset after the array
+    """
+
+    items = []
+    for index in xrange( size ):
+        item, offset = _decode( data, offset )
+        items.append( item )
+    return items, offset
+
+
+#=============================================================================
+def _decode_bin( data, offset, size ):
+    """
+    Decodes the contents of a binary string.
+    @param data         The encoded data
+    @param offset       The offset of the contents in the data
+    @param size         The size of the string
+    @return             A tuple of the string, and the offset after the string
+    """
+
+    end = offset + size
+    if end > len( data ):
+        raise IndexError()
+    return data[ offset : end ], end
+
+
+#=============================================================================
+def _decode_map( data, offset, size ):
+    """
+    Decodes the entries of a map.
+    @param data         The encoded data
+    @param offset       The offset of the first entry in the data
+    @param size         The number of entries in the map
+    @return             A tuple of the dict, and the offset after the map
+    """
+
+    entries = {}
+    for index in xrange( size ):
+        key, offset   = _decode( data, offset )
+        value, offset = _decode( data, offset )
+        entries[ key ] = value
+    return entries, offset
+
+
+#=============================================================================
+def _decode_str( data, offset, size ):
+    """
+    Decodes the contents of a (UTF-8) string.
+    @param data         The encoded data
+    @param offset       The offset of the contents in the data
+    @param size         The size of the string
+    @return             A tuple of the string, and the offset after the string
+    """
+
+    value, offset = _decode_bin( data, offset, size )
+    return value.decode( 'utf-8' ), offset
+
+
+#=============================================================================
+_formats = {
+    0xc4 : ( _uint8,   _decode_bin ),
+    0xc5 : ( _uint16,  _decode_bin ),
+    0xc6 : ( _uint32,  _decode_bin ),
+    0xca : ( _float32, None ),
+    0xcb : ( _float64, None ),
+    0xcc : ( _uint8,   None ),
+    0xcd : ( _uint16,  None ),
+    0xce : ( _uint32,  None ),
+    0xcf : ( _uint64,  None ),
+    0xd0 : ( _int8,    None ),
+    0xd1 : ( _int16,   None ),
+    0xd2 : ( _int32,   None ),
+    0xd3 : ( _int64,   None ),
+    0xd9 : ( _uint8,   _decode_str ),
+    0xda : ( _uint16,  _decode_str ),
+    0xdb : ( _uint32,  _decode_str ),
+    0xdc : ( _uint16,  _decode_array ),
+    0xdd : ( _uint32,  _decode_array ),
+    0xde : ( _uint16,  _decode_map ),
+    0xdf : ( _uint32,  _decode_map )
+}
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    message = {
+        'status'   : 'ok',
+        'response' : 'active',
+        'active'   : [
+            {
+                'taskid'   : str( index ),
+                'state'    : 'running',
+                'position' : index,
+                'progress' : index / 10000.0,
+                'message'  : u'step \u2713 %d' % index,
+                'retry'    : None if index % 2 else -index * 1000000
+            } for index in range( 1000 )
+        ]
+    }
+
+    text   = dumps( message )
+    binary = dumps( message, BINARY )
+
+    print 'JSON size:', len( text )
+    print 'binary size:', len( binary )
+    print 'round trip:', loads( binary, BINARY ) == json.loads( text )
+
+    try:
+        loads( binary[ : -1 ], BINARY )
+    except ValueError as e:
+        print 'truncated:', e
+
+    for size in ( 0, 15, 0xffff ):
+        entries = dict( ( str( index ), index ) for index in range( size ) )
+        for encoding in ( JSON, BINARY ):
+            added = add_field( dumps( entries, encoding ), 'id', 7, encoding )
+            print 'add field (%d, %d):' % ( size, encoding ), \
+                loads( added, encoding ) == dict( entries, id = 7 )
+
+    # binary data (sent without copying, or as base64 text)
+    blob   = { 'data' : buffer( '\0\xff' * 200, 100 ) }
+    value  = str( blob[ 'data' ] )
+    binary = loads( dumps( blob, BINARY ), BINARY )[ 'data' ]
+    text   = base64.b64decode( loads( dumps( blob ) )[ 'data' ] )
+    print 'binary data:', binary == value, text == value
+    print 'binary chunks:', len( dump_chunks( blob, BINARY ) )
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
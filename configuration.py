@@ -27,6 +27,19 @@ def load_configuration( filename ):
     return config
 
 
+#=============================================================================
+def is_worker_count( value ):
+    """
+    Checks a worker pool size setting.
+    @param value        The number of worker processes, or 'auto'
+    @return             True if the setting is valid
+    """
+
+    if value == 'auto':
+        return True
+    return ( type( value ) in ( int, long ) ) and ( value >= 1 )
+
+
 #=============================================================================
 class Error( Exception ):
     """
@@ -58,8 +71,21 @@ class Configuration( object ):
 
 
     #=========================================================================
-    commands_admins = ()
-    commands_users  = ( 'index', 'start', 'stop', 'active' )
+    commands_admins = (
+        'stats',
+        'resize'
+    )
+    commands_users  = (
+        'index',
+        'start',
+        'stop',
+        'active',
+        'watch',
+        'batch',
+        'start_many',
+        'output',
+        'result'
+    )
 
 
     #=========================================================================
@@ -108,6 +134,31 @@ class Configuration( object ):
         return ( self._data[ 'host' ], self._data[ 'port' ] )
 
 
+    #=========================================================================
+    def get_addresses( self ):
+        """
+        """
+
+        addresses = []
+
+        if self._data[ 'port' ] is not None:
+            addresses.append( self.get_address() )
+
+        path = self.get_socket_path()
+        if path is not None:
+            addresses.append( path )
+
+        return addresses
+
+
+    #=========================================================================
+    def get_cache_file( self ):
+        """
+        """
+
+        return self.get_path( 'data' ) + os.sep + 'cache.json'
+
+
     #=========================================================================
     def get_log_file( self ):
         """
@@ -116,6 +167,14 @@ class Configuration( object ):
         return self.get_path( 'data' ) + os.sep + 'log.sqlite'
 
 
+    #=========================================================================
+    def get_output_path( self ):
+        """
+        """
+
+        return self.get_path( 'data' ) + os.sep + 'output'
+
+
     #=========================================================================
     def get_path( self, key ):
         """
@@ -134,6 +193,38 @@ class Configuration( object ):
         return script_dir + os.sep + base
 
 
+    #=========================================================================
+    def get_result_path( self ):
+        """
+        """
+
+        return self.get_path( 'data' ) + os.sep + 'results'
+
+
+    #=========================================================================
+    def get_snapshot_file( self ):
+        """
+        """
+
+        return self.get_path( 'data' ) + os.sep + 'status.snapshot'
+
+
+    #=========================================================================
+    def get_socket_path( self ):
+        """
+        """
+
+        path = self._data[ 'socket' ]
+
+        if len( path ) == 0:
+            return None
+
+        if path.startswith( '/' ) == True:
+            return path
+
+        return self.get_path( 'data' ) + os.sep + path
+
+
     #=========================================================================
     def get_task_index( self ):
         """
@@ -157,7 +248,9 @@ class Configuration( object ):
                         {
                             'name'      : symname,
                             'arguments' : ref.getargs(),
-                            'help'      : ref.gethelp()
+                            'help'      : ref.gethelp(),
+                            'mode'      : ref.mode,
+                            'cacheable' : ref.cacheable
                         }
                     )
 
@@ -256,6 +349,89 @@ class Configuration( object ):
         if 'loglevel' not in self._data:
             self._data[ 'loglevel' ] = 1
 
+        if 'backlog' not in self._data:
+            self._data[ 'backlog' ] = 1024
+
+        if 'netprocs' not in self._data:
+            self._data[ 'netprocs' ] = 1
+
+        if 'snapshotdelay' not in self._data:
+            self._data[ 'snapshotdelay' ] = 0.1
+
+        if 'maxrequest' not in self._data:
+            self._data[ 'maxrequest' ] = 1048576
+
+        if 'ratelimit' not in self._data:
+            self._data[ 'ratelimit' ] = 0
+
+        if 'rateburst' not in self._data:
+            self._data[ 'rateburst' ] = 10
+
+        if 'ratelimits' not in self._data:
+            self._data[ 'ratelimits' ] = {}
+
+        if 'maxqueue' not in self._data:
+            self._data[ 'maxqueue' ] = 0
+
+        if 'workers' not in self._data:
+            self._data[ 'workers' ] = 'auto'
+
+        if is_worker_count( self._data[ 'workers' ] ) == False:
+            raise VerificationError()
+
+        if 'workertasks' not in self._data:
+            self._data[ 'workertasks' ] = 100
+
+        if 'weights' not in self._data:
+            self._data[ 'weights' ] = {}
+
+        for weight in self._data[ 'weights' ].values():
+            if weight <= 0:
+                raise VerificationError()
+
+        if 'workerlimit' not in self._data:
+            self._data[ 'workerlimit' ] = 0
+
+        if 'workerlimits' not in self._data:
+            self._data[ 'workerlimits' ] = {}
+
+        if 'hostthreads' not in self._data:
+            self._data[ 'hostthreads' ] = 64
+
+        if 'hosttasks' not in self._data:
+            self._data[ 'hosttasks' ] = 1024
+
+        if 'statusinterval' not in self._data:
+            self._data[ 'statusinterval' ] = 0.1
+
+        if 'outputsize' not in self._data:
+            self._data[ 'outputsize' ] = 1048576
+
+        if 'outputfiles' not in self._data:
+            self._data[ 'outputfiles' ] = 1024
+
+        if 'resultfiles' not in self._data:
+            self._data[ 'resultfiles' ] = 1024
+
+        if 'cachesize' not in self._data:
+            self._data[ 'cachesize' ] = 268435456
+
+        if 'cachettl' not in self._data:
+            self._data[ 'cachettl' ] = 3600.0
+
+        if 'cachepersist' not in self._data:
+            self._data[ 'cachepersist' ] = False
+
+        if 'ringsize' not in self._data:
+            self._data[ 'ringsize' ] = 4194304
+
+        if 'socket' not in self._data:
+            self._data[ 'socket' ] = ''
+
+        if ( self._data[ 'port' ] is None ) \
+            and ( self._data[ 'socket' ] == '' ):
+            raise VerificationError()
+
 
 #=============================================================================
 def main( argv ):
@@ -273,7 +449,7 @@ def main( argv ):
         'separators' : ( ',', ' : ' )
     }
 
-    print json.dumps( conf.get_address(), **pp )
+    print json.dumps( conf.get_addresses(), **pp )
 
     print json.dumps( conf.get_task_index(), **pp )
 
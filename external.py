@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+
+"""
+External Program Task Interface
+
+Provides a task driver base class for running an external program.  The
+program's output (stdout and stderr) is read without blocking the worker, and
+each line is checked for progress information, either with the built-in line
+protocol:
+
+    @aptask progress 0.42
+    @aptask message Compressing archive
+
+or with the regular expressions given by a child class.  A pattern may use
+these named groups:
+
+    progress            Progress from 0.0 to 1.0
+    percent             Progress from 0 to 100
+    done, total         Progress as a count of steps
+    message             A message for the task's status report
+
+The program's output is also written to the task's output (see the output
+module), unless a child class turns this off.
+
+Tasks are stopped by sending SIGTERM to the program, followed by SIGKILL if it
+does not exit in time.  The same escalation enforces an optional time limit.
+
+External programs spend their time in their own processes, so these tasks are
+executed in threads of a host process by default (see the host module).
+"""
+
+
+import errno
+import fcntl
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+import poller
+import task
+
+
+#=============================================================================
+PREFIX = '@aptask '                 # prefix of line protocol messages
+
+_read_size = 65536                  # maximum bytes read from a pipe at once
+
+
+#=============================================================================
+class ExternalTask( task.Task ):
+    """
+    Runs an external program as a task.  Child classes set the command
+    attribute to the program's argument list (or override get_command() to
+    build it from the task's arguments), and may set these attributes:
+        patterns        Regular expressions that extract progress or
+                        messages from output lines
+        timeout         Time limit for the program (seconds, 0 for none)
+        kill_delay      Time between SIGTERM and SIGKILL (seconds)
+        poll            Maximum time process() waits for output (seconds,
+                        cooperative mode tasks never wait)
+        echo            Set to copy the program's output to the task's output
+    The program's exit status is reported in the final status message.
+    """
+
+
+    #=========================================================================
+    mode       = task.Task.THREAD
+    command    = None
+    patterns   = []
+    timeout    = 0.0
+    kill_delay = 5.0
+    poll       = 0.1
+    echo       = True
+
+
+    #=========================================================================
+    def __init__( self, arguments = None ):
+        """
+        Constructor.
+        @param arguments
+                        Argument values requested for task execution
+        """
+
+        super( ExternalTask, self ).__init__( arguments )
+
+        self._patterns = [ re.compile( p ) for p in self.patterns ]
+
+        # the program, its output pipes (with partial lines read from them,
+        #   and the names of the streams their output is copied to)
+        self._proc    = None
+        self._pipes   = {}
+        self._started = None
+
+        # the reason the program is being stopped, and when to kill it
+        self._reason    = None
+        self._kill_time = None
+
+
+    #=========================================================================
+    def abort( self ):
+        """
+        Asks the program to stop.  The task is done when the program exits.
+        @return         The task's status report
+        """
+
+        self._stop( 'aborted' )
+        return self.report
+
+
+    #=========================================================================
+    def get_command( self ):
+        """
+        Builds the program's argument list.
+        @return         A list of the program and its arguments
+        """
+
+        return list( self.command )
+
+
+    #=========================================================================
+    def initialize( self ):
+        """
+        Starts the program.
+        @return         The task's status report
+        """
+
+        # programs that can not be started finish right away
+        try:
+            with open( os.devnull, 'rb' ) as null:
+                self._proc = subprocess.Popen(
+                    self.get_command(),
+                    stdin     = null,
+                    stdout    = subprocess.PIPE,
+                    stderr    = subprocess.PIPE,
+                    close_fds = True
+                )
+        except OSError as e:
+            self.report.status  = task.Report.DONE
+            self.report.message = 'unable to start: %s' % e.strerror
+            return self.report
+        self._started = time.time()
+
+        # read output without blocking
+        pipes = { 'stdout' : self._proc.stdout, 'stderr' : self._proc.stderr }
+        for stream, pipe in pipes.items():
+            flags = fcntl.fcntl( pipe, fcntl.F_GETFL )
+            fcntl.fcntl( pipe, fcntl.F_SETFL, flags | os.O_NONBLOCK )
+            self._pipes[ pipe.fileno() ] = [ pipe, '', stream ]
+
+        self.report.status = task.Report.RUNNING
+        return self.report
+
+
+    #=========================================================================
+    def process( self ):
+        """
+        Reads the program's output (waiting at most the poll time), and
+        checks if it has exited.
+        @return         The task's status report
+        """
+
+        # cooperative tasks share their thread, so they must not wait
+        if self.mode == task.Task.COOPERATIVE:
+            self._read( 0.0 )
+        else:
+            self._read( self.poll )
+
+        # report the program's exit once its output has been read
+        code = self._proc.poll()
+        if code is not None:
+            while len( self._pipes ) > 0:
+                if self._read( 0.0 ) == False:
+                    break
+            self._finish( code )
+            return self.report
+
+        # enforce the time limit, and kill programs that ignore SIGTERM
+        now = time.time()
+        if ( self.timeout > 0.0 ) and ( now > self._started + self.timeout ):
+            self._stop( 'timed out' )
+        if ( self._kill_time is not None ) and ( now >= self._kill_time ):
+            self._signal( signal.SIGKILL )
+            self._kill_time = None
+
+        return self.report
+
+
+    #=========================================================================
+    def _finish( self, code ):
+        """
+        Reports the end of the program.
+        @param code     The program's exit status (negative for a signal)
+        """
+
+        for pipe, partial, stream in self._pipes.values():
+            if len( partial ) > 0:
+                self._parse( partial )
+            pipe.close()
+        self._pipes = {}
+
+        if self._reason is not None:
+            self.report.message = self._reason
+        elif code < 0:
+            self.report.message = 'killed by signal %d' % -code
+        elif code > 0:
+            self.report.message = 'exited with status %d' % code
+        else:
+            self.report.progress = 1.0
+        self.report.status = task.Report.DONE
+
+
+    #=========================================================================
+    def _parse( self, line ):
+        """
+        Updates the status report from a line of output.
+        @param line     The line (without its line ending)
+        """
+
+        # line protocol messages
+        if line.startswith( PREFIX ) == True:
+            content = line[ len( PREFIX ) : ].strip()
+            ( field, _, value ) = content.partition( ' ' )
+            if field == 'progress':
+                self._set_progress( value )
+            elif field == 'message':
+                self.report.message = value
+            return
+
+        # the first matching pattern is used
+        for pattern in self._patterns:
+            match = pattern.search( line )
+            if match is None:
+                continue
+            groups = match.groupdict()
+            if groups.get( 'progress' ) is not None:
+                self._set_progress( groups[ 'progress' ] )
+            elif groups.get( 'percent' ) is not None:
+                self._set_progress( groups[ 'percent' ], 100.0 )
+            elif ( groups.get( 'done' ) is not None ) \
+                and ( groups.get( 'total' ) is not None ):
+                self._set_progress( groups[ 'done' ], groups[ 'total' ] )
+            if groups.get( 'message' ) is not None:
+                self.report.message = groups[ 'message' ]
+            break
+
+
+    #=========================================================================
+    def _read( self, timeout ):
+        """
+        Reads and parses the available output.
+        @param timeout  Maximum time to wait for output (seconds)
+        @return         True if any output (or the end of it) was read
+        """
+
+        # programs may close their output, and keep running
+        if len( self._pipes ) == 0:
+            time.sleep( timeout )
+            return False
+
+        # hosts run many tasks, so the pipes may be beyond the reach of
+        #   select()
+        try:
+            ready = poller.wait( self._pipes.keys(), timeout )
+        except IOError as e:
+            if poller.is_interrupt( e ) == True:
+                return False
+            raise
+
+        for fd in ready:
+            try:
+                data = os.read( fd, _read_size )
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    continue
+                raise
+
+            # the program closed its end of the pipe
+            entry = self._pipes[ fd ]
+            if len( data ) == 0:
+                if len( entry[ 1 ] ) > 0:
+                    self._parse( entry[ 1 ] )
+                entry[ 0 ].close()
+                del self._pipes[ fd ]
+                continue
+
+            # copy the output (the stream is looked up each time, because the
+            #   task's output may be redirected)
+            if self.echo == True:
+                getattr( sys, entry[ 2 ] ).write( data )
+
+            # parse complete lines (progress bars often end lines with '\r')
+            lines = ( entry[ 1 ] + data ).replace( '\r', '\n' ).split( '\n' )
+            entry[ 1 ] = lines.pop()
+            for line in lines:
+                self._parse( line )
+
+        return len( ready ) > 0
+
+
+    #=========================================================================
+    def _set_progress( self, value, total = 1.0 ):
+        """
+        Sets the reported progress.
+        @param value    The amount of progress (string or number)
+        @param total    The amount of progress when the task is complete
+        """
+
+        try:
+            progress = float( value ) / float( total )
+        except ( ValueError, ZeroDivisionError ):
+            return
+        self.report.progress = min( 1.0, max( 0.0, progress ) )
+
+
+    #=========================================================================
+    def _signal( self, signum ):
+        """
+        Sends a signal to the program.
+        @param signum   The signal number
+        """
+
+        try:
+            os.kill( self._proc.pid, signum )
+        except OSError:
+            pass
+
+
+    #=========================================================================
+    def _stop( self, reason ):
+        """
+        Asks the program to stop, and schedules killing it if it does not.
+        @param reason   The reason reported in the final status message
+        """
+
+        if ( self._reason is not None ) or ( self._proc is None ):
+            return
+        self._reason    = reason
+        self._kill_time = time.time() + self.kill_delay
+        self._signal( signal.SIGTERM )
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    class Example( ExternalTask ):
+        command  = [
+            sys.executable,
+            '-c',
+            'import time\n'
+            'for i in range( 1, 6 ):\n'
+            '    print "step %d of 5" % i\n'
+            '    time.sleep( 0.1 )\n'
+            'print "@aptask message all done"\n'
+        ]
+        patterns = [ r'step (?P<done>\d+) of (?P<total>\d+)' ]
+
+    # run the program to completion
+    tsk    = Example()
+    report = tsk.initialize()
+    while report.is_done() == False:
+        report = tsk.process()
+        print report.status, report.progress, report.message
+
+    # stop a program that ignores SIGTERM
+    Example.command    = [
+        sys.executable,
+        '-c',
+        'import signal, time\n'
+        'signal.signal( signal.SIGTERM, signal.SIG_IGN )\n'
+        'time.sleep( 60 )\n'
+    ]
+    Example.kill_delay = 0.5
+    tsk    = Example()
+    report = tsk.initialize()
+    time.sleep( 0.5 )
+    start  = time.time()
+    report = tsk.abort()
+    while report.is_done() == False:
+        report = tsk.process()
+    print 'stopped in %.1f s:' % ( time.time() - start ), report.message
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    sys.exit( main( sys.argv ) )
@@ -1,79 +1,179 @@
 #!/usr/bin/env python
 
 """
-Worker/Task FIFO Queue
+Worker/Task Queue
+
+Free worker slots are shared fairly between the auth keys that have tasks
+waiting (see the scheduler module).  Each key's tasks are started in order of
+priority, and tasks with the same priority are started in the order they were
+added (first-come, first-served).  A task that has been started keeps its
+worker slot until it is removed, even if a task with a higher priority is
+added later.
+
+Tasks that are executed in host processes (see the host module) use their
+own lanes of worker slots, so thousands of waiting thread tasks do not hold
+up the tasks that need a worker process (or the other way around).
 """
 
 
 import raqueue
+import scheduler
+import task
 
 
 #=============================================================================
 class WorkerFIFO( raqueue.RandomAccessQueue ):
     """
-    Implements a FIFO queue to ensure first-come, first-served task execution.
-    Additionally, this allows random access to all items in the queue to allow
-    a user to check on status, and execute multiple simultaneous tasks without
-    removing them from the queue.
+    Implements a fair-share queue with first-come, first-served task
+    execution within each key's priority.  Additionally, this allows random
+    access to all items in the queue to allow a user to check on status, and
+    execute multiple simultaneous tasks without removing them from the queue.
     """
 
 
     #=========================================================================
-    def __init__( self, num_procs = 1 ):
+    def __init__( self, num_procs = 1, sched = None ):
         """
         Constructor.
         @param num_procs
                         Maximum number of concurrent worker processes
+        @param sched    Scheduler of waiting tasks (default is an unweighted
+                        FairScheduler)
         """
 
         super( WorkerFIFO, self ).__init__()
 
-        self._iter     = 0
-        self.num_procs = num_procs
-        self.fifo      = []
+        self._iter = None
+
+        # task IDs that hold a worker slot (in the order they were started)
+        self.active = []
+
+        # worker slots by execution mode (tasks in process mode use the
+        #   worker processes)
+        self.lanes = {}
+        self.add_lane( task.Task.PROCESS, num_procs, sched )
 
 
     #=========================================================================
     def __iter__( self ):
         """
-        Iterator protocol support.
+        Iterator protocol support.  Workers are visited in no particular
+        order (use get_task_ids() for the queue order).
         @return         Iterable object
         """
 
-        self._iter = 0
+        self._iter = iter( self.keys() )
         return self
 
 
     #=========================================================================
-    def add( self, wrkr ):
+    def add( self, wrkr, priority = 0 ):
         """
         Add a worker to the queue.
         @param wrkr     Worker object to enqueue
+        @param priority The task's priority (higher values start first)
         @return         Assigned task ID
         """
 
         # enqueue the worker object
         task_id = super( WorkerFIFO, self ).add( wrkr )
 
-        # append the ID to the end of the queue
-        self.fifo.append( task_id )
+        # queue the ID, and give it a slot if one is free
+        lane = self._get_lane( wrkr )
+        lane.pending.push( task_id, wrkr.authkey, priority )
+        self._fill( lane )
 
         # return the task ID for this worker object
         return task_id
 
 
+    #=========================================================================
+    def add_lane( self, mode, size, sched = None ):
+        """
+        Adds (or replaces) the worker slots used by tasks in an execution
+        mode.  Tasks in modes without a lane use the worker processes.
+        @param mode     The execution mode (see task.Task)
+        @param size     Maximum number of concurrent tasks in the mode
+        @param sched    Scheduler of waiting tasks (default is an unweighted
+                        FairScheduler)
+        """
+
+        if sched is None:
+            sched = scheduler.FairScheduler()
+        self.lanes[ mode ] = _Lane( size, sched )
+
+
+    #=========================================================================
+    def add_many( self, workers, priority = 0 ):
+        """
+        Add a list of workers to the queue in one pass.
+        @param workers  List of worker objects to enqueue
+        @param priority The tasks' priority (higher values start first)
+        @return         List of assigned task IDs (in the same order)
+        """
+
+        # enqueue the worker objects
+        task_ids = [
+            super( WorkerFIFO, self ).add( wrkr ) for wrkr in workers
+        ]
+
+        # queue the IDs, and fill any free slots
+        lanes = set()
+        for task_id, wrkr in zip( task_ids, workers ):
+            lane = self._get_lane( wrkr )
+            lane.pending.push( task_id, wrkr.authkey, priority )
+            lanes.add( lane )
+        for lane in lanes:
+            self._fill( lane )
+
+        # return the task IDs for the worker objects
+        return task_ids
+
+
+    #=========================================================================
+    def get_running( self, mode = task.Task.PROCESS ):
+        """
+        Get the number of active tasks in an execution mode.
+        @param mode     The execution mode (see task.Task)
+        @return         Number of tasks holding a worker slot in the mode
+        """
+
+        return self.lanes[ mode ].running
+
+
+    #=========================================================================
+    def get_size( self, mode = task.Task.PROCESS ):
+        """
+        Get the number of worker slots for an execution mode.
+        @param mode     The execution mode (see task.Task)
+        @return         Maximum number of concurrent tasks in the mode
+        """
+
+        return self.lanes[ mode ].size
+
+
     #=========================================================================
     def get_task_ids( self, active = False ):
         """
         Get list of task IDs in the queue.
         @param active   Set this option to only retrieve active task IDs
-        @return         A list of task IDs in the queue
+        @return         A list of task IDs in the queue (active tasks first,
+                        then waiting tasks in the order they will start in
+                        each lane)
         """
 
         if active == True:
-            return self.fifo[ : self.num_procs ]
+            return list( self.active )
 
-        return list( self.fifo )
+        # tasks waiting for worker processes are listed first
+        task_ids = list( self.active )
+        modes    = sorted(
+            self.lanes,
+            key = lambda mode: ( mode != task.Task.PROCESS, mode )
+        )
+        for mode in modes:
+            task_ids.extend( self.lanes[ mode ].pending.get_keys() )
+        return task_ids
 
 
     #=========================================================================
@@ -83,12 +183,10 @@ class WorkerFIFO( raqueue.RandomAccessQueue ):
         @return         Next worker in queue
         """
 
-        if self._iter >= len( self.fifo ):
+        if self._iter is None:
             raise StopIteration
 
-        task_id = self.fifo[ self._iter ]
-        self._iter += 1
-        return self[ task_id ]
+        return self[ next( self._iter ) ]
 
 
     #=========================================================================
@@ -99,27 +197,102 @@ class WorkerFIFO( raqueue.RandomAccessQueue ):
         @return         The worker object that was removed
         """
 
-        # the default assumption is to remove the oldest worker (index = 0)
+        # the default assumption is to remove the oldest active worker
         if task_id is None:
-            index = 0
-
-        # if the ID is specified, we have to search the queue for the index
-        else:
-            try:
-                index = self.fifo.index( task_id )
-            except ValueError:
+            task_ids = self.get_task_ids()
+            if len( task_ids ) == 0:
                 return None
+            task_id = task_ids[ 0 ]
 
-        # remove the worker from the queue
-        try:
-            task_id = self.fifo.pop( index )
-        except IndexError:
+        # make sure the task is in the queue
+        wrkr = self[ task_id ]
+        if wrkr is None:
             return None
+        lane = self._get_lane( wrkr )
+
+        # active tasks are searched (there are at most as many of them as
+        #   there are worker slots)
+        if task_id in self.active:
+            self.active.remove( task_id )
+            lane.running -= 1
+            lane.pending.release( wrkr.authkey )
+
+        # waiting tasks are removed from the heap
+        elif lane.pending.remove( task_id ) is None:
+            return None
+
+        # give the free slot to the next waiting task
+        self._fill( lane )
 
         # dequeue the worker object
         return super( WorkerFIFO, self ).remove( task_id )
 
 
+    #=========================================================================
+    def resize( self, size, mode = task.Task.PROCESS ):
+        """
+        Change the maximum number of concurrent tasks in an execution mode.
+        When the number is reduced, active tasks keep running, and no more
+        tasks are started until enough of them are done.
+        @param size     Maximum number of concurrent tasks (for process mode,
+                        the number of concurrent worker processes)
+        @param mode     The execution mode (see task.Task)
+        """
+
+        lane = self.lanes[ mode ]
+        lane.size = size
+        self._fill( lane )
+
+
+    #=========================================================================
+    def _fill( self, lane ):
+        """
+        Moves the highest priority waiting tasks into free worker slots.
+        @param lane     The lane with free slots
+        """
+
+        while lane.running < lane.size:
+            task_id = lane.pending.pop()
+            if task_id is None:
+                break
+            self.active.append( task_id )
+            lane.running += 1
+
+
+    #=========================================================================
+    def _get_lane( self, wrkr ):
+        """
+        Get the worker slots used by a worker's task.
+        @param wrkr     The worker object
+        @return         The worker's lane
+        """
+
+        lane = self.lanes.get( wrkr.mode )
+        if lane is None:
+            lane = self.lanes[ task.Task.PROCESS ]
+        return lane
+
+
+#=============================================================================
+class _Lane( object ):
+    """
+    Worker slots, and the tasks waiting for them, for one execution mode.
+    """
+
+
+    #=========================================================================
+    def __init__( self, size, sched ):
+        """
+        Constructor.
+        @param size     Maximum number of concurrent tasks
+        @param sched    Scheduler of waiting tasks
+        """
+
+        self.size    = size
+        self.running = 0
+        self.pending = sched
+
+
 #=============================================================================
 def main( argv ):
     """
@@ -128,24 +301,39 @@ def main( argv ):
     @return             Exit code (0 = success)
     """
 
+    import collections
+
+    Worker = collections.namedtuple( 'Worker', 'authkey mode' )
+    def stub( authkey, mode = task.Task.PROCESS ):
+        return Worker( authkey, mode )
+
     queue = WorkerFIFO( 4 )
 
-    print 'initial queue:', queue.queue
-    queue.add( object() )
-    print 'adding one:', queue.queue
-    queue.add( object() )
-    queue.add( object() )
-    print 'adding two:', queue.queue
+    print 'initial queue:', queue.get_task_ids()
+    queue.add( stub( 'a' ) )
+    print 'adding one:', queue.get_task_ids()
+    queue.add( stub( 'a' ) )
+    queue.add( stub( 'a' ) )
+    print 'adding two:', queue.get_task_ids()
     queue.remove( '2' )
-    print 'removing second:', queue.queue
-    queue.add( object() )
-    queue.add( object() )
-    queue.add( object() )
-    queue.add( object() )
-    queue.add( object() )
-    queue.add( object() )
-    print 'adding six:', queue.queue
+    print 'removing second:', queue.get_task_ids()
+    queue.add_many( [ stub( 'a' ) ] * 4 )
+    queue.add( stub( 'a' ), priority = 5 )
+    queue.add_many( [ stub( 'b' ) ] * 3 )
+    print 'adding eight:', queue.get_task_ids()
+    print 'active only:', queue.get_task_ids( active = True )
+    queue.remove( '1' )
+    queue.remove( '3' )
+    print 'removing two:', queue.get_task_ids()
     print 'active only:', queue.get_task_ids( active = True )
+    queue.resize( 2 )
+    queue.remove( '4' )
+    print 'shrinking to two:', queue.get_task_ids( active = True )
+    queue.resize( 6 )
+    print 'growing to six:', queue.get_task_ids( active = True )
+    queue.add_lane( task.Task.THREAD, 2 )
+    queue.add_many( [ stub( 'c', task.Task.THREAD ) ] * 3 )
+    print 'adding threads:', queue.get_task_ids( active = True )
 
     # return success
     return 0
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+"""
+Message Framing
+
+Implements the length-prefixed framing used by persistent (keep-alive)
+connections.  A client selects framed mode by sending a single handshake byte
+as the first byte on a new connection.  The handshake byte also selects the
+encoding of the connection's messages (JSON or binary, see the codec module).
+After that, every request and response is sent as a frame: a four-byte,
+big-endian payload length followed by the payload itself.  Connections that do
+not start with a handshake byte use the original one-shot (one request, one
+response) protocol.  The end of a one-shot request is found by scanning the
+JSON text for the end of the top-level value.
+"""
+
+
+import re
+import struct
+
+import codec
+
+
+#=============================================================================
+HANDSHAKE        = '\x01'           # handshake byte for framed connections
+BINARY_HANDSHAKE = '\x02'           # handshake byte for binary connections
+HEADER           = struct.Struct( '!I' )    # frame header (payload length)
+
+# encoding selected by each handshake byte
+HANDSHAKES = {
+    HANDSHAKE        : codec.JSON,
+    BINARY_HANDSHAKE : codec.BINARY
+}
+
+
+#=============================================================================
+class FrameError( Exception ):
+    """
+    Exception raised when a frame can not be accepted from a stream.
+    """
+
+    pass
+
+
+#=============================================================================
+class JSONScanner( object ):
+    """
+    Incrementally finds the end of the first JSON object (or array) in a
+    stream of received data.  Text that does not start with an object or
+    array is considered complete as soon as it is received (the request
+    parser will reject it).
+    """
+
+
+    #=========================================================================
+    _tokens = re.compile( r'[\[\]{}"\\]' )
+
+
+    #=========================================================================
+    def __init__( self, max_size = None ):
+        """
+        Constructor.
+        @param max_size Maximum size of the JSON text (None for unlimited)
+        """
+
+        self.chunks   = []
+        self.size     = 0
+        self.max_size = max_size
+        self.started  = False
+        self.end      = None
+        self._depth   = 0
+        self._string  = False
+        self._escaped = None
+
+
+    #=========================================================================
+    def feed( self, data ):
+        """
+        Adds received data, and scans it for the end of the JSON value.
+        @param data     Data received from the stream
+        @return         True if the JSON value is complete
+        @throws FrameError
+                        The JSON text exceeds the maximum size
+        """
+
+        # nothing more to scan once the value is complete
+        if self.end is not None:
+            return True
+
+        # absolute stream offset of the new data
+        base = self.size
+        self.chunks.append( data )
+        self.size += len( data )
+
+        # wait for the first meaningful character
+        if self.started == False:
+            stripped = data.lstrip()
+            if len( stripped ) == 0:
+                return False
+            self.started = True
+            if stripped[ 0 ] not in '{[':
+                self.end = self.size
+                return True
+
+        # scan the structural characters in the new data
+        for match in self._tokens.finditer( data ):
+            offset = base + match.start()
+            char   = match.group()
+
+            # characters escaped within a string have no meaning
+            if offset == self._escaped:
+                continue
+
+            # track strings (and escapes within strings)
+            if self._string == True:
+                if char == '\\':
+                    self._escaped = offset + 1
+                elif char == '"':
+                    self._string = False
+            elif char == '"':
+                self._string = True
+
+            # track nesting of objects and arrays
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = offset + 1
+                    return True
+
+        # check the incomplete text against the limit
+        if ( self.max_size is not None ) and ( self.size > self.max_size ):
+            raise FrameError( 'request exceeds %d bytes' % self.max_size )
+
+        # the value is not complete
+        return False
+
+
+    #=========================================================================
+    def get_text( self ):
+        """
+        Retrieves the scanned JSON text.
+        @return         The complete value's text (or all received data if
+                        the value is not complete)
+        """
+
+        text = ''.join( self.chunks )
+        if self.end is not None:
+            return text[ : self.end ]
+        return text
+
+
+#=============================================================================
+class FrameReader( object ):
+    """
+    Incrementally extracts complete frames from a stream of received data.
+    """
+
+
+    #=========================================================================
+    def __init__( self, max_size = None ):
+        """
+        Constructor.
+        @param max_size Maximum payload size to accept (None for unlimited)
+        """
+
+        self.buffer   = ''
+        self.max_size = max_size
+
+
+    #=========================================================================
+    def feed( self, data ):
+        """
+        Adds received data to the stream buffer.
+        @param data     Data received from the stream
+        """
+
+        self.buffer += data
+
+
+    #=========================================================================
+    def frames( self ):
+        """
+        Extracts all complete frames from the stream buffer.
+        @return         A list of frame payloads (may be empty)
+        @throws FrameError
+                        A frame exceeds the maximum payload size
+        """
+
+        # list of complete payloads
+        payloads = []
+
+        # offset of the next frame header in the buffer
+        offset = 0
+
+        # extract frames while there is at least a complete header
+        while ( len( self.buffer ) - offset ) >= HEADER.size:
+
+            # read the payload length from the header
+            size = HEADER.unpack_from( self.buffer, offset )[ 0 ]
+
+            # check the payload size against the limit
+            if ( self.max_size is not None ) and ( size > self.max_size ):
+                raise FrameError( 'frame exceeds %d bytes' % self.max_size )
+
+            # check for a complete payload
+            end = offset + HEADER.size + size
+            if end > len( self.buffer ):
+                break
+
+            # extract the payload
+            payloads.append( self.buffer[ offset + HEADER.size : end ] )
+            offset = end
+
+        # discard all consumed data
+        if offset > 0:
+            self.buffer = self.buffer[ offset : ]
+
+        # return the list of complete payloads
+        return payloads
+
+
+#=============================================================================
+def pack( payload ):
+    """
+    Builds a frame for sending a payload.
+    @param payload      The payload data (string)
+    @return             The framed payload (string)
+    """
+
+    return HEADER.pack( len( payload ) ) + payload
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    reader = FrameReader( 64 )
+
+    stream = pack( 'hello' ) + pack( '' ) + pack( 'world' )
+
+    # feed the stream one byte at a time to exercise partial frames
+    payloads = []
+    for byte in stream:
+        reader.feed( byte )
+        payloads.extend( reader.frames() )
+
+    print 'frames:', payloads
+
+    reader.feed( pack( 'x' * 65 ) )
+    try:
+        reader.frames()
+    except FrameError as e:
+        print 'oversize:', e
+
+    scanner = JSONScanner()
+    for chunk in ( ' {"a":"}\\', '"{", "b" : [ 1', ', { } ] }trailing' ):
+        print 'scan %r:' % chunk, scanner.feed( chunk )
+    print 'text:', scanner.get_text()
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
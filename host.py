@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+
+"""
+Task Host Processes
+
+Tasks that spend most of their time waiting (on files, sockets, or other
+programs) do not need a worker process of their own.  A task class declares
+how it is executed with its mode attribute (see task.Task).  Tasks in thread
+mode run in threads of a shared host process.  Tasks in cooperative mode take
+turns in a single thread of a shared host process: each turn checks the
+task's connection for commands, and calls its process() method once, so
+process() must return without blocking.
+
+Each hosted task has its own connection and status slot, exactly like a task
+in a worker process.  The daemon creates them, and passes the host's ends to
+the host process (as file descriptors) along with the task descriptor.  Each
+task's output written through sys.stdout and sys.stderr is captured in its own
+file (see the output module).  The daemon's side of a hosted task (a Lane)
+provides the same interface as a worker process, so the Worker object controls
+the task the same way.
+"""
+
+
+import multiprocessing
+import multiprocessing.reduction
+import os
+import threading
+import traceback
+
+import _multiprocessing
+
+import output
+import poller
+import pool
+import slot
+import task
+import worker
+
+
+#=============================================================================
+_parent_poll = 1.0                  # time between checks for the parent
+
+
+#=============================================================================
+class Host( object ):
+    """
+    Starts hosted tasks in a host process.  The host process is started when
+    it is first needed, and restarted if it exits.
+    """
+
+
+    #=========================================================================
+    def __init__( self, mode, zygote = None ):
+        """
+        Constructor.
+        @param mode     The execution mode of the hosted tasks (see task.Task)
+        @param zygote   The forkserver that starts host processes (None to
+                        start them from this process)
+        """
+
+        self.mode    = mode
+        self.zygote  = zygote
+        self.process = None
+
+        # lifetime counters
+        self.started = 0
+        self.crashed = 0
+
+        # number of lanes in use by each host process
+        self._lanes = {}
+
+
+    #=========================================================================
+    def acquire( self ):
+        """
+        Creates the execution lane for a new hosted task.
+        @return         The lane (used as the task's worker process)
+        """
+
+        # start (or restart) the host process
+        if ( self.process is None ) or ( self.process.is_alive() == False ):
+            if self.process is not None:
+                self.crashed += 1
+                self._release_process( self.process )
+            self.process = self._spawn()
+
+        self._lanes[ self.process ] += 1
+        return Lane( self.process )
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Stops the host process.  Tasks still running in it are stopped with
+        it.
+        """
+
+        if self.process is not None:
+            self.process.close()
+            self.process.join()
+            del self._lanes[ self.process ]
+            self.process = None
+
+
+    #=========================================================================
+    def get_stats( self ):
+        """
+        Get the host's statistics.
+        @return         A dict of task and process counts
+        """
+
+        return {
+            'tasks'   : sum( self._lanes.values() ),
+            'started' : self.started,
+            'crashed' : self.crashed
+        }
+
+
+    #=========================================================================
+    def release( self, lane ):
+        """
+        Releases the execution lane of a finished task.
+        @param lane     The lane
+        """
+
+        lane.close()
+        self._lanes[ lane.host ] -= 1
+        if lane.host is not self.process:
+            self._release_process( lane.host )
+
+
+    #=========================================================================
+    def _release_process( self, process ):
+        """
+        Stops tracking a host process that is being replaced.  The process
+        is joined once none of its lanes are in use.
+        @param process  The host process
+        """
+
+        if self._lanes[ process ] == 0:
+            del self._lanes[ process ]
+            process.join()
+
+
+    #=========================================================================
+    def _spawn( self ):
+        """
+        Starts a new host process.
+        @return         The host process
+        """
+
+        if self.zygote is not None:
+            process = self.zygote.fork( self.mode )
+        else:
+            process = pool.Process( self.mode )
+            process.start()
+        self._lanes[ process ] = 0
+        self.started += 1
+        return process
+
+
+#=============================================================================
+class Lane( object ):
+    """
+    The daemon's side of a hosted task.  This provides the same interface as
+    a pool.Process for the task's Worker object.
+    """
+
+
+    #=========================================================================
+    def __init__( self, host ):
+        """
+        Constructor.
+        @param host     The host process
+        """
+
+        self.host = host
+
+        # the task's connection and status slot, and the host's exit sentinel
+        ( self.conn, self._child ) = multiprocessing.Pipe( True )
+        self.slot     = slot.Slot()
+        self.sentinel = host.sentinel
+        self.tasks    = 0
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Releases the lane's connection and status slot.
+        """
+
+        if self._child is not None:
+            self._child.close()
+            self._child = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            self.slot.close()
+
+
+    #=========================================================================
+    def is_alive( self ):
+        """
+        Check to see if the host process is still running.
+        @return         True if the host process has not exited
+        """
+
+        return self.host.is_alive()
+
+
+    #=========================================================================
+    def run_task( self, descriptor ):
+        """
+        Sends a task, and the host's ends of its connection and status slot,
+        to the host process.
+        @param descriptor
+                        Task execution descriptor
+        """
+
+        self.tasks += 1
+        try:
+            self.host.conn.send( descriptor )
+            multiprocessing.reduction.send_handle(
+                self.host.conn,
+                self._child.fileno(),
+                None
+            )
+            multiprocessing.reduction.send_handle(
+                self.host.conn,
+                self.slot.fileno(),
+                None
+            )
+        except ( IOError, OSError ):
+            pass
+
+        # only the host needs its end of the connection
+        self._child.close()
+        self._child = None
+
+
+#=============================================================================
+def serve( conn, mode ):
+    """
+    Function to execute as a host process.
+    @param conn         Control connection to the daemon (receives tasks)
+    @param mode         The execution mode of the hosted tasks
+    """
+
+    # the parent may exit without asking
+    parent = os.getppid()
+
+    # send each task's output to its capture
+    output.install()
+
+    # cooperative tasks as [ connection, status slot, steps, capture ] lists
+    tasks = []
+
+    while True:
+
+        # give each cooperative task a turn, and find out how long the
+        #   host can wait for commands before the next turn
+        timeout = _parent_poll
+        for entry in list( tasks ):
+            output.select( entry[ 3 ] )
+            try:
+                timeout = min( timeout, next( entry[ 2 ] ) )
+            except StopIteration:
+                _finish( entry[ 0 ], entry[ 1 ], entry[ 3 ] )
+                tasks.remove( entry )
+            except:
+                traceback.print_exc()
+                _finish( entry[ 0 ], entry[ 1 ], entry[ 3 ] )
+                tasks.remove( entry )
+        output.select( None )
+
+        # wait for a new task, or a command for a cooperative task
+        try:
+            ready = poller.wait(
+                [ conn ] + [ entry[ 0 ] for entry in tasks ],
+                timeout
+            )
+        except IOError as e:
+            if poller.is_interrupt( e ) == True:
+                continue
+            raise
+        if conn not in ready:
+            if ( len( ready ) == 0 ) and ( os.getppid() != parent ):
+                break
+            continue
+
+        # receive the next task (None asks the host to exit)
+        try:
+            message = conn.recv()
+            if message is None:
+                break
+            task_conn = _multiprocessing.Connection(
+                multiprocessing.reduction.recv_handle( conn )
+            )
+            task_slot = slot.Slot(
+                fd = multiprocessing.reduction.recv_handle( conn )
+            )
+        except ( EOFError, IOError ):
+            break
+
+        # start the task
+        if mode == task.Task.COOPERATIVE:
+            tasks.append(
+                [
+                    task_conn,
+                    task_slot,
+                    worker.execute( task_conn, task_slot, message ),
+                    output.create( message )
+                ]
+            )
+        else:
+            thread = threading.Thread(
+                target = _run_thread,
+                args   = ( task_conn, task_slot, message )
+            )
+            thread.daemon = True
+            thread.start()
+
+
+#=============================================================================
+def _finish( conn, status_slot, capture = None ):
+    """
+    Reports that a hosted task is finished, and releases its resources.
+    @param conn         The task's connection
+    @param status_slot  The task's status slot
+    @param capture      The task's output capture (None if not captured)
+    """
+
+    if capture is not None:
+        capture.close()
+    try:
+        conn.send( None )
+    except ( IOError, OSError ):
+        pass
+    conn.close()
+    status_slot.close()
+
+
+#=============================================================================
+def _run_thread( conn, status_slot, descriptor ):
+    """
+    Executes a task in a host process' thread.
+    @param conn         The task's connection
+    @param status_slot  The task's status slot
+    @param descriptor   Task execution descriptor
+    """
+
+    capture = output.create( descriptor )
+    output.select( capture )
+    try:
+        worker.worker( conn, status_slot, descriptor )
+    except:
+        traceback.print_exc()
+    output.select( None )
+    _finish( conn, status_slot, capture )
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import time
+
+    # DevTask blocks in process(), so it is hosted in threads
+    hst = Host( task.Task.THREAD )
+
+    # start a batch of tasks, then stop them
+    start   = time.time()
+    workers = []
+    for index in range( 50 ):
+        wrkr = worker.Worker(
+            worker.create_task_descriptor( 'DevTask', { 'devarg' : index } ),
+            mode = task.Task.THREAD
+        )
+        wrkr.start( hst.acquire() )
+        workers.append( wrkr )
+    for wrkr in workers:
+        wrkr.stop()
+    for wrkr in workers:
+        wrkr.join()
+        hst.release( wrkr.process )
+    print '%d tasks: %s (%.1f ms)' % (
+        len( workers ),
+        workers[ -1 ].get_status().message,
+        ( time.time() - start ) * 1000.0
+    )
+    print 'stats:', hst.get_stats()
+    hst.close()
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
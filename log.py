@@ -5,6 +5,7 @@ Event Log Interface
 """
 
 
+import contextlib
 import sqlite3
 
 import data
@@ -87,6 +88,7 @@ class Log( object ):
         self.db.row_factory = sqlite3.Row
         self.is_open        = True
         self.max_level      = max_level
+        self._transactions  = 0
         self._check_schema()
 
 
@@ -125,7 +127,8 @@ class Log( object ):
             """ % self.table_name,
             ( event.message, event.level, event.authkey )
         )
-        self.db.commit()
+        if self._transactions == 0:
+            self.db.commit()
 
 
     #=========================================================================
@@ -208,6 +211,22 @@ class Log( object ):
         return events
 
 
+    #=========================================================================
+    @contextlib.contextmanager
+    def transaction( self ):
+        """
+        Groups all events appended within a "with" block into one commit.
+        """
+
+        self._transactions += 1
+        try:
+            yield self
+        finally:
+            self._transactions -= 1
+            if self._transactions == 0:
+                self.db.commit()
+
+
     #=========================================================================
     def _check_schema( self ):
         """
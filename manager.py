@@ -7,14 +7,36 @@ Provides the top-level control and tracking of long-running worker processes.
 """
 
 
+import collections
+import heapq
 import json
+import multiprocessing
+import os
+import time
 
+import cache
+import codec
+import configuration
 import fifo
+import host
 import log
+import output
+import pool
 import request
+import scheduler
+import snapshot
+import store
+import task
 import worker
 
 
+#=============================================================================
+AUTO_INTERVAL = 10.0                # time between automatic pool resizes
+
+_publish_share = 0.1                # maximum share of the daemon's time spent
+                                    #   publishing status snapshots
+
+
 #=============================================================================
 class Manager( object ):
     """
@@ -24,22 +46,83 @@ class Manager( object ):
 
 
     #=========================================================================
-    def __init__( self, config, logger ):
+    def __init__( self, config, logger, zygote = None ):
         """
         Constructor.
         @param config
         @param logger
+        @param zygote   The forkserver that starts worker processes (optional)
         """
 
+        self.cache      = None
         self.config     = config
+        self.hosts      = {}
         self.log        = logger
+        self.net_stats  = {}
+        self.pool       = pool.Pool( config.workertasks, zygote )
+        self.snapshot   = None
+        self.task_args  = {}
         self.task_index = []
+        self.task_modes = {}
         self.task_names = []
-        self.workers    = fifo.WorkerFIFO()
+        self.task_cache = set()
+        self.timers     = []
+        self.workers    = fifo.WorkerFIFO(
+            sched = scheduler.FairScheduler(
+                config.weights,
+                config.workerlimit,
+                config.workerlimits
+            )
+        )
+        self.zygote     = zygote
+
+        # tasks in thread and cooperative modes run in host processes
+        sizes = {
+            task.Task.THREAD      : config.hostthreads,
+            task.Task.COOPERATIVE : config.hosttasks
+        }
+        for mode, size in sizes.items():
+            self.hosts[ mode ] = host.Host( mode, zygote )
+            self.workers.add_lane(
+                mode,
+                size,
+                scheduler.FairScheduler( config.weights )
+            )
+
+        self._auto_workers   = False
+        self._auto_timer     = False
+        self._cache_keys     = {}
+        self._finished       = collections.deque( maxlen = 256 )
+        self._finished_seq   = 0
+        self._outputs        = collections.deque()
+        self._results        = collections.deque()
+        self._snapshot_dirty = True
+        self._snapshot_cost  = 0.0
+        self._snapshot_time  = 0.0
+        self._snapshot_timer = False
+        self._startup        = [ 0, 0.0, 0.0 ]
+        self._timer_seq      = 0
 
         self._update_environment()
 
 
+    #=========================================================================
+    def call_later( self, delay, function, *args ):
+        """
+        Schedules a function to be called from process() after a delay.
+        @param delay    Time to wait before calling the function (seconds)
+        @param function The function to call
+        @param *args    Arguments to pass to the function
+        """
+
+        # the sequence number keeps timers due at the same time in order
+        self._timer_seq += 1
+        heapq.heappush(
+            self.timers,
+            ( time.time() + delay, self._timer_seq, function, args )
+        )
+
+
     #=========================================================================
     def get_active( self, authkey = None ):
         """
@@ -49,8 +132,544 @@ class Manager( object ):
         @return         A list of dicts describing the active tasks
         """
 
+        return [
+            report for owner, report in self._get_reports()
+                if ( authkey is None ) or ( owner == authkey )
+        ]
+
+
+    #=========================================================================
+    def get_timeout( self ):
+        """
+        Determines how long the manager can wait before process() must be
+        called again, assuming nothing returned by get_waitables() is ready.
+        @return         Time until the next timer is due (None for no timers)
+        """
+
+        # workers waiting to be started need attention now
+        for task_id in self.workers.get_task_ids( active = True ):
+            if self.workers[ task_id ].state == worker.Worker.INIT:
+                return 0.0
+
+        # wait until the nearest timer is due
+        if len( self.timers ) > 0:
+            return max( 0.0, self.timers[ 0 ][ 0 ] - time.time() )
+
+        # nothing is scheduled
+        return None
+
+
+    #=========================================================================
+    def get_waitables( self ):
+        """
+        Retrieves the objects that become readable when a worker needs
+        attention (status updates and process exits).
+        @return         A list of objects or descriptors to wait on
+        """
+
+        waitables = []
+        for wrkr in self.workers:
+            waitables.extend( wrkr.get_waitables() )
+        return waitables
+
+
+    #=========================================================================
+    def handle_request( self, string, encoding = codec.JSON ):
+        """
+        Handles outside requests for task execution, control, and updates.
+        @param string   An encoded request string
+        @param encoding The encoding of the request and response (see the
+                        codec module, the default is JSON)
+        @return         An encoded response string
+        """
+
+        # parse request
+        req = request.Request( string, encoding )
+
+        # binary requests are logged as JSON
+        if encoding != codec.JSON:
+            if req.get_message() is not None:
+                string = req.get_message()
+            else:
+                string = repr( string )
+
+        # log the request and response in one transaction
+        with self.log.transaction():
+
+            # handle the request
+            res = self._handle( req, string )
+
+            # pipelined requests are matched to responses by the request ID
+            if req.id is not None:
+                res[ 'id' ] = req.id
+
+            # format the response
+            response = codec.dumps( res, encoding )
+
+            # log the response
+            if encoding == codec.JSON:
+                self.log.log( log.RESPONSE, response )
+            else:
+                self._log( log.RESPONSE, res )
+
+        # return a formatted response
+        return response
+
+
+    #=========================================================================
+    def process( self ):
+        """
+        Method to periodically invoke to keep the task manager current.
+        """
+
+        # service all the status queues to keep them from filling up
+        for wrkr in self.workers:
+
+            # i happen to know the worker object caches his status internally
+            previous = wrkr.status
+            if wrkr.get_status() is not previous:
+                self._snapshot_status_changed()
+
+        # get all active task ids
+        task_ids = self.workers.get_task_ids( active = True )
+
+        # iterate over active tasks
+        for task_id in task_ids:
+
+            # get worker object for this task ID
+            wrkr = self.workers[ task_id ]
+
+            # look for workers that can be started (should be abstracted)
+            if wrkr.state == worker.Worker.INIT:
+                wrkr.start(
+                    self._acquire( wrkr ),
+                    self._get_output( task_id, wrkr ),
+                    self._get_result( task_id, wrkr )
+                )
+                self._snapshot_dirty = True
+                self.log.log( log.TASKING, 'starting task %s' % task_id )
+
+            # look for workers that have been stopped
+            elif wrkr.state == worker.Worker.STOPPING:
+
+                # let the worker take its time shutting down
+                if wrkr.is_alive() == False:
+                    wrkr.join()
+                    self._retire( task_id )
+                    self.log.log( log.TASKING, 'stopping task %s' % task_id )
+
+            # look for active worker status transitions
+            else:
+
+                # get latest status
+                status = wrkr.get_status()
+
+                # look for workers that are done and should be removed
+                if ( status is not None ) and ( status.is_done() == True ):
+                    wrkr.join()
+                    self._retire( task_id )
+                    self.log.log( log.TASKING, 'stopping task %s' % task_id )
+
+                # look for workers that exited without finishing
+                elif wrkr.is_alive() == False:
+                    wrkr.join()
+                    self._retire( task_id )
+                    self.log.log(
+                        log.SERVER_ERROR,
+                        'task %s exited unexpectedly' % task_id
+                    )
+
+        # call all timers that are due
+        now = time.time()
+        while ( len( self.timers ) > 0 ) and ( self.timers[ 0 ][ 0 ] <= now ):
+            deadline, seq, function, args = heapq.heappop( self.timers )
+            function( *args )
+
+
+    #=========================================================================
+    def publish_snapshot( self ):
+        """
+        Publishes a new status snapshot for the network processes if the
+        task table has changed.  The daemon calls this after handling
+        requests, and before sending their responses, so a client sees the
+        effect of its own requests (unless a snapshot was published less than
+        a snapshot delay period ago, see below).
+        @return         True if a new snapshot was published
+        """
+
+        # nothing to publish (or no publisher)
+        if ( self._snapshot_dirty == False ) or ( self.snapshot is None ):
+            return False
+
+        # each snapshot serializes the whole task table, so snapshots are
+        #   published at most once per snapshot delay period, and the period
+        #   grows with the time taken to publish (changes made during the
+        #   period are published together when it ends)
+        period = max(
+            self.config.snapshotdelay,
+            self._snapshot_cost / _publish_share
+        )
+        start = time.time()
+        delay = self._snapshot_time + period - start
+        if delay > 0.0:
+            if self._snapshot_timer == False:
+                self._snapshot_timer = True
+                self.call_later( delay, self._snapshot_timeout )
+            return False
+
+        # pre-serialize the active task lists of each auth key
+        everything = []
+        by_key     = {}
+        for owner, report in self._get_reports():
+            everything.append( report )
+            by_key.setdefault( owner, [] ).append( report )
+
+        # publish the snapshot
+        self.snapshot.publish(
+            {
+                'index'  : json.dumps(
+                    {
+                        'status'   : 'ok',
+                        'response' : 'index',
+                        'index'    : self.task_index
+                    }
+                ),
+                'all'    : json.dumps( everything ),
+                'active' : dict(
+                    ( k, json.dumps( v ) )
+                        for k, v in by_key.items()
+                            if k is not None
+                ),
+                'finished' : list( self._finished ),
+                'queued'   : len( self.workers )
+            }
+        )
+
+        self._snapshot_dirty = False
+        self._snapshot_time  = time.time()
+        self._snapshot_cost  = self._snapshot_time - start
+        return True
+
+
+    #=========================================================================
+    def resize( self, workers ):
+        """
+        Changes the maximum number of concurrent worker processes.  Queued and
+        running tasks are not affected, except that more (or fewer) of them
+        may run at once.
+        @param workers  The number of worker processes, or 'auto' to size the
+                        pool from the number of CPUs and the system load
+        @return         The new number of worker processes
+        """
+
+        # automatic sizing is checked again periodically
+        if workers == 'auto':
+            self._auto_workers = True
+            workers = self._get_auto_size()
+            if self._auto_timer == False:
+                self._auto_timer = True
+                self.call_later( AUTO_INTERVAL, self._auto_resize )
+        else:
+            self._auto_workers = False
+
+        # resize the pool (this may start queued tasks)
+        self.pool.resize( workers )
+        if workers != self.workers.get_size():
+            self.workers.resize( workers )
+            self._snapshot_dirty = True
+            self.log.log(
+                log.TASKING,
+                'resizing worker pool to %d' % workers
+            )
+
+        return workers
+
+
+    #=========================================================================
+    def set_net_stats( self, stats ):
+        """
+        Stores the statistics reported by a network process.
+        @param stats    The statistics dict (including the process' shard)
+        """
+
+        self.net_stats[ stats[ 'shard' ] ] = stats
+
+
+    #=========================================================================
+    def start( self ):
+        """
+        Method to call before task management needs to begin.
+        """
+
+        # the result cache is loaded first, so the results it keeps survive
+        #   clearing the result store
+        if self.config.cachepersist == True:
+            path = self.config.get_cache_file()
+        else:
+            path = None
+        self.cache = cache.Cache(
+            self.config.get_result_path(),
+            self.config.cachesize,
+            self.config.cachettl,
+            path
+        )
+        self.cache.open()
+
+        # task IDs start over, so output files and results from a previous
+        #   run are removed
+        output.clear( self.config.get_output_path() )
+        store.clear( self.config.get_result_path() )
+
+        # size the worker pool
+        self.resize( self.config.workers )
+
+        # create the status snapshot publisher, and publish the first one
+        self.snapshot = snapshot.Writer( self.config.get_snapshot_file() )
+        self.publish_snapshot()
+
+
+    #=========================================================================
+    def stop( self ):
+        """
+        Method to call when task management needs to stop.
+        """
+
+        # get a copy of task IDs
+        task_ids = self.workers.get_task_ids()
+
+        # iterate over all task_ids in queue
+        for task_id in task_ids:
+
+            # get worker object for this task ID
+            wrkr = self.workers.get( task_id )
+
+            # check if this worker is active
+            if wrkr.is_active() == True:
+                wrkr.stop()
+
+            # worker is inactive
+            else:
+                self.workers.remove( task_id )
+
+        # get current copy of task IDs
+        task_ids = self.workers.get_task_ids()
+
+        # iterate over remaining task IDs
+        for task_id in task_ids:
+
+            # get worker object for this task ID
+            wrkr = self.workers.get( task_id )
+
+            # block until this worker is shut down
+            wrkr.join()
+
+            # remove worker from queue, and release its process
+            self.workers.remove( task_id )
+            self._release( wrkr )
+
+        # stop the worker and host processes
+        self.pool.close()
+        for hst in self.hosts.values():
+            hst.close()
+
+        # stop publishing status snapshots
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+        # save the result cache
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+    #=========================================================================
+    def _acquire( self, wrkr ):
+        """
+        Gets the process that will execute a worker's task.
+        @param wrkr     The worker object
+        @return         A worker process from the pool, or a lane of a host
+                        process (for tasks in thread or cooperative mode)
+        """
+
+        if wrkr.mode in self.hosts:
+            return self.hosts[ wrkr.mode ].acquire()
+        return self.pool.acquire()
+
+
+    #=========================================================================
+    def _auto_resize( self ):
+        """
+        Timer function that resizes the worker pool when it is sized
+        automatically.
+        """
+
+        self._auto_timer = False
+        if self._auto_workers == True:
+            self.resize( 'auto' )
+
+
+    #=========================================================================
+    def _batch( self, req, string ):
+        """
+        Handles a batch of requests.
+        @param req      The batch request object
+        @param string   The batch request string
+        @return         The response dict
+        """
+
+        # make sure the batch is a list of requests
+        if type( req.requests ) is not list:
+            self._log( log.CLIENT_ERROR, string, req.key )
+            return {
+                'status'   : 'error',
+                'response' : 'batch',
+                'message'  : 'invalid request list'
+            }
+
+        # handle each request in order
+        responses = []
+        for sub in req.requests:
+
+            # batches can not be nested, or contain subscriptions
+            if ( type( sub ) is not dict ) \
+                or ( sub.get( 'request' ) in ( 'batch', 'watch' ) ):
+                responses.append(
+                    { 'status' : 'error', 'message' : 'invalid request' }
+                )
+                continue
+
+            # requests use the batch's auth key unless they specify one
+            if 'key' not in sub:
+                sub = dict( sub, key = req.key )
+
+            # handle the request
+            res = self._handle( request.Request( sub ), sub )
+            if 'id' in sub:
+                res[ 'id' ] = sub[ 'id' ]
+            responses.append( res )
+
+        # return the list of responses
+        return {
+            'status'    : 'ok',
+            'response'  : 'batch',
+            'responses' : responses
+        }
+
+
+    #=========================================================================
+    def _finish( self, task_id, authkey, report ):
+        """
+        Records the final report of a task for status subscribers, and
+        applies the result retention limit.
+        @param task_id  The task's ID
+        @param authkey  The task owner's auth key
+        @param report   The task's final report dict
+        """
+
+        self._finished_seq += 1
+        self._finished.append(
+            {
+                'seq'     : self._finished_seq,
+                'authkey' : authkey,
+                'report'  : report
+            }
+        )
+
+        # remove the oldest results beyond the retention limit
+        if report.get( 'result' ) is not None:
+            directory = self.config.get_result_path()
+            self._results.append(
+                (
+                    store.get_path( directory, task_id, authkey ),
+                    report[ 'result' ]
+                )
+            )
+            limit = self.config.resultfiles
+            while ( limit > 0 ) and ( len( self._results ) > limit ):
+                store.remove( directory, *self._results.popleft() )
+
+        # the task table has changed
+        self._snapshot_dirty = True
+
+
+    #=========================================================================
+    def _get_auto_size( self ):
+        """
+        Determines the number of worker processes from the number of CPUs and
+        the system load.  CPUs kept busy by other programs are not used (the
+        load caused by this pool's own workers does not count).
+        @return         The number of worker processes (at least 1)
+        """
+
+        cpus = multiprocessing.cpu_count()
+        try:
+            load = os.getloadavg()[ 0 ]
+        except OSError:
+            load = 0.0
+        running = self.workers.get_running()
+        other   = max( 0.0, load - running )
+        return max( 1, cpus - int( round( other ) ) )
+
+
+    #=========================================================================
+    def _get_cache_key( self, name, arguments ):
+        """
+        Get the result cache key of a task.
+        @param name     The task's name
+        @param arguments
+                        The requested arguments
+        @return         The cache key, or None if the task's result is not
+                        cached (or the arguments are not valid)
+        """
+
+        if ( self.config.cachesize <= 0 ) or ( name not in self.task_cache ):
+            return None
+
+        # requests that give the same arguments in different ways (or leave
+        #   out defaults) share a key (the arguments are checked against the
+        #   task index, so task modules are not imported by the daemon)
+        arguments = task.normalize_args( self.task_args[ name ], arguments )
+        if arguments is None:
+            return None
+        try:
+            return cache.get_key( name, arguments )
+        except ( TypeError, ValueError ):
+            return None
+
+
+    #=========================================================================
+    def _get_output( self, task_id, wrkr ):
+        """
+        Get the output capture settings for a task.
+        @param task_id  The task's ID
+        @param wrkr     The worker object
+        @return         A tuple of the path of the task's output file, and
+                        its maximum size (None if output is not captured)
+        """
+
+        if self.config.outputsize <= 0:
+            return None
+
+        return (
+            output.get_path(
+                self.config.get_output_path(),
+                task_id,
+                wrkr.authkey
+            ),
+            self.config.outputsize
+        )
+
+
+    #=========================================================================
+    def _get_reports( self ):
+        """
+        Builds the current status reports of all tasks in the queue.
+        @return         A list of ( authkey, report dict ) pairs
+        """
+
         # set up a list to populate
-        active = []
+        reports = []
 
         # set up a queue position index
         position = -1
@@ -67,60 +686,131 @@ class Manager( object ):
             # get worker object for this task ID
             wrkr = self.workers[ task_id ]
 
-            # check to see if this worker is for the given auth key
-            if ( authkey is not None ) and ( wrkr.authkey != authkey ):
+            # build the report, and add it to the list
+            report = self._get_report( task_id, wrkr )
+            report[ 'position' ] = position
+            reports.append( ( wrkr.authkey, report ) )
+
+        # return worker status list
+        return reports
 
-                # do not report on other user's tasks
-                continue
 
-            # get the most recent task status
-            status = wrkr.get_status()
+    #=========================================================================
+    def _get_report( self, task_id, wrkr ):
+        """
+        Builds the current status report of a task.
+        @param task_id  The task's ID
+        @param wrkr     The task's worker object
+        @return         A dict describing the task
+        """
 
-            # make sure the worker has a status to report
-            if status is not None:
+        # get the most recent task status
+        status = wrkr.get_status()
 
-                # get a copy of the report object as a dictionary
-                report = status.__getstate__()
+        # make sure the worker has a status to report
+        if status is not None:
 
-            # the worker does not have a meaningful status to report
-            else:
-                report = {}
+            # get a copy of the report object as a dictionary
+            report = status.__getstate__()
 
-            # add position, process state, and task ID
-            report[ 'position' ] = position
-            report[ 'taskid' ]   = task_id
-            if wrkr.is_active() == True:
-                report[ 'state' ] = 'active'
-            else:
-                report[ 'state' ] = 'inactive'
+        # the worker does not have a meaningful status to report
+        else:
+            report = {}
 
-            # add status to list
-            active.append( report )
+        # add process state and task ID
+        report[ 'taskid' ] = task_id
+        if wrkr.is_active() == True:
+            report[ 'state' ] = 'active'
+        else:
+            report[ 'state' ] = 'inactive'
 
-        # return worker status list
-        return active
+        # return the report
+        return report
 
 
     #=========================================================================
-    def handle_request( self, string ):
+    def _get_result( self, task_id, wrkr ):
         """
-        Handles outside requests for task execution, control, and updates.
-        @param string   A JSON-formatted request string
-        @return         A JSON-formatted response string
+        Get the result store settings for a task.
+        @param task_id  The task's ID
+        @param wrkr     The worker object
+        @return         A tuple of the path of the result store, and the path
+                        of the task's link to its result
         """
 
-        # parse request
-        req = request.Request( string )
+        directory = self.config.get_result_path()
+        return (
+            directory,
+            store.get_path( directory, task_id, wrkr.authkey )
+        )
+
+
+    #=========================================================================
+    def _get_stats( self ):
+        """
+        Builds the server statistics response.
+        @return         The response dict
+        """
+
+        # total the requests rejected by every network process
+        rejected = {}
+        for stats in self.net_stats.values():
+            for key, counts in stats[ 'rejected' ].items():
+                totals = rejected.setdefault( key, {} )
+                for reason, count in counts.items():
+                    totals[ reason ] = totals.get( reason, 0 ) + count
+
+        # average the startup latency of finished tasks
+        ( count, total, maximum ) = self._startup
+        startup = {
+            'tasks' : count,
+            'mean'  : ( total / count ) if count > 0 else None,
+            'max'   : maximum if count > 0 else None
+        }
+
+        # describe the host processes
+        hosts = {}
+        for mode, hst in self.hosts.items():
+            hosts[ mode ] = hst.get_stats()
+            hosts[ mode ][ 'size' ] = self.workers.get_size( mode )
+
+        return {
+            'status'   : 'ok',
+            'response' : 'stats',
+            'startup'  : startup,
+            'tasks'    : {
+                'active'   : len( self.workers ),
+                'finished' : self._finished_seq
+            },
+            'rejected' : rejected,
+            'workers'  : dict(
+                self.pool.get_stats(),
+                size = self.workers.get_size(),
+                auto = self._auto_workers
+            ),
+            'hosts'    : hosts,
+            'cache'    : self.cache.get_stats()
+        }
+
+
+    #=========================================================================
+    def _handle( self, req, string ):
+        """
+        Handles a parsed request.
+        @param req      The request object
+        @param string   The request as it was received (for logging)
+        @return         The response dict
+        """
 
         # check basic request validity
         if req.is_valid() == False:
             res = { 'status' : 'error', 'message' : 'malformed request' }
-            self.log.log( log.CLIENT_ERROR, string )
+            self._log( log.CLIENT_ERROR, string )
 
         # check request authorization
         elif self.config.is_authorized( req.key, req.request ) == False:
             res = { 'status' : 'error', 'message' : 'invalid auth key' }
-            self.log.log( log.CLIENT_ERROR, string )
+            self._log( log.CLIENT_ERROR, string )
 
         # request is, basically, in good shape
         else:
@@ -132,31 +822,28 @@ class Manager( object ):
                     'response' : 'index',
                     'index'    : self.task_index
                 }
-                self.log.log( log.REQUEST, string, req.key )
+                self._log( log.REQUEST, string, req.key )
 
             # handle request to start a new task
             elif req.request == 'start':
-                if req.name in self.task_names:
-                    descr = worker.create_task_descriptor(
-                        req.name,
-                        req.arguments
-                    )
-                    task_id = self.workers.add(
-                        worker.Worker( descr, req.key )
-                    )
+                priority = _get_priority( req )
+                if priority is None:
                     res = {
-                        'status'   : 'ok',
+                        'status'   : 'error',
                         'response' : 'start',
-                        'taskid'   : task_id
+                        'message'  : 'invalid priority'
                     }
-                    self.log.log( log.REQUEST, string, req.key )
+                    self._log( log.CLIENT_ERROR, string, req.key )
+                elif req.name in self.task_names:
+                    res = self._start( req, priority )
+                    self._log( log.REQUEST, string, req.key )
                 else:
                     res = {
                         'status'   : 'error',
                         'response' : 'start',
                         'message'  : 'invalid task name'
                     }
-                    self.log.log( log.CLIENT_ERROR, string, req.key )
+                    self._log( log.CLIENT_ERROR, string, req.key )
 
             # handle request to stop an active/queued task
             elif req.request == 'stop':
@@ -167,15 +854,16 @@ class Manager( object ):
                         'response' : 'stop',
                         'taskid'   : req.taskid
                     }
-                    self.log.log( log.CLIENT_ERROR, string, req.key )
+                    self._log( log.CLIENT_ERROR, string, req.key )
                 else:
                     wrkr.stop()
+                    self._snapshot_dirty = True
                     res = {
                         'status'   : 'ok',
                         'response' : 'stop',
                         'taskid'   : req.taskid
                     }
-                    self.log.log( log.REQUEST, string, req.key )
+                    self._log( log.REQUEST, string, req.key )
 
             # handle request for all active tasks
             elif req.request == 'active':
@@ -184,119 +872,285 @@ class Manager( object ):
                     "response" : "active",
                     'active'   : self.get_active( req.key )
                 }
-                self.log.log( log.REQUEST, string, req.key )
+                self._log( log.REQUEST, string, req.key )
+
+            # handle request to start many instances of a task
+            elif req.request == 'start_many':
+                res = self._start_many( req, string )
+
+            # handle a batch of requests
+            elif req.request == 'batch':
+                res = self._batch( req, string )
+
+            # handle request for a range of a task's output
+            elif req.request == 'output':
+                res = output.get_response(
+                    self.config.get_output_path(),
+                    req
+                )
+                self._log( log.REQUEST, string, req.key )
+
+            # handle request for a range of a task's result
+            elif req.request == 'result':
+                res = store.get_response( self.config.get_result_path(), req )
+                self._log( log.REQUEST, string, req.key )
+
+            # handle request for server statistics
+            elif req.request == 'stats':
+                res = self._get_stats()
+                self._log( log.REQUEST, string, req.key )
+
+            # handle request to resize the worker pool
+            elif req.request == 'resize':
+                if configuration.is_worker_count( req.workers ) == True:
+                    res = {
+                        'status'   : 'ok',
+                        'response' : 'resize',
+                        'workers'  : self.resize( req.workers )
+                    }
+                    self._log( log.REQUEST, string, req.key )
+                else:
+                    res = {
+                        'status'   : 'error',
+                        'response' : 'resize',
+                        'message'  : 'invalid worker count'
+                    }
+                    self._log( log.CLIENT_ERROR, string, req.key )
 
             # unknown request command
             else:
                 res = { 'status' : 'error', 'message' : 'invalid request' }
-                self.log.log( log.CLIENT_ERROR, string, req.key )
+                self._log( log.CLIENT_ERROR, string, req.key )
 
-        # format the response
-        response = json.dumps( res )
-
-        # log the response
-        self.log.log( log.RESPONSE, response )
-
-        # return a formatted response
-        return response
+        # return the response
+        return res
 
 
     #=========================================================================
-    def process( self ):
+    def _log( self, level, message, authkey = None ):
         """
-        Method to periodically invoke to keep the task manager current.
+        Logs a request.  Requests that are not strings (from a batch) are
+        only serialized if the log level calls for it.
+        @param level    The event's log level
+        @param message  The request string or dict
+        @param authkey  The requester's auth key
         """
 
-        # service all the status queues to keep them from filling up
-        for wrkr in self.workers:
+        if level > self.log.max_level:
+            return
 
-            # i happen to know the worker object caches his status internally
-            wrkr.get_status()
+        if isinstance( message, basestring ) == False:
+            message = codec.dumps( message )
 
-        # get all active task ids
-        task_ids = self.workers.get_task_ids( active = True )
+        self.log.log( level, message, authkey )
 
-        # iterate over active tasks
-        for task_id in task_ids:
 
-            # get worker object for this task ID
-            wrkr = self.workers[ task_id ]
+    #=========================================================================
+    def _release( self, wrkr ):
+        """
+        Releases the process that executed a worker's task.
+        @param wrkr     The worker object
+        """
 
-            # look for workers that can be started (should be abstracted)
-            if wrkr.state == worker.Worker.INIT:
-                wrkr.start()
-                self.log.log( log.TASKING, 'starting task %s' % task_id )
+        if wrkr.process is None:
+            return
+        if wrkr.mode in self.hosts:
+            self.hosts[ wrkr.mode ].release( wrkr.process )
+        else:
+            self.pool.release( wrkr.process )
 
-            # look for workers that have been stopped
-            elif wrkr.state == worker.Worker.STOPPING:
 
-                # let the worker take its time shutting down
-                if wrkr.is_alive() == False:
-                    wrkr.join()
-                    self.workers.remove( task_id )
-                    self.log.log( log.TASKING, 'stopping task %s' % task_id )
+    #=========================================================================
+    def _retire( self, task_id ):
+        """
+        Removes a finished (or stopped) task from the queue, and records its
+        final report for status subscribers.
+        @param task_id  The task's ID
+        """
 
-            # look for active worker status transitions
-            else:
+        # remove the worker from the queue, and return its process to the pool
+        wrkr = self.workers.remove( task_id )
+        self._release( wrkr )
+
+        # record the task's startup latency ( count, total, maximum )
+        if wrkr.latency is not None:
+            self._startup[ 0 ] += 1
+            self._startup[ 1 ] += wrkr.latency
+            self._startup[ 2 ]  = max( self._startup[ 2 ], wrkr.latency )
+
+        # record the final report
+        report = self._get_report( task_id, wrkr )
+        report[ 'state' ] = 'done'
+        self._finish( task_id, wrkr.authkey, report )
+
+        # cache the results of cacheable tasks that finished on their own
+        key = self._cache_keys.pop( task_id, None )
+        if ( key is not None ) \
+            and ( wrkr.state != worker.Worker.STOPPING ) \
+            and ( report.get( 'status' ) == task.Report.DONE ) \
+            and ( report.get( 'result' ) is not None ):
+            self.cache.put( key, report[ 'result' ], report.get( 'message' ) )
+
+        # remove the oldest output files beyond the retention limit
+        if self.config.outputsize > 0:
+            self._outputs.append(
+                output.get_path(
+                    self.config.get_output_path(),
+                    task_id,
+                    wrkr.authkey
+                )
+            )
+            limit = self.config.outputfiles
+            while ( limit > 0 ) and ( len( self._outputs ) > limit ):
+                output.remove( self._outputs.popleft() )
 
-                # get latest status
-                status = wrkr.get_status()
 
-                # look for workers that are done and should be removed
-                if ( status is not None ) and ( status.is_done() == True ):
-                    wrkr.join()
-                    self.workers.remove( task_id )
-                    self.log.log( log.TASKING, 'stopping task %s' % task_id )
+    #=========================================================================
+    def _snapshot_status_changed( self ):
+        """
+        Notes a change in a task's status.  Status changes are published at
+        most once per snapshot delay period (see publish_snapshot()).
+        """
+
+        self._snapshot_dirty = True
 
 
     #=========================================================================
-    def start( self ):
+    def _snapshot_timeout( self ):
         """
-        Method to call before task management needs to begin.
+        Timer function that ends a snapshot delay period.  The daemon
+        publishes the changes made during the period after process() returns.
         """
 
-        # nothing needed here, yet
-
-        pass
+        self._snapshot_timer = False
 
 
     #=========================================================================
-    def stop( self ):
+    def _start( self, req, priority ):
         """
-        Method to call when task management needs to stop.
+        Starts a task, or finishes it right away with a cached result.
+        @param req      The start request object (with a valid task name)
+        @param priority The task's priority
+        @return         The response dict
         """
 
-        # get a copy of task IDs
-        task_ids = self.workers.get_task_ids()
+        # tasks with a cached result are not executed
+        key = self._get_cache_key( req.name, req.arguments )
+        if key is not None:
+            task_id = self._start_cached( key, req.key )
+            if task_id is not None:
+                return {
+                    'status'   : 'ok',
+                    'response' : 'start',
+                    'taskid'   : task_id,
+                    'cached'   : True
+                }
 
-        # iterate over all task_ids in queue
-        for task_id in task_ids:
+        descr = worker.create_task_descriptor(
+            req.name,
+            req.arguments,
+            self.config.statusinterval
+        )
+        task_id = self.workers.add(
+            worker.Worker( descr, req.key, self.task_modes[ req.name ] ),
+            priority
+        )
+        if key is not None:
+            self._cache_keys[ task_id ] = key
+        self._snapshot_dirty = True
 
-            # get worker object for this task ID
-            wrkr = self.workers.get( task_id )
+        return { 'status' : 'ok', 'response' : 'start', 'taskid' : task_id }
 
-            # check if this worker is active
-            if wrkr.is_active() == True:
-                wrkr.stop()
 
-            # worker is inactive
-            else:
-                self.workers.remove( task_id )
+    #=========================================================================
+    def _start_cached( self, key, authkey ):
+        """
+        Finishes a task with its cached result.
+        @param key      The task's cache key
+        @param authkey  The task owner's auth key
+        @return         The task's ID, or None if its result is not cached
+        """
 
-        # get current copy of task IDs
-        task_ids = self.workers.get_task_ids()
+        entry = self.cache.get( key )
+        if entry is None:
+            return None
+        ( digest, message ) = entry
 
-        # iterate over remaining task IDs
-        for task_id in task_ids:
+        # the task gets its own link to the result, like any other task
+        task_id   = self.workers.reserve()
+        directory = self.config.get_result_path()
+        path      = store.get_path( directory, task_id, authkey )
+        if store.link( directory, digest, path ) == False:
+            self.cache.remove( key )
+            return None
 
-            # get worker object for this task ID
-            wrkr = self.workers.get( task_id )
+        report = task.Report(
+            task.Report.DONE,
+            1.0,
+            message,
+            digest
+        ).__getstate__()
+        report[ 'taskid' ] = task_id
+        report[ 'state' ]  = 'done'
+        self._finish( task_id, authkey, report )
 
-            # block until this worker is shut down
-            wrkr.join()
+        return task_id
 
-            # remove worker from queue
-            self.workers.remove( task_id )
+
+    #=========================================================================
+    def _start_many( self, req, string ):
+        """
+        Handles a request to start many instances of the same task.  All the
+        workers are added to the queue in one pass.
+        @param req      The request object
+        @param string   The request string
+        @return         The response dict
+        """
+
+        # check the task name and the list of argument sets
+        if ( req.name not in self.task_names ) \
+            or ( type( req.arguments ) is not list ):
+            self._log( log.CLIENT_ERROR, string, req.key )
+            return {
+                'status'   : 'error',
+                'response' : 'start_many',
+                'message'  : 'invalid task name or argument list'
+            }
+
+        # check the tasks' priority
+        priority = _get_priority( req )
+        if priority is None:
+            self._log( log.CLIENT_ERROR, string, req.key )
+            return {
+                'status'   : 'error',
+                'response' : 'start_many',
+                'message'  : 'invalid priority'
+            }
+
+        # create a worker for each set of arguments
+        workers = [
+            worker.Worker(
+                worker.create_task_descriptor(
+                    req.name,
+                    arguments,
+                    self.config.statusinterval
+                ),
+                req.key,
+                self.task_modes[ req.name ]
+            )
+                for arguments in req.arguments
+        ]
+
+        # add all the workers to the queue
+        task_ids = self.workers.add_many( workers, priority )
+        self._snapshot_dirty = True
+        self._log( log.REQUEST, string, req.key )
+
+        return {
+            'status'   : 'ok',
+            'response' : 'start_many',
+            'taskids'  : task_ids
+        }
 
 
     #=========================================================================
@@ -306,8 +1160,37 @@ class Manager( object ):
         environment.
         """
 
-        self.task_index = self.config.get_task_index()
+        # task modules are only imported by the zygote (when there is one)
+        if self.zygote is not None:
+            self.task_index = self.zygote.get_task_index()
+        else:
+            self.task_index = self.config.get_task_index()
+        self.task_args  = dict(
+            ( x[ 'name' ], x[ 'arguments' ] ) for x in self.task_index
+        )
+        self.task_modes = dict(
+            ( x[ 'name' ], x[ 'mode' ] ) for x in self.task_index
+        )
         self.task_names = [ x[ 'name' ] for x in self.task_index ]
+        self.task_cache = set(
+            x[ 'name' ] for x in self.task_index if x[ 'cacheable' ] == True
+        )
+
+
+#=============================================================================
+def _get_priority( req ):
+    """
+    Checks the priority of a request that starts tasks.
+    @param req          The request object
+    @return             The priority (0 if not given), or None if the
+                        priority is not an integer
+    """
+
+    if req.priority is None:
+        return 0
+    if ( type( req.priority ) is int ) or ( type( req.priority ) is long ):
+        return req.priority
+    return None
 
 
 #=============================================================================
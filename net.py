@@ -4,17 +4,47 @@
 Network Interface Process
 
 This implements a network daemon that communicates with its parent process
-through a duplex pipe.  This daemon uses select polling to handle multiple
-simultaneous clients.
+through a duplex pipe (for control messages) and a pair of shared memory
+rings (for requests and responses, see the ring module).  Several network
+processes may share one listening socket, each with its own pipe and rings.
+This daemon uses readiness polling (epoll, when available) and non-blocking
+sockets to handle many simultaneous clients.
+
+Read-only requests (index and active) are answered directly from the status
+snapshot published by the task manager (see the snapshot module), and requests
+for task output and results are answered from the tasks' files (see the output
+and store modules).  Other requests are checked against the rate and queue
+limits (see the admission module) before they are sent to the task manager.
+
+By default, a client connection carries a single request and response.
+Clients that send a framing handshake (see the frame module) keep their
+connection open and may have several requests in flight at the same time.
+The handshake also selects the encoding of the connection's messages (see the
+codec module).  Responses are matched to requests using the optional "id"
+field of a request, which is returned in the response.
 """
 
 
+import collections
 import errno
-import select
+import json
+import os
+import Queue
 import socket
+import stat
+import threading
+import time
 
+import admission
+import codec
 import data
+import frame
+import output
+import poller
+import request
 import session
+import snapshot
+import store
 
 
 #=============================================================================
@@ -25,17 +55,21 @@ class Message( data.Data ):
 
 
     #=========================================================================
-    DATA = 1                        # message contains data
-    QUIT = 86                       # message indicates process shutdown
+    DATA     = 1                    # message contains data
+    SNAPSHOT = 2                    # message indicates a new status snapshot
+    STATS    = 3                    # message contains network statistics
+    QUIT     = 86                   # message indicates process shutdown
 
 
     #=========================================================================
-    def __init__( self, mid = DATA, sid = None, data = None ):
+    def __init__( self, mid = DATA, sid = None, data = None,
+        encoding = codec.JSON ):
         """
         Constructor.
         @param mid      Message ID (default is for a data message)
         @param sid      Request session ID (required for data messages)
         @param data     Message data payload (as a string)
+        @param encoding Encoding of the data payload (see the codec module)
         """
 
         # load arguments into object state
@@ -43,127 +77,1140 @@ class Message( data.Data ):
 
 
 #=============================================================================
-QUIT = Message( Message.QUIT )      # message to send to shut down the process
+QUIT     = Message( Message.QUIT )      # message to shut down the process
+SNAPSHOT = Message( Message.SNAPSHOT )  # message to announce a new snapshot
 
 
 #=============================================================================
-def net( pipe, address ):
+MAX_REQUEST    = 1048576            # default maximum request size
+RECV_SIZE      = 65536              # size of each socket read
+STATS_INTERVAL = 1.0                # minimum time between statistics reports
+
+_retry_errors = ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR )
+
+# requests answered without the task manager
+_local_requests = ( 'index', 'active', 'watch', 'output', 'result' )
+
+
+#=============================================================================
+class Connection( object ):
     """
-    Network daemon process function.
-    @param pipe         IPC duplex communication pipe connection object
-    @param address      Address of the listen port (tuple)
-    @return             Process exit code (0 = normal)
+    Network client connection state.
+    A connection starts in an undetermined mode.  The first data received
+    from the client selects either the one-shot mode (a single request and
+    response, then the connection is closed) or the framed (keep-alive) mode
+    where any number of requests may be in flight on the same connection.
+    Responses are queued in an output buffer, and written as the socket
+    becomes writable so a slow client never blocks the network process.
     """
 
-    # create a session queue
-    queue = session.SessionQueue()
 
-    # set the maximum backlog for new connections (5 is often max)
-    backlog = 5
+    #=========================================================================
+    ONESHOT = 1                     # one request, one response
+    FRAMED  = 2                     # length-prefixed frames, kept alive
 
-    # set the maximum request payload size
-    max_request_size = 2048
 
-    # create and configure the server socket
-    sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
-    sock.bind( address )
-    sock.listen( backlog )
+    #=========================================================================
+    def __init__( self, sock, address, max_request_size ):
+        """
+        Constructor.
+        @param sock     The connection's socket object (non-blocking)
+        @param address  The client's network address
+        @param max_request_size
+                        The maximum request payload size
+        """
 
-    # list of input connections to poll
-    poll = [ sock, pipe ]
+        self.sock     = sock
+        self.address  = address
+        self.mode     = None
+        self.encoding = codec.JSON
+        self.reader   = frame.FrameReader( max_request_size )
+        self.scanner  = frame.JSONScanner( max_request_size )
+        self.pending  = 0
+        self.closed   = False
+        self.finished = False
+        self.hung_up  = False
+        self.events   = 0
+        self.output   = collections.deque()
+        self.offset   = 0
 
-    # loop execution flag
-    is_running = True
 
-    # daemon loop
-    while is_running == True:
+    #=========================================================================
+    def close( self ):
+        """
+        Closes the connection.
+        """
 
-        # select next connection with available data
-        try:
-            inputs, outputs, excepts = select.select( poll, [], [] )
+        if self.closed == False:
+            self.sock.close()
+            self.closed = True
+            self.output.clear()
 
-        # select errors
-        except select.error as e:
 
-            # select was interrupted by system call (SIGINT)
-            if e.args[ 0 ] == errno.EINTR:
-                for s in poll:
-                    if ( s != sock ) and ( s != pipe ):
-                        s.close()
-                is_running = False
-                break
+    #=========================================================================
+    def fileno( self ):
+        """
+        Support polling on the connection object.
+        @return         The socket's file descriptor
+        """
 
-        # process shut down by interactive input or application exit
-        except ( KeyboardInterrupt, SystemExit ):
-            for s in poll:
-                if ( s != sock ) and ( s != pipe ):
-                    s.close()
-            is_running = False
-            break
+        return self.sock.fileno()
+
+
+    #=========================================================================
+    def flush( self ):
+        """
+        Writes as much buffered output as the socket will accept.
+        @return         True if all buffered output has been written
+        @throws socket.error
+                        The connection failed
+        """
+
+        # write output chunks until the buffer is empty
+        while len( self.output ) > 0:
+
+            # write as much of the current chunk as possible
+            chunk = self.output[ 0 ]
+            try:
+                sent = self.sock.send( buffer( chunk, self.offset ) )
+            except socket.error as e:
+                if e.args[ 0 ] in _retry_errors:
+                    return False
+                raise
+
+            # advance through the current chunk
+            self.offset += sent
+            if self.offset < len( chunk ):
+                return False
+
+            # move to the next chunk
+            self.output.popleft()
+            self.offset = 0
+
+        # all output has been written
+        return True
+
+
+    #=========================================================================
+    def get_events( self ):
+        """
+        Determines the poller events this connection is interested in.
+        @return         The poller event mask
+        """
 
-        # loop through all new inputs
-        for ready in inputs:
+        events = 0
 
-            # handle parent process messages
-            if ready == pipe:
+        # one-shot connections stop reading after the request
+        if ( self.mode != Connection.ONESHOT ) or ( self.pending == 0 ):
+            if ( self.finished == False ) and ( self.hung_up == False ):
+                events |= poller.READ
 
-                # fetch the message from the pipe
-                message = pipe.recv()
+        # wait for writability while there is output to send
+        if len( self.output ) > 0:
+            events |= poller.WRITE
 
-                # check for daemon shutdown message
-                if message.mid == Message.QUIT:
-                    is_running = False
+        return events
 
-                # check for response data message
-                elif message.mid == Message.DATA:
 
-                    # remove the session from the queue
-                    sess = queue.remove( message.sid )
+    #=========================================================================
+    def hang_up( self ):
+        """
+        Processes the client closing its side of the connection.
+        @return         A list of complete requests
+        """
+
+        self.hung_up = True
+
+        # a one-shot client may end its request by shutting down its side
+        if ( self.mode == Connection.ONESHOT ) and ( self.pending == 0 ):
+            if ( self.finished == False ) and ( self.scanner.end is None ):
+                return [ self.scanner.get_text() ]
 
-                    # send the response data to the socket
-                    sess[ 'sock' ].send( message.data )
+        # there is no request to answer
+        return []
 
-                    # close the socket
-                    sess[ 'sock' ].close()
 
-            # handle a new connection with a network client
-            elif ready == sock:
+    #=========================================================================
+    def is_reading( self ):
+        """
+        Checks if the connection is accepting request data.
+        @return         True if more request data is expected
+        """
 
-                # accept the new connection
-                connection, address = ready.accept()
+        return ( self.get_events() & poller.READ ) != 0
 
-                # add the connection to the input polling list
-                poll.append( connection )
 
-            # handle data from all other connections
+    #=========================================================================
+    def receive( self, payload ):
+        """
+        Processes data received from the client.
+        @param payload  The data received from the socket
+        @return         A list of complete requests
+        @throws frame.FrameError
+                        A request exceeds the maximum request size
+        """
+
+        # the first data received selects the connection mode and encoding
+        if self.mode is None:
+            if payload[ 0 ] in frame.HANDSHAKES:
+                self.mode     = Connection.FRAMED
+                self.encoding = frame.HANDSHAKES[ payload[ 0 ] ]
+                payload       = payload[ 1 : ]
             else:
+                self.mode = Connection.ONESHOT
+
+        # one-shot requests end with the end of the top-level JSON value
+        if self.mode == Connection.ONESHOT:
+            if self.scanner.feed( payload ) == True:
+                return [ self.scanner.get_text() ]
+            return []
+
+        # framed connections may send partial or multiple requests
+        self.reader.feed( payload )
+        return self.reader.frames()
+
 
-                # load the request data from the socket
-                payload, address = ready.recvfrom( max_request_size )
+    #=========================================================================
+    def respond( self, data ):
+        """
+        Queues a response to send to the client.
+        @param data     The response data (a string, or a list of chunks that
+                        may include buffers, which are sent without copying)
+        """
 
-                # data is available if the payload is not an empty string
-                if len( payload ) > 0:
+        # responses to closed connections are discarded
+        if self.closed == True:
+            return
 
-                    # add request to session queue
-                    sid = queue.add( address = address, sock = ready )
+        # responses in chunks are queued as they are (after a frame header
+        #   for the whole response)
+        if type( data ) is list:
+            if self.mode == Connection.FRAMED:
+                size = sum( len( chunk ) for chunk in data )
+                self.output.append( frame.HEADER.pack( size ) )
+            self.output.extend( data )
+        elif self.mode == Connection.FRAMED:
+            self.output.append( frame.pack( data ) )
+        else:
+            self.output.append( data )
 
-                    # send request to parent
-                    pipe.send( Message( sid = sid, data = payload ) )
+        # framed connections stay open for more requests, and one-shot
+        #   connections are closed after the response is sent
+        if self.mode != Connection.FRAMED:
+            self.finished = True
 
-                    # remove the socket from select polling
-                    poll.remove( ready )
 
-                # no data in payload (empty string)
+    #=========================================================================
+    def reject( self, data ):
+        """
+        Queues a final response, and stops accepting requests.  This is used
+        when the client sends data that can not be handled.
+        @param data     The response data
+        """
+
+        self.respond( data )
+        self.finished = True
+
+
+#=============================================================================
+class Watch( object ):
+    """
+    Task status subscription.
+    A watch remembers the last task reports sent to its client so that only
+    the changes need to be sent when a new status snapshot is published.
+    """
+
+
+    #=========================================================================
+    def __init__( self, conn, key, taskids = None, request_id = None ):
+        """
+        Constructor.
+        @param conn     The client connection receiving updates
+        @param key      The subscriber's auth key
+        @param taskids  The list of task IDs to watch (None for all tasks
+                        owned by the auth key)
+        @param request_id
+                        The ID of the watch request (sent with each update)
+        """
+
+        self.conn       = conn
+        self.key        = key
+        self.taskids    = None if taskids is None else set( taskids )
+        self.request_id = request_id
+        self.reports    = {}
+        self.finished   = 0
+
+
+    #=========================================================================
+    def is_watching( self, authkey, taskid ):
+        """
+        Checks if a task is in the scope of this watch.
+        @param authkey  The task owner's auth key
+        @param taskid   The task's ID
+        @return         True if the task is being watched
+        """
+
+        if ( self.key is not None ) and ( authkey != self.key ):
+            return False
+        if ( self.taskids is not None ) and ( taskid not in self.taskids ):
+            return False
+        return True
+
+
+    #=========================================================================
+    def update( self, reports, finished ):
+        """
+        Determines the changes since the last update.
+        @param reports  A list of current task report dicts for the auth key
+        @param finished The snapshot's list of recently finished tasks
+        @return         An update dict, or None if nothing has changed
+        """
+
+        changed = []
+        removed = []
+
+        # build the table of currently watched reports
+        current = {}
+        for report in reports:
+            taskid = report[ 'taskid' ]
+            if ( self.taskids is None ) or ( taskid in self.taskids ):
+                current[ taskid ] = report
+
+        # send new tasks in full, and only the changed fields of other tasks
+        for taskid, report in current.items():
+            previous = self.reports.get( taskid )
+            if previous is None:
+                changed.append( report )
+            else:
+                delta = dict(
+                    ( k, v ) for k, v in report.items()
+                        if previous.get( k ) != v
+                )
+                if len( delta ) > 0:
+                    delta[ 'taskid' ] = taskid
+                    changed.append( delta )
+
+        # send the final reports of watched tasks that finished
+        for entry in finished:
+            if entry[ 'seq' ] <= self.finished:
+                continue
+            self.finished = entry[ 'seq' ]
+            report = entry[ 'report' ]
+            if self.is_watching( entry[ 'authkey' ], report[ 'taskid' ] ):
+                if report[ 'taskid' ] not in current:
+                    removed.append( report )
+
+        # remember the reports for the next update
+        self.reports = current
+
+        # nothing to send
+        if ( len( changed ) == 0 ) and ( len( removed ) == 0 ):
+            return None
+
+        # build the update
+        update = {
+            'status'   : 'ok',
+            'response' : 'watch',
+            'changed'  : changed,
+            'removed'  : removed
+        }
+        if self.request_id is not None:
+            update[ 'id' ] = self.request_id
+        return update
+
+
+#=============================================================================
+class Server( object ):
+    """
+    Network server event loop.
+    All sockets are non-blocking, and are monitored with a readiness poller
+    (epoll, when available) so the cost of each wake up does not depend on
+    the number of connected clients.
+    """
+
+
+    #=========================================================================
+    def __init__( self, pipe, listeners, shard = 0, config = None,
+        ring = None ):
+        """
+        Constructor.
+        @param pipe     IPC duplex communication pipe connection object
+        @param listeners
+                        A list of listening server sockets (see listen())
+        @param shard    The number of this network process
+        @param config   Application configuration object (enables answering
+                        read-only requests from the status snapshot)
+        @param ring     This process's end of the request and response rings
+                        (see the ring module, None sends requests through the
+                        pipe)
+        """
+
+        # create a session queue
+        self.shard = shard
+        self.queue = session.SessionQueue( shard )
+
+        # the listen sockets may be shared with other network processes
+        self.listeners = listeners
+        for listener in self.listeners:
+            listener.setblocking( 0 )
+
+        # create the readiness poller for the listeners, the parent pipe, and
+        #   the response ring
+        self.pipe   = pipe
+        self.ring   = ring
+        self.outbox = Queue.Queue()
+        self.poller = poller.Poller()
+        for listener in self.listeners:
+            self.poller.register( listener, poller.READ )
+        self.poller.register( self.pipe, poller.READ )
+        if self.ring is not None:
+            self.poller.register( self.ring, poller.READ )
+
+        # set up answering read-only requests from the status snapshot
+        self.config  = config
+        self.watches = []
+        self._cache  = {}
+        self._cache_version = None
+        if config is not None:
+            self.snapshot = snapshot.Reader( config.get_snapshot_file() )
+            self.max_request_size = config.maxrequest
+        else:
+            self.snapshot = None
+            self.max_request_size = MAX_REQUEST
+
+        # set up checking requests against the rate and queue limits
+        if ( config is not None ) \
+            and ( admission.is_enabled( config ) == True ):
+            self.admission = admission.Admission( config )
+        else:
+            self.admission = None
+        self._stats_time = 0.0
+
+        # loop execution flag
+        self.is_running = False
+
+
+    #=========================================================================
+    def run( self ):
+        """
+        Runs the server loop until shut down.
+        """
+
+        # set the loop execution flag
+        self.is_running = True
+
+        # messages to the parent pipe are sent from a separate thread so the
+        #   loop never blocks on the pipe while the parent is sending responses
+        sender = threading.Thread( target = self._send_messages )
+        sender.daemon = True
+        sender.start()
+
+        # daemon loop
+        while self.is_running == True:
+
+            # wait for the next set of ready connections
+            try:
+                ready = self.poller.poll( self._get_timeout() )
+
+            # polling was interrupted by system call (SIGINT)
+            except IOError as e:
+                if poller.is_interrupt( e ) == True:
+                    break
+                raise
+
+            # process shut down by interactive input or application exit
+            except ( KeyboardInterrupt, SystemExit ):
+                break
+
+            # handle each ready object
+            for obj, events in ready:
+
+                # handle parent process messages
+                if obj is self.pipe:
+                    self._handle_pipe()
+
+                # handle responses from the parent process
+                elif obj is self.ring:
+                    self._handle_ring()
+
+                # handle new connections with network clients
+                elif obj in self.listeners:
+                    self._accept( obj )
+
+                # handle client connections
                 else:
+                    self._handle_connection( obj, events )
+
+            # report new statistics to the parent
+            self._send_stats()
+
+        # close all client connections
+        for obj in self.poller.objects():
+            if isinstance( obj, Connection ) == True:
+                self._close( obj )
+
+        # stop the message sender
+        self.outbox.put( None )
+
+        # shut down the listen sockets
+        self.poller.close()
+        for listener in self.listeners:
+            listener.close()
+
+
+    #=========================================================================
+    def _accept( self, listener ):
+        """
+        Accepts all pending connections from a listen socket.
+        @param listener The ready listen socket
+        """
+
+        while True:
+
+            # accept the next new connection
+            try:
+                sock, address = listener.accept()
+
+            # no more pending connections (or the client gave up)
+            except socket.error:
+                break
+
+            # add the connection to the poller
+            sock.setblocking( 0 )
+            conn = Connection( sock, address, self.max_request_size )
+            conn.events = poller.READ
+            self.poller.register( conn, conn.events )
+
+
+    #=========================================================================
+    def _admit( self, conn, payload ):
+        """
+        Checks a request against the rate and queue limits.
+        @param conn     The client connection sending the request
+        @param payload  The request data
+        @return         None to send the request to the task manager, or the
+                        busy response data
+        """
+
+        # no limits are configured
+        if self.admission is None:
+            return None
+
+        # invalid requests are left to the task manager
+        req = request.Request( payload, conn.encoding )
+        if req.is_valid() == False:
+            return None
+
+        # check the request
+        result = self.admission.check( req, self.snapshot.get() )
+        if result is None:
+            return None
+
+        # build the busy response
+        ( reason, retry ) = result
+        response = self.admission.get_response( reason, retry, conn.encoding )
+        if req.id is not None:
+            response = codec.add_field( response, 'id', req.id, conn.encoding )
+        return response
+
+
+    #=========================================================================
+    def _close( self, conn ):
+        """
+        Closes a client connection.  Pending responses are discarded.
+        @param conn     The connection to close
+        """
+
+        if conn.closed == False:
+            self.poller.unregister( conn )
+            conn.close()
+
+
+    #=========================================================================
+    def _get_cache( self, snap ):
+        """
+        Retrieves the cache of data derived from the status snapshot.  The
+        cache is emptied when a new snapshot is published.
+        @param snap     The current status snapshot
+        @return         The cache dict
+        """
+
+        if snap[ 'version' ] != self._cache_version:
+            self._cache         = {}
+            self._cache_version = snap[ 'version' ]
+        return self._cache
+
+
+    #=========================================================================
+    def _get_encoded( self, snap, field, key, encoding ):
+        """
+        Retrieves a response to a read-only request in a non-JSON encoding.
+        Responses are kept until a new snapshot is published.
+        @param snap     The current status snapshot
+        @param field    The snapshot field ("index" or "active")
+        @param key      The auth key of an active task list (None for all)
+        @param encoding The response encoding (see the codec module)
+        @return         The encoded response (without a request ID)
+        """
 
-                    # close the socket
-                    ready.close()
+        # the index response is the same for all keys
+        if field == 'index':
+            key = None
 
-                    # remove the socket from select polling
-                    poll.remove( ready )
+        # encode the response on first use
+        cache = self._get_cache( snap )
+        name  = ( 'encoded', field, key, encoding )
+        if name not in cache:
+            if field == 'index':
+                res = self._get_parsed( snap, 'index' )
+            else:
+                res = {
+                    'status'   : 'ok',
+                    'response' : 'active',
+                    'active'   : self._get_parsed( snap, 'active', key )
+                }
+            cache[ name ] = codec.dumps( res, encoding )
+
+        # return the encoded response
+        return cache[ name ]
+
+
+    #=========================================================================
+    def _get_parsed( self, snap, field, key = None ):
+        """
+        Retrieves a serialized part of the status snapshot as parsed data.
+        Parsed data is kept until a new snapshot is published.
+        @param snap     The current status snapshot
+        @param field    The snapshot field ("index" or "active")
+        @param key      The auth key of an active task list (None for all)
+        @return         The parsed data (must not be modified)
+        """
+
+        # parse the field on first use
+        cache = self._get_cache( snap )
+        name  = ( 'parsed', field, key )
+        if name not in cache:
+            if field == 'index':
+                text = snap[ 'index' ]
+            elif key is None:
+                text = snap[ 'all' ]
+            else:
+                text = snap[ 'active' ].get( key, '[]' )
+            cache[ name ] = json.loads( text )
+
+        # return the parsed data
+        return cache[ name ]
+
+
+    #=========================================================================
+    def _get_snapshot_response( self, conn, payload ):
+        """
+        Attempts to answer a read-only request from the status snapshot (or
+        a task's output or result file).  Requests that can not be answered
+        this way (including all invalid and unauthorized requests) are left
+        to the task manager.
+        @param conn     The client connection sending the request
+        @param payload  The request data
+        @return         The response data, or None to forward the request
+        """
+
+        # only index, active, watch, output, and result requests are answered
+        #   here
+        for name in _local_requests:
+            if conn.encoding == codec.JSON:
+                name = '"%s"' % name
+            if name in payload:
+                break
+        else:
+            return None
+
+        # parse and check the request
+        req = request.Request( payload, conn.encoding )
+        if req.is_valid() == False:
+            return None
+        if req.request not in _local_requests:
+            return None
+        if ( self.config is not None ) \
+            and ( self.config.is_authorized( req.key, req.request ) == False ):
+            return None
+
+        # task output and results are read from their files (which are found
+        #   through the configuration)
+        if ( self.config is None ) \
+            and ( req.request in ( 'output', 'result' ) ):
+            return None
+        if req.request == 'output':
+            return self._read_output( conn, req )
+        if req.request == 'result':
+            return self._read_result( conn, req )
+
+        # make sure a snapshot has been published
+        if self.snapshot is None:
+            return None
+        snap = self.snapshot.get()
+        if snap is None:
+            return None
+
+        # subscribe to status updates
+        if req.request == 'watch':
+            return self._watch( conn, req, snap )
+
+        # binary responses are encoded once for each snapshot
+        if conn.encoding != codec.JSON:
+            response = self._get_encoded(
+                snap,
+                req.request,
+                req.key,
+                conn.encoding
+            )
+
+        # the task index response is serialized by the manager
+        elif req.request == 'index':
+            response = snap[ 'index' ]
+
+        # the active task lists are serialized for each auth key
+        else:
+            if req.key is None:
+                active = snap[ 'all' ]
+            else:
+                active = snap[ 'active' ].get( req.key, '[]' )
+            response = '{"status":"ok","response":"active","active":%s}' \
+                % active
+
+        # pipelined requests are matched to responses by the request ID
+        if req.id is not None:
+            response = codec.add_field( response, 'id', req.id, conn.encoding )
+
+        # return the response (serialized JSON is always ASCII)
+        return str( response )
+
+
+    #=========================================================================
+    def _get_timeout( self ):
+        """
+        Determines how long the loop may wait for ready objects.
+        @return         The time until statistics are due to be reported
+                        (None to wait indefinitely)
+        """
+
+        if ( self.admission is None ) or ( self.admission.changed == False ):
+            return None
+        return STATS_INTERVAL - ( time.time() - self._stats_time )
+
+
+    #=========================================================================
+    def _handle_connection( self, conn, events ):
+        """
+        Handles readiness events for a client connection.
+        @param conn     The ready connection
+        @param events   The ready events
+        """
+
+        # send buffered output
+        if ( events & poller.WRITE ) != 0:
+            self._write( conn )
+
+        # receive request data
+        events &= ( poller.READ | poller.ERROR )
+        if ( conn.closed == False ) and ( events != 0 ):
+
+            # load requests from connections that are expecting data
+            if conn.is_reading() == True:
+                self._read( conn )
+
+            # the connection failed or hung up while waiting for a response
+            else:
+                self._close( conn )
+
+
+    #=========================================================================
+    def _handle_pipe( self ):
+        """
+        Handles all messages waiting in the parent process pipe.
+        """
+
+        # read until the pipe is empty
+        while ( self.is_running == True ) and ( self.pipe.poll() == True ):
+
+            # fetch the message from the pipe
+            message = self.pipe.recv()
+
+            # check for daemon shutdown message
+            if message.mid == Message.QUIT:
+                self.is_running = False
+
+            # check for a new status snapshot
+            elif message.mid == Message.SNAPSHOT:
+                self._update_watches()
+
+            # check for response data message
+            elif message.mid == Message.DATA:
+                self._respond( message.sid, message.data )
+
+
+    #=========================================================================
+    def _handle_ring( self ):
+        """
+        Handles all responses waiting in the response ring.
+        """
+
+        for ( sid, encoding, data ) in self.ring.receive():
+            self._respond( sid, data )
+
+
+    #=========================================================================
+    def _read( self, conn ):
+        """
+        Reads request data from a client connection.
+        @param conn     The connection with data to read
+        """
+
+        # load the available request data from the socket
+        try:
+            payload = conn.sock.recv( RECV_SIZE )
+        except socket.error as e:
+            if e.args[ 0 ] in _retry_errors:
+                return
+            self._close( conn )
+            return
+
+        # no data in payload (empty string) means the client hung up
+        if len( payload ) == 0:
+            requests = conn.hang_up()
+            if ( len( requests ) == 0 ) and ( conn.pending == 0 ):
+                self._close( conn )
+                return
+
+        # extract all complete requests from the data
+        else:
+            try:
+                requests = conn.receive( payload )
+
+            # the request is too large, tell the client before hanging up
+            except frame.FrameError as e:
+                conn.reject( codec.dumps(
+                    { 'status' : 'error', 'message' : str( e ) },
+                    conn.encoding
+                ) )
+                self._write( conn )
+                return
+
+        # handle each request
+        for payload in requests:
+
+            # answer read-only requests from the status snapshot
+            response = self._get_snapshot_response( conn, payload )
+            if response is not None:
+                conn.respond( response )
+                continue
+
+            # answer requests beyond the rate and queue limits
+            response = self._admit( conn, payload )
+            if response is not None:
+                conn.respond( response )
+                continue
+
+            # add request to session queue
+            sid = self.queue.add(
+                address = conn.address,
+                sock    = conn.sock,
+                conn    = conn
+            )
+            conn.pending += 1
+
+            # send request to parent
+            self._send( sid, payload, conn.encoding )
+
+        # send any responses, and update the connection's poller events
+        self._write( conn )
+
+
+    #=========================================================================
+    def _read_output( self, conn, req ):
+        """
+        Answers a request for a range of a task's output.  Only the range is
+        mapped from the task's output file, so large output files do not pass
+        through the task manager (or into memory).
+        @param conn     The client connection sending the request
+        @param req      The request object
+        @return         The response data (a list of chunks)
+        """
+
+        response = output.get_response( self.config.get_output_path(), req )
+
+        # pipelined requests are matched to responses by the request ID
+        if req.id is not None:
+            response[ 'id' ] = req.id
+
+        return codec.dump_chunks( response, conn.encoding )
+
+
+    #=========================================================================
+    def _read_result( self, conn, req ):
+        """
+        Answers a request for a range of a task's result.  The range is
+        mapped from the result store, and the binary encoding sends the
+        mapped pages without copying them.
+        @param conn     The client connection sending the request
+        @param req      The request object
+        @return         The response data (a list of chunks)
+        """
+
+        response = store.get_response( self.config.get_result_path(), req )
+
+        # pipelined requests are matched to responses by the request ID
+        if req.id is not None:
+            response[ 'id' ] = req.id
+
+        return codec.dump_chunks( response, conn.encoding )
+
+
+    #=========================================================================
+    def _respond( self, sid, data ):
+        """
+        Sends a response from the parent process to its client.
+        @param sid      The request's session ID
+        @param data     The response data
+        """
+
+        # remove the session from the queue
+        sess = self.queue.remove( sid )
+
+        # queue the response data for the client
+        conn = sess[ 'conn' ]
+        conn.pending -= 1
+        if conn.closed == False:
+            conn.respond( data )
+            self._write( conn )
+
+
+    #=========================================================================
+    def _send( self, sid, payload, encoding ):
+        """
+        Sends a request to the parent process.
+        @param sid      The request's session ID
+        @param payload  The request data
+        @param encoding The encoding of the request data
+        """
+
+        # requests are sent through the ring, unless they can never fit
+        if self.ring is not None:
+            if self.ring.send( sid, encoding, payload ) == True:
+                return
+
+        # other requests are sent through the pipe
+        self.outbox.put(
+            Message( sid = sid, data = payload, encoding = encoding )
+        )
+
+
+    #=========================================================================
+    def _send_messages( self ):
+        """
+        Sends queued messages to the parent process until stopped.
+        """
+
+        while True:
+
+            # wait for the next message (None stops the sender)
+            message = self.outbox.get()
+            if message is None:
+                break
+
+            # send the message to the parent
+            try:
+                self.pipe.send( message )
+            except ( IOError, OSError ):
+                break
+
+
+    #=========================================================================
+    def _send_stats( self ):
+        """
+        Reports changed statistics to the parent process (at most once per
+        STATS_INTERVAL).
+        """
+
+        # nothing has changed
+        if ( self.admission is None ) or ( self.admission.changed == False ):
+            return
+
+        # wait until the next report is due
+        now = time.time()
+        if ( now - self._stats_time ) < STATS_INTERVAL:
+            return
+
+        # send a copy of the counters (they are sent from another thread)
+        rejected = dict(
+            ( key, dict( counts ) )
+                for key, counts in self.admission.rejected.items()
+        )
+        self.outbox.put(
+            Message(
+                Message.STATS,
+                data = { 'shard' : self.shard, 'rejected' : rejected }
+            )
+        )
+        self.admission.changed = False
+        self._stats_time       = now
+
+
+    #=========================================================================
+    def _update( self, conn ):
+        """
+        Updates the poller for a connection's current state.
+        @param conn     The connection to update
+        """
+
+        # finished connections are closed once all output is written
+        done = ( conn.finished == True ) \
+            or ( ( conn.hung_up == True ) and ( conn.pending == 0 ) )
+        if ( done == True ) and ( len( conn.output ) == 0 ):
+            self._close( conn )
+            return
+
+        # only modify the poller when the events change
+        events = conn.get_events()
+        if events != conn.events:
+            conn.events = events
+            self.poller.modify( conn, events )
+
+
+    #=========================================================================
+    def _update_watches( self ):
+        """
+        Sends the changes in a new status snapshot to all subscribers.
+        """
+
+        # drop subscriptions of closed connections
+        self.watches = [ w for w in self.watches if w.conn.closed == False ]
+        if len( self.watches ) == 0:
+            return
+
+        # load the new snapshot
+        snap = self.snapshot.get()
+
+        # send each subscriber its changes (parsed report lists are shared by
+        #   subscribers to the same key)
+        for watch in self.watches:
+            update = watch.update(
+                self._get_parsed( snap, 'active', watch.key ),
+                snap[ 'finished' ]
+            )
+            if update is not None:
+                watch.conn.respond(
+                    codec.dumps( update, watch.conn.encoding )
+                )
+                self._write( watch.conn )
+
+
+    #=========================================================================
+    def _watch( self, conn, req, snap ):
+        """
+        Subscribes a client to task status updates.
+        @param conn     The client connection sending the request
+        @param req      The watch request
+        @param snap     The current status snapshot
+        @return         The response data
+        """
+
+        # updates can only be sent on framed connections
+        if conn.mode != Connection.FRAMED:
+            res = {
+                'status'   : 'error',
+                'response' : 'watch',
+                'message'  : 'watch requires a framed connection'
+            }
+
+        # subscribe to updates, and send the current status of all tasks
+        else:
+            watch = Watch( conn, req.key, req.taskids, req.id )
+            if len( snap[ 'finished' ] ) > 0:
+                watch.finished = snap[ 'finished' ][ -1 ][ 'seq' ]
+            reports = self._get_parsed( snap, 'active', req.key )
+            res = watch.update( reports, [] )
+            if res is None:
+                res = {
+                    'status'   : 'ok',
+                    'response' : 'watch',
+                    'changed'  : [],
+                    'removed'  : []
+                }
+            self.watches.append( watch )
+
+        # pipelined requests are matched to responses by the request ID
+        if req.id is not None:
+            res[ 'id' ] = req.id
+
+        return codec.dumps( res, conn.encoding )
+
+
+    #=========================================================================
+    def _write( self, conn ):
+        """
+        Writes buffered output to a client connection.
+        @param conn     The connection to write
+        """
+
+        # write as much as the socket accepts
+        try:
+            conn.flush()
+
+        # the client is gone
+        except socket.error:
+            self._close( conn )
+            return
+
+        # update the connection's poller events
+        self._update( conn )
+
+
+#=============================================================================
+def listen( address, backlog = 1024 ):
+    """
+    Creates the listening server socket.  The socket is created before the
+    network processes are started so they can all accept connections from
+    the same port.
+    @param address      Address of the listen port (tuple), or the path of
+                        a Unix domain socket (string)
+    @param backlog      Maximum backlog of connections waiting to be accepted
+    @return             The listening socket
+    """
+
+    # Unix domain sockets replace a socket left behind by a previous run
+    if isinstance( address, basestring ) == True:
+        try:
+            if stat.S_ISSOCK( os.stat( address ).st_mode ) == True:
+                os.unlink( address )
+        except OSError:
+            pass
+        sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+
+    # TCP sockets may be bound while old connections are timing out
+    else:
+        sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        sock.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+
+    sock.bind( address )
+    sock.listen( backlog )
+    return sock
+
+
+#=============================================================================
+def net( pipe, listeners, shard = 0, config = None, ring = None ):
+    """
+    Network daemon process function.
+    @param pipe         IPC duplex communication pipe connection object
+    @param listeners    A list of listening server sockets (see listen())
+    @param shard        The number of this network process
+    @param config       Application configuration object
+    @param ring         This process's end of the request and response rings
+    @return             Process exit code (0 = normal)
+    """
 
-    # shut down the listen socket
-    sock.close()
+    # create and run the server
+    server = Server( pipe, listeners, shard, config, ring )
+    server.run()
 
     # return exit code
     return 0
@@ -193,12 +1240,14 @@ def main( argv ):
     import multiprocessing
 
     ( p_pipe, c_pipe ) = multiprocessing.Pipe( True )
+    listener = listen( address )
     netd = multiprocessing.Process(
         target = net,
-        args   = ( c_pipe, address ),
+        args   = ( c_pipe, [ listener ] ),
         name   = 'netd'
     )
     netd.start()
+    listener.close()
 
     print 'server started, listening on port %d' % address[ 1 ]
 
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+
+"""
+Task Output Capture
+
+Everything a task writes to its standard output and standard error is
+appended to a file in the daemon's output directory.  Each file is capped at
+a configured size: once the cap is reached, a marker is written in place of
+the rest of the output, so a task that writes without bound can not fill the
+disk.  The files are only ever appended to, so a client can follow a task's
+output by requesting the range after the last byte it received.
+
+Tasks in worker processes own the process' standard output and error file
+descriptors, so the output of the programs and extension modules they use is
+captured along with their own.  Tasks in host processes share the process'
+descriptors, so only output written through sys.stdout and sys.stderr is
+captured (the host installs streams that send each thread's output to the
+capture file of the task it is running).
+
+Capture files are named for the task's ID and a digest of its owner's key,
+so the network processes can find (and authorize) a task's output without
+asking the manager.  Reads return the file's bytes as they are (a range may
+split a multibyte character), so clients can rebuild the file from the
+ranges they receive.
+"""
+
+
+import errno
+import hashlib
+import mmap
+import os
+import sys
+import threading
+
+
+#=============================================================================
+READ_SIZE = 65536                   # default size of a requested range
+MAX_READ  = 1048576                 # maximum size of a requested range
+
+_TRUNCATED = '\n[output truncated]\n'   # marker written at the size cap
+
+_drain_time = 1.0                   # time allowed to read the rest of the
+                                    #   output when a task finishes
+_pump_size  = 65536                 # maximum bytes read from the pipe at once
+
+_local = threading.local()          # the capture of each thread's task
+
+
+#=============================================================================
+class Capture( object ):
+    """
+    Size-capped, append-only output file.  Writes are safe from any thread.
+    Captures may replace sys.stdout and sys.stderr.
+    """
+
+
+    #=========================================================================
+    def __init__( self, path, limit ):
+        """
+        Constructor.
+        @param path     The path of the output file (replaced if it exists)
+        @param limit    The maximum size of the file (bytes)
+        """
+
+        self.path  = path
+        self.limit = limit
+        self.size  = 0
+
+        self._fd   = os.open(
+            path,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND,
+            0640
+        )
+        self._lock = threading.Lock()
+
+        # the process' streams and file descriptors while redirected
+        self._saved = None
+        self._pump  = None
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Stops capturing output, and closes the file.
+        """
+
+        if self._saved is not None:
+            self._restore()
+
+        with self._lock:
+            if self._fd is not None:
+                os.close( self._fd )
+                self._fd = None
+
+
+    #=========================================================================
+    def flush( self ):
+        """
+        Output is written to the file without buffering, so there is nothing
+        to flush.
+        """
+
+        pass
+
+
+    #=========================================================================
+    def redirect( self ):
+        """
+        Captures the process' standard output and standard error (streams and
+        file descriptors) until the capture is closed.
+        """
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        # Python output is written straight to the file
+        self._saved = (
+            sys.stdout,
+            sys.stderr,
+            os.dup( sys.__stdout__.fileno() ),
+            os.dup( sys.__stderr__.fileno() )
+        )
+        sys.stdout = self
+        sys.stderr = self
+
+        # output written to the descriptors (by other programs and extension
+        #   modules) is read from a pipe
+        ( reader, writer ) = os.pipe()
+        os.dup2( writer, sys.__stdout__.fileno() )
+        os.dup2( writer, sys.__stderr__.fileno() )
+        os.close( writer )
+        self._pump = threading.Thread(
+            target = self._read,
+            args   = ( reader, )
+        )
+        self._pump.daemon = True
+        self._pump.start()
+
+
+    #=========================================================================
+    def write( self, data ):
+        """
+        Appends output to the file.  Output beyond the size cap is discarded.
+        @param data     The output (string)
+        """
+
+        if isinstance( data, unicode ) == True:
+            data = data.encode( 'utf-8', 'replace' )
+
+        with self._lock:
+            if ( self._fd is None ) or ( self.size >= self.limit ):
+                return
+            room = self.limit - len( _TRUNCATED ) - self.size
+            if len( data ) > room:
+                data = data[ : max( 0, room ) ] + _TRUNCATED
+            try:
+                os.write( self._fd, data )
+            except OSError:
+                pass
+            self.size += len( data )
+
+
+    #=========================================================================
+    def _read( self, reader ):
+        """
+        Copies output from the redirected file descriptors' pipe to the file
+        (until every writer has closed the pipe).
+        @param reader   The read end of the pipe
+        """
+
+        while True:
+            try:
+                data = os.read( reader, _pump_size )
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                break
+            if len( data ) == 0:
+                break
+            self.write( data )
+        os.close( reader )
+
+
+    #=========================================================================
+    def _restore( self ):
+        """
+        Restores the process' standard output and standard error.
+        """
+
+        ( stdout, stderr, stdout_fd, stderr_fd ) = self._saved
+        self._saved = None
+
+        sys.stdout = stdout
+        sys.stderr = stderr
+        stdout.flush()
+        stderr.flush()
+
+        # closing the last copies of the pipe's write end lets the pump read
+        #   the rest of the output (programs the task left running may keep
+        #   their copies, and the rest of their output is discarded)
+        os.dup2( stdout_fd, sys.__stdout__.fileno() )
+        os.dup2( stderr_fd, sys.__stderr__.fileno() )
+        os.close( stdout_fd )
+        os.close( stderr_fd )
+        self._pump.join( _drain_time )
+        self._pump = None
+
+
+#=============================================================================
+class _Dispatcher( object ):
+    """
+    Replaces a standard stream in a host process.  Output is written to the
+    capture of the calling thread's task, or to the original stream.
+    """
+
+
+    #=========================================================================
+    def __init__( self, stream ):
+        """
+        Constructor.
+        @param stream   The original stream
+        """
+
+        self.stream = stream
+
+
+    #=========================================================================
+    def __getattr__( self, name ):
+        """
+        Provides the original stream's other attributes.
+        @param name     The attribute name
+        @return         The original stream's attribute
+        """
+
+        return getattr( self.stream, name )
+
+
+    #=========================================================================
+    def flush( self ):
+        """
+        Flushes the original stream (captures are not buffered).
+        """
+
+        if getattr( _local, 'capture', None ) is None:
+            self.stream.flush()
+
+
+    #=========================================================================
+    def write( self, data ):
+        """
+        Writes output for the calling thread's task.
+        @param data     The output (string)
+        """
+
+        capture = getattr( _local, 'capture', None )
+        if capture is None:
+            self.stream.write( data )
+        else:
+            capture.write( data )
+
+
+    #=========================================================================
+    def writelines( self, lines ):
+        """
+        Writes a sequence of strings for the calling thread's task.
+        @param lines    The strings
+        """
+
+        for line in lines:
+            self.write( line )
+
+
+#=============================================================================
+def clear( directory ):
+    """
+    Creates the output directory, or removes the files left in it.
+    @param directory    The path of the output directory
+    """
+
+    if os.path.isdir( directory ) == False:
+        os.makedirs( directory )
+        return
+
+    for name in os.listdir( directory ):
+        remove( os.path.join( directory, name ) )
+
+
+#=============================================================================
+def create( descriptor ):
+    """
+    Starts capturing a task's output, if the task descriptor asks for it.
+    @param descriptor   Task descriptor
+    @return             The capture, or None if output is not captured (or
+                        the output file can not be created)
+    """
+
+    if descriptor.get( 'output' ) is None:
+        return None
+
+    ( path, limit ) = descriptor[ 'output' ]
+    try:
+        return Capture( path, limit )
+    except OSError:
+        return None
+
+
+#=============================================================================
+def find( directory, task_id, authkey ):
+    """
+    Finds a task's output file.
+    @param directory    The path of the output directory
+    @param task_id      The task's ID
+    @param authkey      The requester's auth key
+    @return             The path of the file, or None if the task has no
+                        output file (or is owned by another key)
+    """
+
+    # task IDs are digits, so they can not reach outside the directory
+    if ( isinstance( task_id, basestring ) == False ) \
+        or ( task_id.isdigit() == False ):
+        return None
+
+    path = get_path( directory, task_id, authkey )
+    if os.path.isfile( path ) == False:
+        return None
+    return path
+
+
+#=============================================================================
+def get_response( directory, req ):
+    """
+    Answers a request for a range of a task's output.
+    @param directory    The path of the output directory
+    @param req          The output request object
+    @return             The response dict (the data is a buffer of the
+                        mapped range)
+    """
+
+    response = { 'response' : 'output', 'taskid' : req.taskid }
+
+    # check the requested range
+    offset = 0 if req.offset is None else req.offset
+    length = READ_SIZE if req.length is None else req.length
+    if ( type( offset ) not in ( int, long ) ) \
+        or ( type( length ) not in ( int, long ) ) or ( length < 0 ):
+        return dict( response, status = 'error', message = 'invalid range' )
+
+    # find and read the output file
+    path = find( directory, req.taskid, req.key )
+    if path is None:
+        return dict( response, status = 'error', message = 'no output' )
+    try:
+        ( offset, size, data ) = read( path, offset, length )
+    except ( IOError, OSError ):
+        return dict( response, status = 'error', message = 'no output' )
+
+    # the next offset lets clients follow the output
+    return dict(
+        response,
+        status = 'ok',
+        offset = offset,
+        next   = offset + len( data ),
+        size   = size,
+        data   = data
+    )
+
+
+#=============================================================================
+def get_path( directory, task_id, authkey ):
+    """
+    Get the path of a task's output file.
+    @param directory    The path of the output directory
+    @param task_id      The task's ID
+    @param authkey      The task owner's auth key
+    @return             The path of the file
+    """
+
+    if isinstance( authkey, unicode ) == True:
+        authkey = authkey.encode( 'utf-8' )
+    digest = hashlib.sha1( authkey or '' ).hexdigest()[ : 16 ]
+    return os.path.join( directory, '%s-%s' % ( task_id, digest ) )
+
+
+#=============================================================================
+def install():
+    """
+    Replaces sys.stdout and sys.stderr so output from each thread can be sent
+    to the capture of the task it is running (see select()).
+    """
+
+    if isinstance( sys.stdout, _Dispatcher ) == False:
+        sys.stdout = _Dispatcher( sys.stdout )
+    if isinstance( sys.stderr, _Dispatcher ) == False:
+        sys.stderr = _Dispatcher( sys.stderr )
+
+
+#=============================================================================
+def read( path, offset = 0, length = READ_SIZE ):
+    """
+    Maps a range of an output file.  Only the range is mapped, so large
+    files are never loaded whole.
+    @param path         The path of the file
+    @param offset       The offset of the range (negative to count back
+                        from the end of the file)
+    @param length       The maximum size of the range (at most MAX_READ)
+    @return             A tuple of the range's offset, the file's size, and
+                        a buffer of the range (the mapping is released with
+                        the buffer)
+    @throws IOError, OSError
+                        The file can not be read
+    """
+
+    with open( path, 'rb' ) as output:
+        size = os.fstat( output.fileno() ).st_size
+
+        # find the range within the file
+        if offset < 0:
+            offset = max( 0, size + offset )
+        offset = min( offset, size )
+        length = max( 0, min( length, MAX_READ, size - offset ) )
+        if length == 0:
+            return ( offset, size, buffer( '' ) )
+
+        # map the pages that hold the range
+        base = offset - ( offset % mmap.ALLOCATIONGRANULARITY )
+        view = mmap.mmap(
+            output.fileno(),
+            offset + length - base,
+            access = mmap.ACCESS_READ,
+            offset = base
+        )
+
+    return ( offset, size, buffer( view, offset - base, length ) )
+
+
+#=============================================================================
+def remove( path ):
+    """
+    Removes an output file (if it exists).
+    @param path         The path of the file
+    """
+
+    try:
+        os.unlink( path )
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+#=============================================================================
+def select( capture ):
+    """
+    Sets the capture that receives the calling thread's output (in a process
+    that called install()).
+    @param capture      The capture (None to write to the original streams)
+    """
+
+    _local.capture = capture
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import shutil
+    import subprocess
+    import tempfile
+
+    directory = tempfile.mkdtemp( prefix = 'aptask' )
+    path      = get_path( directory, '1', 'userkey' )
+
+    # capture Python output, and the output of another program
+    capture = Capture( path, 256 )
+    capture.redirect()
+    print 'hello from the task'
+    subprocess.call( [ 'echo', 'hello from a program' ] )
+    capture.close()
+    print 'found:', find( directory, '1', 'userkey' ) == path
+    print 'other key:', find( directory, '1', 'otherkey' )
+    print 'captured:', repr( str( read( path )[ 2 ] ) )
+
+    # the size cap
+    capture = Capture( path, 256 )
+    for index in range( 100 ):
+        capture.write( 'line %d\n' % index )
+    capture.close()
+    ( offset, size, data ) = read( path, -40 )
+    print 'capped:', offset, size, repr( str( data ) )
+
+    shutil.rmtree( directory )
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    sys.exit( main( sys.argv ) )
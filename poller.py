@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+I/O Readiness Poller
+
+Provides a small, uniform interface to the most scalable readiness
+notification mechanism available on the host.  Linux systems use epoll.
+Other systems use poll.  Neither mechanism is limited by FD_SETSIZE, and the
+cost of each wake up depends on the number of ready descriptors rather than
+the number of registered descriptors.
+
+Any object with a fileno() method (sockets, pipes, IPC connections) may be
+registered.  The registered objects are returned from poll() along with the
+events that are ready.
+"""
+
+
+import errno
+import select
+
+
+#=============================================================================
+READ  = 0x001                       # data is available to read
+WRITE = 0x004                       # data may be written without blocking
+ERROR = 0x008 | 0x010               # error or hang up
+
+
+#=============================================================================
+class Poller( object ):
+    """
+    Readiness poller for file-like objects.
+    """
+
+
+    #=========================================================================
+    def __init__( self ):
+        """
+        Constructor.
+        """
+
+        # prefer epoll (Linux), but fall back to poll
+        if hasattr( select, 'epoll' ) == True:
+            self._poll    = select.epoll()
+            self._scale   = 1.0
+            self._forever = -1
+        else:
+            self._poll    = select.poll()
+            self._scale   = 1000.0
+            self._forever = None
+
+        # table of registered objects by file descriptor
+        self._objects = {}
+
+
+    #=========================================================================
+    def __contains__( self, obj ):
+        """
+        Check if an object is registered.
+        @param obj      The object to check
+        @return         True if the object is registered
+        """
+
+        return obj.fileno() in self._objects
+
+
+    #=========================================================================
+    def __len__( self ):
+        """
+        Support "len" built-in function.
+        @return         Number of registered objects
+        """
+
+        return len( self._objects )
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Releases the poller's resources.
+        """
+
+        if hasattr( self._poll, 'close' ) == True:
+            self._poll.close()
+        self._objects = {}
+
+
+    #=========================================================================
+    def modify( self, obj, events ):
+        """
+        Changes the events monitored for a registered object.
+        @param obj      The registered object
+        @param events   The event mask (READ, WRITE)
+        """
+
+        self._poll.modify( obj.fileno(), events )
+
+
+    #=========================================================================
+    def objects( self ):
+        """
+        Retrieves all registered objects.
+        @return         A list of registered objects
+        """
+
+        return self._objects.values()
+
+
+    #=========================================================================
+    def poll( self, timeout = None ):
+        """
+        Waits for registered objects to become ready.
+        @param timeout  Maximum time to wait in seconds (None to block)
+        @return         A list of ( object, events ) pairs that are ready
+        @throws IOError
+                        The wait was interrupted by a signal (EINTR)
+        """
+
+        # convert the timeout to the mechanism's units
+        if timeout is None:
+            timeout = self._forever
+        else:
+            timeout = max( 0.0, timeout ) * self._scale
+
+        # wait for readiness (poll raises select.error on interruption)
+        try:
+            ready = self._poll.poll( timeout )
+        except select.error as e:
+            raise IOError( e.args[ 0 ], e.args[ 1 ] )
+
+        # map the descriptors back to their objects
+        return [
+            ( self._objects[ fd ], events )
+                for fd, events in ready
+                    if fd in self._objects
+        ]
+
+
+    #=========================================================================
+    def register( self, obj, events = READ ):
+        """
+        Registers an object to be monitored.
+        @param obj      The object to monitor (must implement fileno())
+        @param events   The event mask (READ, WRITE)
+        """
+
+        fd = obj.fileno()
+        self._poll.register( fd, events )
+        self._objects[ fd ] = obj
+
+
+    #=========================================================================
+    def unregister( self, obj ):
+        """
+        Stops monitoring an object.  This must be called before the object's
+        descriptor is closed.
+        @param obj      The registered object
+        """
+
+        fd = obj.fileno()
+        if fd in self._objects:
+            del self._objects[ fd ]
+            try:
+                self._poll.unregister( fd )
+            except ( IOError, OSError, KeyError ):
+                pass
+
+
+#=============================================================================
+def is_interrupt( error ):
+    """
+    Checks if an exception indicates an interrupted system call.
+    @param error        The exception raised by a system call
+    @return             True if the call was interrupted by a signal
+    """
+
+    return ( len( error.args ) > 0 ) and ( error.args[ 0 ] == errno.EINTR )
+
+
+#=============================================================================
+def wait( objects, timeout = None ):
+    """
+    Waits for any of a list of objects to become readable (or hang up).
+    This is intended for short, changing lists of objects where keeping a
+    Poller registration up to date is not worth the trouble.
+    @param objects      A list of objects (with fileno()) or file descriptors
+    @param timeout      Maximum time to wait in seconds (None to block)
+    @return             A list of the objects that are ready
+    @throws IOError
+                        The wait was interrupted by a signal (EINTR)
+    """
+
+    # register each object's descriptor
+    poll  = select.poll()
+    table = {}
+    for obj in objects:
+        if isinstance( obj, ( int, long ) ) == True:
+            fd = obj
+        else:
+            fd = obj.fileno()
+        poll.register( fd, READ )
+        table[ fd ] = obj
+
+    # convert the timeout to milliseconds
+    if timeout is not None:
+        timeout = max( 0.0, timeout ) * 1000.0
+
+    # wait for readiness
+    try:
+        ready = poll.poll( timeout )
+    except select.error as e:
+        raise IOError( e.args[ 0 ], e.args[ 1 ] )
+
+    # return the ready objects
+    return [ table[ fd ] for fd, events in ready ]
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import os
+
+    ( rfd, wfd ) = os.pipe()
+    reader = os.fdopen( rfd, 'rb', 0 )
+    writer = os.fdopen( wfd, 'wb', 0 )
+
+    poller = Poller()
+    poller.register( reader, READ )
+    poller.register( writer, WRITE )
+
+    print 'before write:', [ ( o.mode, e ) for o, e in poller.poll( 0 ) ]
+    writer.write( 'x' )
+    print 'after write:', [ ( o.mode, e ) for o, e in poller.poll( 0 ) ]
+
+    poller.unregister( writer )
+    poller.close()
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
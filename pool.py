@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+
+"""
+Worker Process Pool
+
+Tasks are executed in long-lived worker processes that are started before
+they are needed.  An idle worker process waits for a task descriptor from the
+manager, executes the task, sends None to report that it is idle again, and
+waits for the next task.  This avoids creating (and tearing down) a process
+for every task.
+
+Worker processes are replaced after they have executed a configured number
+of tasks (limiting the effects of tasks that leak memory or other resources),
+and when they exit unexpectedly.
+
+When a zygote is given (see the zygote module), worker processes are forked
+from it instead of from the daemon.  Host processes (see the host module) are
+started the same way.
+"""
+
+
+import multiprocessing
+import os
+import time
+
+import host
+import output
+import slot
+import worker
+
+
+#=============================================================================
+_parent_poll = 1.0                  # time between checks for the parent
+
+
+#=============================================================================
+class Process( multiprocessing.Process ):
+    """
+    A persistent worker process.
+    """
+
+
+    #=========================================================================
+    def __init__( self, mode = None ):
+        """
+        Constructor.
+        @param mode     The execution mode of a host process (None for a
+                        worker process)
+        """
+
+        # initialize the parent
+        super( Process, self ).__init__( name = 'aptaskworker' )
+
+        self.mode = mode
+
+        # connection to the process, its exit sentinel, and its status slot
+        self.conn     = None
+        self.sentinel = None
+        self.slot     = None
+
+        # number of tasks sent to the process
+        self.tasks = 0
+
+        # the process' end of the connection
+        self._child = None
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Asks the process to exit (once it is idle).
+        """
+
+        try:
+            self.conn.send( None )
+        except ( IOError, OSError ):
+            pass
+
+
+    #=========================================================================
+    def join( self, timeout = None ):
+        """
+        Wait for the process to exit.
+        @param timeout  Maximum time to wait in seconds (None to block)
+        """
+
+        super( Process, self ).join( timeout )
+
+        # release the connection, sentinel, and slot once the process is gone
+        if ( self.sentinel is not None ) and ( self.is_alive() == False ):
+            self.conn.close()
+            os.close( self.sentinel )
+            self.sentinel = None
+            self.slot.close()
+
+
+    #=========================================================================
+    def run( self ):
+        """
+        Worker process entry point.
+        """
+
+        self.conn.close()
+        if self.mode is None:
+            serve( self._child, self.slot )
+        else:
+            host.serve( self._child, self.mode )
+
+
+    #=========================================================================
+    def run_task( self, descriptor ):
+        """
+        Sends a task to the (idle) process.
+        @param descriptor
+                        Task execution descriptor
+        """
+
+        self.tasks += 1
+        self.conn.send( descriptor )
+
+
+    #=========================================================================
+    def start( self ):
+        """
+        Start the process.
+        """
+
+        # create the IPC connection, and the status slot
+        ( self.conn, self._child ) = multiprocessing.Pipe( True )
+        self.slot = slot.Slot()
+
+        # the worker process holds the only write end of the sentinel pipe,
+        #   so the read end becomes readable (EOF) when the process exits
+        ( self.sentinel, writer ) = os.pipe()
+        super( Process, self ).start()
+        os.close( writer )
+
+        # only the process needs its end of the connection
+        self._child.close()
+        self._child = None
+
+
+#=============================================================================
+class Pool( object ):
+    """
+    Maintains a set of worker processes.
+    """
+
+
+    #=========================================================================
+    def __init__( self, max_tasks = 0, zygote = None ):
+        """
+        Constructor.
+        @param max_tasks
+                        Number of tasks a worker process executes before it
+                        is replaced (0 for unlimited)
+        @param zygote   The forkserver that starts worker processes (None to
+                        start them from this process)
+        """
+
+        self.max_tasks = max_tasks
+        self.zygote    = zygote
+        self.size      = 0
+        self.idle      = []
+
+        # number of live worker processes (idle or busy)
+        self.count = 0
+
+        # lifetime counters
+        self.started  = 0
+        self.recycled = 0
+        self.crashed  = 0
+
+        # total time spent starting processes
+        self._spawn_time = 0.0
+
+
+    #=========================================================================
+    def acquire( self ):
+        """
+        Removes an idle worker process from the pool.  A new process is
+        started if no process is idle.
+        @return         The worker process
+        """
+
+        # skip idle processes that have exited
+        while len( self.idle ) > 0:
+            process = self.idle.pop()
+            if process.is_alive() == True:
+                return process
+            self.crashed += 1
+            self._retire( process )
+
+        return self._spawn()
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Stops all idle worker processes.  Busy processes are stopped when
+        they are released.
+        """
+
+        self.resize( 0 )
+
+
+    #=========================================================================
+    def get_stats( self ):
+        """
+        Get the pool's statistics.
+        @return         A dict of process counts
+        """
+
+        if self.started > 0:
+            spawn = self._spawn_time / self.started
+        else:
+            spawn = None
+
+        return {
+            'processes' : self.count,
+            'idle'      : len( self.idle ),
+            'started'   : self.started,
+            'recycled'  : self.recycled,
+            'crashed'   : self.crashed,
+            'spawn'     : spawn
+        }
+
+
+    #=========================================================================
+    def release( self, process ):
+        """
+        Returns a worker process to the pool after its task is finished.
+        @param process  The worker process
+        """
+
+        # processes that exited are replaced
+        if process.is_alive() == False:
+            self.crashed += 1
+            self._retire( process )
+
+        # processes that have executed enough tasks are replaced
+        elif ( self.max_tasks > 0 ) and ( process.tasks >= self.max_tasks ):
+            self.recycled += 1
+            self._retire( process )
+
+        # processes beyond the pool's size are stopped
+        elif self.count > self.size:
+            self._retire( process )
+
+        # the process waits for another task
+        else:
+            self.idle.append( process )
+
+        self._fill()
+
+
+    #=========================================================================
+    def resize( self, size ):
+        """
+        Changes the number of worker processes kept in the pool.
+        @param size     The number of worker processes
+        """
+
+        self.size = size
+        while ( self.count > self.size ) and ( len( self.idle ) > 0 ):
+            self._retire( self.idle.pop( 0 ) )
+        self._fill()
+
+
+    #=========================================================================
+    def _fill( self ):
+        """
+        Starts worker processes until the pool is full.
+        """
+
+        while self.count < self.size:
+            self.idle.append( self._spawn() )
+
+
+    #=========================================================================
+    def _retire( self, process ):
+        """
+        Stops a worker process.
+        @param process  The worker process
+        """
+
+        process.close()
+        process.join()
+        self.count -= 1
+
+
+    #=========================================================================
+    def _spawn( self ):
+        """
+        Starts a new worker process.
+        @return         The worker process
+        """
+
+        start = time.time()
+        if self.zygote is not None:
+            process = self.zygote.fork()
+        else:
+            process = Process()
+            process.start()
+        self._spawn_time += time.time() - start
+        self.count       += 1
+        self.started     += 1
+        return process
+
+
+#=============================================================================
+def serve( conn, status_slot ):
+    """
+    Function to execute as a worker process.
+    @param conn         IPC connection to the parent process
+    @param status_slot  Shared memory slot for the latest status report
+    """
+
+    # the parent may exit without asking (other processes it started may
+    #   hold copies of its end of the connection, so there may be no EOF)
+    parent = os.getppid()
+
+    while True:
+
+        # wait for the next task (None asks the process to exit)
+        try:
+            if conn.poll( _parent_poll ) == False:
+                if os.getppid() != parent:
+                    break
+                continue
+            message = conn.recv()
+        except ( EOFError, IOError ):
+            break
+        if message is None:
+            break
+
+        # commands for a task that has already finished are ignored
+        if type( message ) is not dict:
+            continue
+
+        # execute the task (capturing its output), then report that the
+        #   process is idle
+        capture = output.create( message )
+        if capture is not None:
+            capture.redirect()
+        try:
+            worker.worker( conn, status_slot, message )
+        finally:
+            if capture is not None:
+                capture.close()
+        conn.send( None )
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import sys
+
+    import configuration
+
+    # the worker processes import tasks from the configured directory
+    config = configuration.load_configuration( 'aptaskd.json' )
+    sys.path.append( config.get_path( 'tasks' ) )
+
+    workers = Pool( max_tasks = 2 )
+    workers.resize( 2 )
+    print 'started:', workers.get_stats()
+
+    # run a few tasks through the pool to exercise recycling
+    start = time.time()
+    for index in range( 5 ):
+        wrkr = worker.Worker(
+            worker.create_task_descriptor( 'DevTask', { 'devarg' : index } )
+        )
+        wrkr.start( workers.acquire() )
+        wrkr.stop()
+        wrkr.join()
+        print 'task %d:' % index, wrkr.get_status().message
+        workers.release( wrkr.process )
+    print 'elapsed: %.3f' % ( time.time() - start )
+    print 'recycled:', workers.get_stats()
+
+    workers.close()
+    print 'closed:', workers.get_stats()
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
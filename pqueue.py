@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""
+Indexed Priority Queue
+
+Implements a priority queue on a binary heap that also tracks the position of
+every key in the heap.  This allows any key to be removed (or looked up) in
+O(log n) time, not just the key at the top of the heap.  Keys with the same
+priority are removed in the order they were added.
+
+Higher priority values are removed first.
+"""
+
+
+#=============================================================================
+class PriorityQueue( object ):
+    """
+    Binary heap of keys ordered by priority, then by insertion order.
+    """
+
+
+    #=========================================================================
+    def __init__( self ):
+        """
+        Constructor.
+        """
+
+        # heap of [ negated priority, sequence number, key ] entries
+        self.heap  = []
+
+        # position of each key's entry in the heap
+        self.index = {}
+
+        # insertion counter (keeps the order stable within a priority)
+        self._seq = 0
+
+
+    #=========================================================================
+    def __contains__( self, key ):
+        """
+        Membership test support.
+        @param key      The key to check
+        @return         True if the key is in the queue
+        """
+
+        return key in self.index
+
+
+    #=========================================================================
+    def __len__( self ):
+        """
+        Length support.
+        @return         The number of keys in the queue
+        """
+
+        return len( self.heap )
+
+
+    #=========================================================================
+    def get_keys( self ):
+        """
+        Get all keys in the order they would be removed.
+        @return         A list of keys
+        """
+
+        return [ entry[ 2 ] for entry in sorted( self.heap ) ]
+
+
+    #=========================================================================
+    def get_priority( self, key ):
+        """
+        Get the priority of a key in the queue.
+        @param key      The key to look up
+        @return         The key's priority (None if the key is not queued)
+        """
+
+        if key not in self.index:
+            return None
+        return -self.heap[ self.index[ key ] ][ 0 ]
+
+
+    #=========================================================================
+    def peek( self ):
+        """
+        Get the next key to be removed without removing it.
+        @return         The next key (None if the queue is empty)
+        """
+
+        if len( self.heap ) == 0:
+            return None
+        return self.heap[ 0 ][ 2 ]
+
+
+    #=========================================================================
+    def pop( self ):
+        """
+        Remove the key with the highest priority.
+        @return         The removed key (None if the queue is empty)
+        """
+
+        if len( self.heap ) == 0:
+            return None
+        return self.remove( self.heap[ 0 ][ 2 ] )
+
+
+    #=========================================================================
+    def push( self, key, priority = 0 ):
+        """
+        Add a key to the queue.
+        @param key      The key to add (must not already be queued)
+        @param priority The key's priority (higher values are removed first)
+        """
+
+        self._seq += 1
+        position = len( self.heap )
+        self.heap.append( [ -priority, self._seq, key ] )
+        self.index[ key ] = position
+        self._sift_up( position )
+
+
+    #=========================================================================
+    def remove( self, key ):
+        """
+        Remove a key from anywhere in the queue.
+        @param key      The key to remove
+        @return         The removed key (None if the key is not queued)
+        """
+
+        # find the key's entry
+        position = self.index.pop( key, None )
+        if position is None:
+            return None
+
+        # move the last entry into the hole, and restore the heap order
+        last = self.heap.pop()
+        if position < len( self.heap ):
+            self.heap[ position ] = last
+            self.index[ last[ 2 ] ] = position
+            if self._sift_up( position ) == position:
+                self._sift_down( position )
+
+        return key
+
+
+    #=========================================================================
+    def _sift_down( self, position ):
+        """
+        Moves an entry down the heap until its children are lower priority.
+        @param position The entry's position in the heap
+        @return         The entry's new position
+        """
+
+        heap  = self.heap
+        size  = len( heap )
+        entry = heap[ position ]
+        while True:
+            child = ( 2 * position ) + 1
+            if child >= size:
+                break
+            right = child + 1
+            if ( right < size ) and ( heap[ right ] < heap[ child ] ):
+                child = right
+            if entry <= heap[ child ]:
+                break
+            heap[ position ] = heap[ child ]
+            self.index[ heap[ position ][ 2 ] ] = position
+            position = child
+        heap[ position ] = entry
+        self.index[ entry[ 2 ] ] = position
+        return position
+
+
+    #=========================================================================
+    def _sift_up( self, position ):
+        """
+        Moves an entry up the heap until its parent is higher priority.
+        @param position The entry's position in the heap
+        @return         The entry's new position
+        """
+
+        heap  = self.heap
+        entry = heap[ position ]
+        while position > 0:
+            parent = ( position - 1 ) >> 1
+            if heap[ parent ] <= entry:
+                break
+            heap[ position ] = heap[ parent ]
+            self.index[ heap[ position ][ 2 ] ] = position
+            position = parent
+        heap[ position ] = entry
+        self.index[ entry[ 2 ] ] = position
+        return position
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import random
+
+    queue = PriorityQueue()
+    for index in range( 10 ):
+        queue.push( str( index ), index % 3 )
+    print 'order:', queue.get_keys()
+
+    queue.remove( '5' )
+    queue.remove( '0' )
+    print 'removed 5 and 0:', queue.get_keys()
+    print 'pop:', queue.pop(), queue.pop()
+
+    # check the heap order against a sorted list after random removals
+    queue      = PriorityQueue()
+    priorities = {}
+    for index in range( 2000 ):
+        priorities[ index ] = random.randint( -5, 5 )
+        queue.push( index, priorities[ index ] )
+    for index in random.sample( range( 2000 ), 1000 ):
+        queue.remove( index )
+        del priorities[ index ]
+    popped = []
+    while len( queue ) > 0:
+        popped.append( queue.pop() )
+    expected = sorted( priorities, key = lambda k: ( -priorities[ k ], k ) )
+    print 'random removals:', popped == expected
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
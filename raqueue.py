@@ -61,8 +61,7 @@ class RandomAccessQueue( dict ):
         """
 
         # determine a suitable item key string
-        key = str( self._next_id )
-        self._next_id += 1
+        key = self._next_key()
 
         # store the session item for hash-based (random) dequeuing later
         self[ key ] = item
@@ -87,3 +86,25 @@ class RandomAccessQueue( dict ):
 
         # return the item
         return item
+
+
+    #=========================================================================
+    def reserve( self ):
+        """
+        Reserves an access key for an item that is not added to the queue.
+        @return         A unique access key string
+        """
+
+        return self._next_key()
+
+
+    #=========================================================================
+    def _next_key( self ):
+        """
+        Generates the key for the next item added to the queue.
+        @return         A unique access key string
+        """
+
+        key = str( self._next_id )
+        self._next_id += 1
+        return key
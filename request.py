@@ -5,7 +5,7 @@ Request Parsing and Abstraction
 """
 
 
-import json
+import codec
 
 
 #=============================================================================
@@ -16,27 +16,49 @@ class Request( object ):
 
 
     #=========================================================================
-    def __init__( self, string ):
+    def __init__( self, string, encoding = codec.JSON ):
         """
         Constructor.
-        @param string   Request data as a string
+        @param string   Request data as a string (or an already-parsed dict)
+        @param encoding The request data's encoding (see the codec module)
         """
 
         # default attributes
-        self.key     = None
-        self.request = None
+        self.key      = None
+        self.request  = None
+        self._message = None
 
-        # attempt to parse request data
-        try:
-            req = json.loads( string )
-        except ValueError:
-            self.valid_syntax = False
-        else:
+        # requests from a batch are already parsed
+        if type( string ) is dict:
+            req = string
             self.valid_syntax = True
 
-            # load request data into object
-            for k, v in req.items():
-                setattr( self, k, v )
+        # attempt to parse request data
+        else:
+            try:
+                req = codec.loads( string, encoding )
+            except ValueError:
+                self.valid_syntax = False
+            else:
+                self.valid_syntax = type( req ) is dict
+
+        # field names must be strings (binary messages may use other keys)
+        if self.valid_syntax == True:
+            for k in req:
+                if isinstance( k, basestring ) == False:
+                    self.valid_syntax = False
+                    break
+
+        # load request data into object (names that can not be attributes
+        #   make the request invalid)
+        if self.valid_syntax == True:
+            try:
+                for k, v in req.items():
+                    setattr( self, k, v )
+            except UnicodeError:
+                self.valid_syntax = False
+            else:
+                self._message = req
 
 
     #=========================================================================
@@ -50,6 +72,16 @@ class Request( object ):
         return None
 
 
+    #=========================================================================
+    def get_message( self ):
+        """
+        Retrieves the parsed request data.
+        @return         The request dict (None if the request is not valid)
+        """
+
+        return self._message
+
+
     #=========================================================================
     def is_valid( self ):
         """
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+
+"""
+Shared Memory Message Rings
+
+Requests and responses are passed between the daemon and each network
+process through a pair of ring buffers in anonymous shared memory (created
+before the network process is started, so both processes share it).  Each
+ring has exactly one producer and one consumer.  A message is copied into the
+ring by its producer, and out of the ring by its consumer, without being
+pickled.
+
+Each message is stored as a fixed header (session ID, encoding, and payload
+length) followed by the payload.  A ring's producer owns the head counter,
+and its consumer owns the tail counter, so neither needs a lock.  A doorbell
+pipe wakes the consumer when messages are added, and can be polled along with
+sockets and other pipes.
+
+When a ring is full, messages are kept in the producer's backlog.  The
+producer sets the ring's waiting flag, and the consumer rings the producer's
+doorbell once it has made space.
+"""
+
+
+import collections
+import errno
+import fcntl
+import mmap
+import os
+import struct
+
+
+#=============================================================================
+COUNTER = struct.Struct( '!Q' )         # head and tail counters
+RECORD  = struct.Struct( '!16sBI' )     # session ID, encoding, and length
+
+_HEAD    = 0                            # offset of the head counter
+_TAIL    = 8                            # offset of the tail counter
+_WAITING = 16                           # offset of the waiting flag
+_DATA    = 64                           # offset of the data area
+
+
+#=============================================================================
+class Ring( object ):
+    """
+    Single-producer, single-consumer message ring.
+    """
+
+
+    #=========================================================================
+    def __init__( self, size ):
+        """
+        Constructor.
+        @param size     The size of the shared memory area (bytes)
+        """
+
+        self.capacity = size - _DATA
+        self._map     = mmap.mmap( -1, size )
+
+        # positions owned by the producer and the consumer
+        self._head = 0
+        self._tail = 0
+
+        # the doorbell never blocks (a full doorbell is still ringing)
+        ( self._bell_r, self._bell_w ) = os.pipe()
+        for fd in ( self._bell_r, self._bell_w ):
+            flags = fcntl.fcntl( fd, fcntl.F_GETFL )
+            fcntl.fcntl( fd, fcntl.F_SETFL, flags | os.O_NONBLOCK )
+
+
+    #=========================================================================
+    def clear( self ):
+        """
+        Clears the doorbell (used by the consumer before reading messages).
+        """
+
+        try:
+            while len( os.read( self._bell_r, 4096 ) ) == 4096:
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Releases the ring's resources.
+        """
+
+        os.close( self._bell_r )
+        os.close( self._bell_w )
+        self._map.close()
+
+
+    #=========================================================================
+    def fileno( self ):
+        """
+        Support polling on the ring (for the consumer).
+        @return         The doorbell's file descriptor
+        """
+
+        return self._bell_r
+
+
+    #=========================================================================
+    def fits( self, length ):
+        """
+        Checks if a message can ever be stored in the ring.
+        @param length   The length of the message's payload
+        @return         True if the message fits in an empty ring
+        """
+
+        return ( RECORD.size + length ) <= self.capacity
+
+
+    #=========================================================================
+    def get( self ):
+        """
+        Removes all available messages from the ring (used by the consumer).
+        @return         A list of ( sid, encoding, payload ) tuples
+        """
+
+        records = []
+
+        # read messages up to the producer's head
+        head = COUNTER.unpack_from( self._map, _HEAD )[ 0 ]
+        tail = self._tail
+        while tail < head:
+            ( sid, encoding, length ) = RECORD.unpack(
+                self._read( tail, RECORD.size )
+            )
+            tail += RECORD.size
+            records.append(
+                ( sid.rstrip( '\0' ), encoding, self._read( tail, length ) )
+            )
+            tail += length
+
+        # release the space to the producer
+        if tail != self._tail:
+            self._tail = tail
+            COUNTER.pack_into( self._map, _TAIL, tail )
+
+        return records
+
+
+    #=========================================================================
+    def is_waiting( self ):
+        """
+        Checks the flag that the producer is waiting for space.
+        @return         True if the producer is waiting
+        """
+
+        return self._map[ _WAITING ] != '\0'
+
+
+    #=========================================================================
+    def put( self, sid, encoding, payload ):
+        """
+        Adds a message to the ring (used by the producer).
+        @param sid      The message's session ID (at most 16 characters)
+        @param encoding The encoding of the payload (see the codec module)
+        @param payload  The message payload
+        @return         True if the message was added, False if the ring does
+                        not have enough space
+        """
+
+        # check for space
+        size = RECORD.size + len( payload )
+        tail = COUNTER.unpack_from( self._map, _TAIL )[ 0 ]
+        if ( self.capacity - ( self._head - tail ) ) < size:
+            return False
+
+        # copy the message into the ring, then publish it to the consumer
+        self._write( self._head, RECORD.pack( sid, encoding, len( payload ) ) )
+        self._write( self._head + RECORD.size, payload )
+        self._head += size
+        COUNTER.pack_into( self._map, _HEAD, self._head )
+
+        # wake the consumer
+        self.ring()
+        return True
+
+
+    #=========================================================================
+    def ring( self ):
+        """
+        Rings the doorbell.
+        """
+
+        try:
+            os.write( self._bell_w, '\0' )
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+
+    #=========================================================================
+    def set_waiting( self, waiting ):
+        """
+        Sets or clears the flag that the producer is waiting for space.
+        @param waiting  True when the producer is waiting
+        """
+
+        self._map[ _WAITING ] = '\1' if waiting == True else '\0'
+
+
+    #=========================================================================
+    def _read( self, position, length ):
+        """
+        Copies data out of the ring.
+        @param position The stream position of the data
+        @param length   The length of the data
+        @return         The data (string)
+        """
+
+        start = _DATA + ( position % self.capacity )
+        end   = start + length
+        limit = _DATA + self.capacity
+        if end <= limit:
+            return self._map[ start : end ]
+        first = self._map[ start : limit ]
+        return first + self._map[ _DATA : _DATA + length - len( first ) ]
+
+
+    #=========================================================================
+    def _write( self, position, data ):
+        """
+        Copies data into the ring.
+        @param position The stream position of the data
+        @param data     The data (string)
+        """
+
+        start = _DATA + ( position % self.capacity )
+        end   = start + len( data )
+        limit = _DATA + self.capacity
+        if end <= limit:
+            self._map[ start : end ] = data
+        else:
+            split = limit - start
+            self._map[ start : limit ] = data[ : split ]
+            self._map[ _DATA : _DATA + len( data ) - split ] = data[ split : ]
+
+
+#=============================================================================
+class Endpoint( object ):
+    """
+    One process's end of a pair of rings (one inbound, one outbound).
+    """
+
+
+    #=========================================================================
+    def __init__( self, inbound, outbound ):
+        """
+        Constructor.
+        @param inbound  The ring this end consumes
+        @param outbound The ring this end produces
+        """
+
+        self.inbound  = inbound
+        self.outbound = outbound
+        self.backlog  = collections.deque()
+
+
+    #=========================================================================
+    def fileno( self ):
+        """
+        Support polling on the endpoint.
+        @return         The inbound ring's doorbell file descriptor
+        """
+
+        return self.inbound.fileno()
+
+
+    #=========================================================================
+    def flush( self ):
+        """
+        Moves messages from the backlog into the outbound ring.
+        @return         True if the backlog is empty
+        """
+
+        while len( self.backlog ) > 0:
+
+            # move the next message into the ring
+            if self.outbound.put( *self.backlog[ 0 ] ) == True:
+                self.backlog.popleft()
+                continue
+
+            # ask to be woken when there is space, and make sure the
+            #   consumer did not make space before it could see the request
+            self.outbound.set_waiting( True )
+            if self.outbound.put( *self.backlog[ 0 ] ) == False:
+                return False
+            self.backlog.popleft()
+
+        return True
+
+
+    #=========================================================================
+    def receive( self ):
+        """
+        Receives all available messages.  This also moves backlogged messages
+        into the outbound ring when there is space.
+        @return         A list of ( sid, encoding, payload ) tuples
+        """
+
+        # clear the doorbell before reading so no message is missed
+        self.inbound.clear()
+        records = self.inbound.get()
+
+        # wake the other end if it is waiting for the space just released
+        if self.inbound.is_waiting() == True:
+            self.inbound.set_waiting( False )
+            self.outbound.ring()
+
+        # send any backlogged messages
+        self.flush()
+
+        return records
+
+
+    #=========================================================================
+    def send( self, sid, encoding, payload ):
+        """
+        Sends a message to the other end.
+        @param sid      The message's session ID
+        @param encoding The encoding of the payload (see the codec module)
+        @param payload  The message payload
+        @return         True if the message was sent (or queued), False if it
+                        is too large to ever fit in the ring
+        """
+
+        if self.outbound.fits( len( payload ) ) == False:
+            return False
+        self.backlog.append( ( sid, encoding, payload ) )
+        self.flush()
+        return True
+
+
+#=============================================================================
+def channel( size ):
+    """
+    Creates a pair of connected endpoints (similar to multiprocessing.Pipe).
+    This must be called before the process that uses the other end is
+    started.
+    @param size         The size of each ring (bytes)
+    @return             A tuple of the two endpoints
+    """
+
+    first  = Ring( size )
+    second = Ring( size )
+    return ( Endpoint( first, second ), Endpoint( second, first ) )
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import select
+
+    ( parent, child ) = channel( 256 )
+
+    # fill the ring past its capacity to exercise wrapping and the backlog
+    for index in range( 8 ):
+        child.send( '0:%d' % index, 0, 'request %d' % index )
+    print 'backlog:', len( child.backlog )
+    print 'waiting:', child.outbound.is_waiting()
+    print 'ready:', select.select( [ parent ], [], [], 0 )[ 0 ] == [ parent ]
+
+    # the parent's receive wakes the child, which sends the rest
+    received = parent.receive()
+    woken = select.select( [ child ], [], [], 0 )[ 0 ]
+    print 'wakes child:', woken == [ child ]
+    child.receive()
+    received.extend( parent.receive() )
+    print 'received:', [ r[ 0 ] for r in received ]
+    print 'too large:', child.send( '0:9', 0, 'x' * 256 )
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
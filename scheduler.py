@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""
+Fair-Share Task Scheduling
+
+Decides which waiting task gets the next free worker slot.  Waiting tasks are
+kept in a separate queue for each auth key (ordered by the task's priority,
+then by arrival), and the keys take turns in proportion to their weights
+(weighted fair queuing).  One key that requests thousands of tasks does not
+keep the other keys' tasks waiting behind all of them.
+
+Each key has a virtual "pass" time that advances by the inverse of its weight
+every time one of its tasks is started.  The key with the lowest pass is
+served next.  A key that becomes ready again (after having no waiting tasks,
+or after reaching its worker limit) starts at the current virtual time, so it
+can not save up turns while it is idle.
+
+Only keys that are ready to start a task are kept in the scheduling heap, so
+each scheduling decision takes O(log k) time for k keys.
+"""
+
+
+import heapq
+
+import pqueue
+
+
+#=============================================================================
+class FairScheduler( object ):
+    """
+    Weighted fair queue of waiting tasks across auth keys.
+    """
+
+
+    #=========================================================================
+    def __init__( self, weights = None, limit = 0, limits = None ):
+        """
+        Constructor.
+        @param weights  Dict of scheduling weights by auth key (default 1)
+        @param limit    Maximum number of running tasks for each auth key
+                        (0 for unlimited)
+        @param limits   Dict of maximum running tasks for individual keys
+        """
+
+        self.weights = weights if weights is not None else {}
+        self.limit   = limit
+        self.limits  = limits if limits is not None else {}
+
+        # queues of waiting task IDs by auth key
+        self.queues = {}
+
+        # auth key of each waiting task
+        self.owners = {}
+
+        # number of running tasks by auth key
+        self.running = {}
+
+        # virtual pass time by auth key, and the current virtual time
+        self.passes = {}
+        self.vtime  = 0.0
+
+        # keys with waiting tasks that may start another task
+        self.ready = pqueue.PriorityQueue()
+
+
+    #=========================================================================
+    def __len__( self ):
+        """
+        Length support.
+        @return         The number of waiting tasks
+        """
+
+        return len( self.owners )
+
+
+    #=========================================================================
+    def get_keys( self ):
+        """
+        Get all waiting task IDs in the order they are expected to start.
+        The order assumes no key reaches its worker limit.
+        @return         A list of task IDs
+        """
+
+        # merge the keys' queues by simulating the scheduler's turns (ties
+        #   are broken in the order keys joined the schedule)
+        ranks = dict(
+            ( key, rank ) for rank, key in enumerate( self.ready.get_keys() )
+        )
+        turns = [
+            [
+                max( self.passes.get( key, 0.0 ), self.vtime ),
+                ranks.get( key, len( ranks ) ),
+                key,
+                iter( queue.get_keys() )
+            ]
+                for key, queue in self.queues.iteritems()
+        ]
+        heapq.heapify( turns )
+
+        task_ids = []
+        seq      = len( turns )
+        while len( turns ) > 0:
+            turn = turns[ 0 ]
+            task_id = next( turn[ 3 ], None )
+            if task_id is None:
+                heapq.heappop( turns )
+                continue
+            task_ids.append( task_id )
+            seq += 1
+            turn[ 0 ] += 1.0 / self._get_weight( turn[ 2 ] )
+            turn[ 1 ]  = seq
+            heapq.heapreplace( turns, turn )
+
+        return task_ids
+
+
+    #=========================================================================
+    def pop( self ):
+        """
+        Removes the next task to start.
+        @return         The task ID (None if no key may start a task)
+        """
+
+        # take a turn for the key with the lowest pass
+        key = self.ready.pop()
+        if key is None:
+            return None
+        queue   = self.queues[ key ]
+        task_id = queue.pop()
+        del self.owners[ task_id ]
+        if len( queue ) == 0:
+            del self.queues[ key ]
+        self.running[ key ] = self.running.get( key, 0 ) + 1
+
+        # advance the virtual time, and the key's pass
+        self.vtime = self.passes[ key ]
+        self.passes[ key ] += 1.0 / self._get_weight( key )
+
+        # the key waits for its next turn (if it still can)
+        self._update( key )
+
+        return task_id
+
+
+    #=========================================================================
+    def push( self, task_id, key, priority = 0 ):
+        """
+        Adds a waiting task.
+        @param task_id  The task ID
+        @param key      The auth key that requested the task
+        @param priority The task's priority among the key's tasks
+        """
+
+        if key not in self.queues:
+            self.queues[ key ] = pqueue.PriorityQueue()
+        self.queues[ key ].push( task_id, priority )
+        self.owners[ task_id ] = key
+        self._update( key )
+
+
+    #=========================================================================
+    def release( self, key ):
+        """
+        Notes that a running task has been removed.
+        @param key      The auth key that requested the task
+        """
+
+        self.running[ key ] -= 1
+        if self.running[ key ] == 0:
+            del self.running[ key ]
+        self._update( key )
+
+
+    #=========================================================================
+    def remove( self, task_id ):
+        """
+        Removes a waiting task.
+        @param task_id  The task ID
+        @return         The task ID (None if the task is not waiting)
+        """
+
+        key = self.owners.pop( task_id, None )
+        if key is None:
+            return None
+
+        # keys without waiting tasks leave the schedule
+        queue = self.queues[ key ]
+        queue.remove( task_id )
+        if len( queue ) == 0:
+            del self.queues[ key ]
+            self.ready.remove( key )
+
+        return task_id
+
+
+    #=========================================================================
+    def _get_weight( self, key ):
+        """
+        Get the scheduling weight of a key.
+        @param key      The auth key
+        @return         The key's weight
+        """
+
+        return float( self.weights.get( key, 1 ) )
+
+
+    #=========================================================================
+    def _update( self, key ):
+        """
+        Adds a key to the schedule if it has a waiting task, and is under its
+        worker limit.
+        @param key      The auth key
+        """
+
+        # nothing to do if the key is already scheduled, or can not be
+        if ( key in self.ready ) or ( key not in self.queues ):
+            return
+        limit = self.limits.get( key, self.limit )
+        if ( limit > 0 ) and ( self.running.get( key, 0 ) >= limit ):
+            return
+
+        # an idle key starts at the current virtual time
+        self.passes[ key ] = max( self.passes.get( key, 0.0 ), self.vtime )
+        self.ready.push( key, -self.passes[ key ] )
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    sched = FairScheduler( weights = { 'b' : 2 }, limits = { 'c' : 1 } )
+
+    # one key floods the queue before the others request anything
+    for index in range( 100 ):
+        sched.push( 'a%d' % index, 'a' )
+    for index in range( 4 ):
+        sched.push( 'b%d' % index, 'b' )
+        sched.push( 'c%d' % index, 'c' )
+    sched.push( 'b9', 'b', priority = 1 )
+
+    print 'expected:', sched.get_keys()[ : 12 ]
+    started = [ sched.pop() for index in range( 12 ) ]
+    print 'started: ', started
+
+    # the limited key gets another turn once its task is done
+    sched.release( 'c' )
+    print 'released:', sched.pop(), sched.pop()
+    print 'removed:', sched.remove( 'a50' ), sched.remove( 'a50' )
+    print 'waiting:', len( sched )
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
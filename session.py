@@ -21,15 +21,30 @@ import raqueue
 class SessionQueue( raqueue.RandomAccessQueue ):
     """
     Simplifies the process of adding network-specific information to a queue.
+    Session IDs are namespaced by the network process (shard) that owns the
+    session so responses can be routed back to the correct process.
     """
 
 
     #=========================================================================
-    def add( self, address, sock ):
+    def __init__( self, shard = 0 ):
+        """
+        Constructor.
+        @param shard    The number of the network process owning the queue
+        """
+
+        super( SessionQueue, self ).__init__()
+
+        self.shard = shard
+
+
+    #=========================================================================
+    def add( self, address, sock, conn = None ):
         """
         Adds a new session entry to the queue.
         @param address  The standard network address value (tuple)
         @param sock     The connection's socket instance/descriptor/handle
+        @param conn     The connection state object (if any)
         @return         The assigned session ID
         """
 
@@ -41,3 +56,27 @@ class SessionQueue( raqueue.RandomAccessQueue ):
 
         # add the session data to the queue, and return the session ID
         return super( SessionQueue, self ).add( data )
+
+
+    #=========================================================================
+    def _next_key( self ):
+        """
+        Generates the next session ID within this queue's namespace.
+        @return         A session ID string ("<shard>:<number>")
+        """
+
+        return '%d:%s' % (
+            self.shard,
+            super( SessionQueue, self )._next_key()
+        )
+
+
+#=============================================================================
+def get_shard( sid ):
+    """
+    Determines which network process owns a session.
+    @param sid          The session ID
+    @return             The shard number of the owning network process
+    """
+
+    return int( sid.split( ':', 1 )[ 0 ] )
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""
+Latest-Value Status Slots
+
+Each worker process publishes its task's status in a small shared memory
+slot instead of sending every status report through a pipe.  A new report
+replaces the previous one, so the memory used does not depend on how often
+the task reports, and the manager always reads the most recent report in one
+step.
+
+The slot is protected by a sequence number (a "seqlock").  The writer makes
+the sequence number odd while it copies a report into the slot, and even
+again when it is done.  A reader retries if the sequence number was odd, or
+changed while it was copying the report out of the slot.  Retries are
+limited, so a writer that dies while copying a report can not hold up the
+reader: the read finds no new report, and the writer (if it is still alive)
+notifies the reader again when its report is complete.
+
+The slot also has a flag the reader clears before reading.  The writer sets
+the flag after writing a report, and tells the reader (through some other
+channel) only when the flag was clear, so the reader is woken at most once
+between reads.
+"""
+
+
+import mmap
+import os
+import struct
+import tempfile
+
+
+#=============================================================================
+SIZE = 16384                            # default slot size (bytes)
+
+_SEQ    = 0                             # offset of the sequence number
+_LENGTH = 8                             # offset of the report length
+_NOTIFY = 12                            # offset of the notify flag
+_DATA   = 16                            # offset of the report data
+
+_RETRIES = 64                           # reads tried while a value changes
+
+_seq    = struct.Struct( '!Q' )
+_length = struct.Struct( '!I' )
+
+
+#=============================================================================
+class Slot( object ):
+    """
+    Single-writer, single-reader latest-value slot in shared memory.
+    """
+
+
+    #=========================================================================
+    def __init__( self, size = SIZE, fd = None ):
+        """
+        Constructor.
+        @param size     The size of the slot (bytes)
+        @param fd       File descriptor of an existing slot to open (the slot
+                        takes ownership), or None to create a new slot
+        """
+
+        # new slots are backed by an unlinked temporary file, so the slot can
+        #   be passed to an unrelated process as a file descriptor
+        if fd is None:
+            ( fd, path ) = tempfile.mkstemp( prefix = 'aptask' )
+            os.unlink( path )
+            os.ftruncate( fd, size )
+
+        self.capacity = size - _DATA
+        self._fd      = fd
+        self._map     = mmap.mmap( fd, size )
+
+        # the writer's copy of the sequence number
+        self._seq = self.get_seq()
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Releases the slot's resources.
+        """
+
+        if self._map is not None:
+            self._map.close()
+            os.close( self._fd )
+            self._map = None
+
+
+    #=========================================================================
+    def fileno( self ):
+        """
+        Get the slot's file descriptor (for passing the slot to another
+        process).
+        @return         The file descriptor
+        """
+
+        return self._fd
+
+
+    #=========================================================================
+    def get( self, seq = 0 ):
+        """
+        Reads the latest value (used by the reader).  This also clears the
+        notify flag.
+        @param seq      The sequence number of the last value read
+        @return         A tuple of the value's sequence number, and the value
+                        (None if there is no value newer than seq, or the
+                        value kept changing while it was read)
+        """
+
+        self._map[ _NOTIFY ] = '\0'
+
+        for attempt in xrange( _RETRIES ):
+            start = _seq.unpack_from( self._map, _SEQ )[ 0 ]
+            if ( start & 1 ) == 1:
+                continue
+            if start <= seq:
+                return ( seq, None )
+            length = _length.unpack_from( self._map, _LENGTH )[ 0 ]
+            value  = self._map[ _DATA : _DATA + length ]
+            if _seq.unpack_from( self._map, _SEQ )[ 0 ] == start:
+                return ( start, value )
+
+        # the writer is still copying a value (or died while copying it)
+        return ( seq, None )
+
+
+    #=========================================================================
+    def get_seq( self ):
+        """
+        Get the sequence number of the latest value.
+        @return         The sequence number
+        """
+
+        return _seq.unpack_from( self._map, _SEQ )[ 0 ] & ~1
+
+
+    #=========================================================================
+    def put( self, value ):
+        """
+        Replaces the value (used by the writer).
+        @param value    The new value (string)
+        @return         True if the reader should be notified, False if it
+                        has already been notified, or None if the value is
+                        too large for the slot
+        """
+
+        if len( value ) > self.capacity:
+            return None
+
+        # mark the value as changing, copy it, then mark it as complete
+        self._seq += 1
+        _seq.pack_into( self._map, _SEQ, self._seq )
+        _length.pack_into( self._map, _LENGTH, len( value ) )
+        self._map[ _DATA : _DATA + len( value ) ] = value
+        self._seq += 1
+        _seq.pack_into( self._map, _SEQ, self._seq )
+
+        # the reader only needs to be told once between reads
+        if self._map[ _NOTIFY ] == '\0':
+            self._map[ _NOTIFY ] = '\1'
+            return True
+        return False
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import time
+
+    writer = Slot( 256 )
+    reader = Slot( 256, os.dup( writer.fileno() ) )
+
+    print 'empty:', reader.get()
+    notified = [ writer.put( 'report %d' % index ) for index in range( 5 ) ]
+    print 'notified:', notified
+    ( seq, value ) = reader.get()
+    print 'latest:', seq, value
+    print 'unchanged:', reader.get( seq )
+    print 'notify again:', writer.put( 'report 5' )
+    print 'too large:', writer.put( 'x' * 256 )
+
+    # a writer that stops while copying a value does not hold up the reader
+    _seq.pack_into( writer._map, _SEQ, writer.get_seq() + 1 )
+    print 'abandoned:', reader.get( seq )
+
+    # time a burst of updates
+    start = time.time()
+    for index in xrange( 100000 ):
+        writer.put( 'report %d' % index )
+    print 'put: %.2f us' % ( ( time.time() - start ) * 10.0 )
+    start = time.time()
+    for index in xrange( 100000 ):
+        reader.get()
+    print 'get: %.2f us' % ( ( time.time() - start ) * 10.0 )
+
+    writer.close()
+    reader.close()
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
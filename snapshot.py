@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+"""
+Shared Status Snapshot
+
+The task manager publishes a snapshot of its task table (and other read-only
+information) that network processes use to answer read-only requests without
+a round trip through the manager.
+
+A snapshot is stored in two files in the data directory.  The snapshot file
+contains the serialized snapshot data, and is replaced atomically each time
+a new snapshot is published.  The version file is a small, memory-mapped
+counter that is incremented after each publication.  Readers check the
+counter (a shared memory read, no system calls) on each use, and only reload
+the snapshot file when the counter has changed.
+"""
+
+
+import json
+import mmap
+import os
+import struct
+
+
+#=============================================================================
+VERSION = struct.Struct( '!Q' )     # format of the version counter
+
+
+#=============================================================================
+class Writer( object ):
+    """
+    Publishes snapshots (used by the task manager).
+    """
+
+
+    #=========================================================================
+    def __init__( self, filename ):
+        """
+        Constructor.
+        @param filename The name of the snapshot file
+        """
+
+        self.filename = filename
+        self.version  = 0
+
+        # create (or reset) the version file, and map it
+        with open( filename + '.version', 'wb' ) as vf:
+            vf.write( VERSION.pack( self.version ) )
+        self._vfd     = os.open( filename + '.version', os.O_RDWR )
+        self._version = mmap.mmap( self._vfd, VERSION.size )
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Releases the version file mapping.
+        """
+
+        self._version.close()
+        os.close( self._vfd )
+
+
+    #=========================================================================
+    def publish( self, snapshot ):
+        """
+        Publishes a new snapshot.
+        @param snapshot A dictionary of snapshot data (must be JSON-able)
+        """
+
+        # assign the next version to the snapshot
+        self.version += 1
+        snapshot = dict( snapshot, version = self.version )
+
+        # write the snapshot to a temporary file, and move it into place
+        temp = '%s.%d' % ( self.filename, os.getpid() )
+        with open( temp, 'wb' ) as sf:
+            json.dump( snapshot, sf, separators = ( ',', ':' ) )
+        os.rename( temp, self.filename )
+
+        # tell readers a new snapshot is available
+        VERSION.pack_into( self._version, 0, self.version )
+
+
+#=============================================================================
+class Reader( object ):
+    """
+    Loads published snapshots (used by the network processes).
+    """
+
+
+    #=========================================================================
+    def __init__( self, filename ):
+        """
+        Constructor.
+        @param filename The name of the snapshot file
+        """
+
+        self.filename = filename
+        self.version  = 0
+        self.snapshot = None
+        self._version = None
+
+
+    #=========================================================================
+    def get( self ):
+        """
+        Retrieves the most recently published snapshot.
+        @return         The snapshot dictionary (None if none is available)
+        """
+
+        # map the version file when the writer has created it
+        if self._version is None:
+            try:
+                vfd = os.open( self.filename + '.version', os.O_RDONLY )
+            except OSError:
+                return None
+            try:
+                self._version = mmap.mmap(
+                    vfd,
+                    VERSION.size,
+                    access = mmap.ACCESS_READ
+                )
+            except ( mmap.error, ValueError ):
+                return None
+            finally:
+                os.close( vfd )
+
+        # reload the snapshot only when the version changes
+        version = VERSION.unpack_from( self._version, 0 )[ 0 ]
+        if version != self.version:
+            try:
+                with open( self.filename, 'rb' ) as sf:
+                    self.snapshot = json.load( sf )
+            except ( IOError, ValueError ):
+                return self.snapshot
+            self.version = version
+
+        # return the current snapshot
+        return self.snapshot
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import tempfile
+
+    filename = os.path.join( tempfile.mkdtemp(), 'status.snapshot' )
+
+    writer = Writer( filename )
+    reader = Reader( filename )
+
+    print 'before publishing:', reader.get()
+    writer.publish( { 'tasks' : [] } )
+    print 'first version:', reader.get()
+    writer.publish( { 'tasks' : [ 1, 2 ] } )
+    print 'second version:', reader.get()
+
+    writer.close()
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+
+"""
+Task Result Store
+
+A task may leave a result (see task.Task) when it finishes.  Results are
+kept in a content-addressed store in the daemon's data directory: each
+result is saved once, named for the SHA-1 digest of its contents, and each
+task that produced it has a hard link to it named for the task's ID and a
+digest of its owner's key (like the task's output file, see the output
+module).  Tasks with identical results share one copy, and a result is
+removed with the last link to it.
+
+    <data>/results/objects/<digest>
+    <data>/results/tasks/<taskid>-<keydigest>
+
+Results are written by the worker that executed the task, and read by the
+network processes, so they never pass through the task manager.  Reads map
+only the requested range of the result, and the mapped pages are sent to the
+client without being copied (see codec.dump_chunks()).
+"""
+
+
+import errno
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+
+import output
+
+
+#=============================================================================
+READ_SIZE = 1048576                 # default size of a requested range
+MAX_READ  = 16777216                # maximum size of a requested range
+
+_OBJECTS = 'objects'                # directory of result contents
+_TASKS   = 'tasks'                  # directory of links for each task
+
+
+#=============================================================================
+def clear( directory ):
+    """
+    Creates the store, or removes the task links (and unlinked results) left
+    in it.  Results with other links are kept.
+    @param directory    The path of the store's directory
+    """
+
+    for name in ( _OBJECTS, _TASKS ):
+        path = os.path.join( directory, name )
+        if os.path.isdir( path ) == False:
+            os.makedirs( path )
+
+    tasks = os.path.join( directory, _TASKS )
+    for name in os.listdir( tasks ):
+        output.remove( os.path.join( tasks, name ) )
+
+    objects = os.path.join( directory, _OBJECTS )
+    for name in os.listdir( objects ):
+        _release( os.path.join( objects, name ) )
+
+
+#=============================================================================
+def encode( value ):
+    """
+    Converts a task's result to the data that is stored.
+    @param value        The result (strings are stored as they are, other
+                        values are stored as JSON text)
+    @return             The result data (string)
+    """
+
+    if isinstance( value, str ) == True:
+        return value
+    if isinstance( value, unicode ) == True:
+        return value.encode( 'utf-8' )
+    return json.dumps( value )
+
+
+#=============================================================================
+def find( directory, task_id, authkey ):
+    """
+    Finds a task's result.
+    @param directory    The path of the store's directory
+    @param task_id      The task's ID
+    @param authkey      The requester's auth key
+    @return             The path of the task's link to its result, or None if
+                        the task has no result (or is owned by another key)
+    """
+
+    # task IDs are digits, so they can not reach outside the directory
+    if ( isinstance( task_id, basestring ) == False ) \
+        or ( task_id.isdigit() == False ):
+        return None
+
+    path = get_path( directory, task_id, authkey )
+    if os.path.isfile( path ) == False:
+        return None
+    return path
+
+
+#=============================================================================
+def get_object( directory, digest ):
+    """
+    Get the path of a stored result.
+    @param directory    The path of the store's directory
+    @param digest       The result's digest
+    @return             The path of the result
+    """
+
+    return os.path.join( directory, _OBJECTS, digest )
+
+
+#=============================================================================
+def get_path( directory, task_id, authkey ):
+    """
+    Get the path of a task's link to its result.
+    @param directory    The path of the store's directory
+    @param task_id      The task's ID
+    @param authkey      The task owner's auth key
+    @return             The path of the link
+    """
+
+    return output.get_path(
+        os.path.join( directory, _TASKS ),
+        task_id,
+        authkey
+    )
+
+
+#=============================================================================
+def get_response( directory, req ):
+    """
+    Answers a request for a range of a task's result.
+    @param directory    The path of the store's directory
+    @param req          The result request object
+    @return             The response dict (the data is a buffer of the
+                        mapped result)
+    """
+
+    response = { 'response' : 'result', 'taskid' : req.taskid }
+
+    # check the requested range
+    offset = 0 if req.offset is None else req.offset
+    length = READ_SIZE if req.length is None else req.length
+    if ( type( offset ) not in ( int, long ) ) or ( offset < 0 ) \
+        or ( type( length ) not in ( int, long ) ) or ( length < 0 ):
+        return dict( response, status = 'error', message = 'invalid range' )
+
+    # find and map the result
+    path = find( directory, req.taskid, req.key )
+    if path is None:
+        return dict( response, status = 'error', message = 'no result' )
+    try:
+        ( size, data ) = read( path, offset, length )
+    except ( IOError, OSError ):
+        return dict( response, status = 'error', message = 'no result' )
+
+    offset = min( offset, size )
+    return dict(
+        response,
+        status = 'ok',
+        offset = offset,
+        next   = offset + len( data ),
+        size   = size,
+        data   = data
+    )
+
+
+#=============================================================================
+def link( directory, digest, path ):
+    """
+    Adds a link to a stored result.
+    @param directory    The path of the store's directory
+    @param digest       The result's digest
+    @param path         The path of the new link (replaced if it exists)
+    @return             True if the result is stored, False if it has been
+                        removed
+    """
+
+    # the new link replaces the old one in one step
+    temp = path + '.new'
+    output.remove( temp )
+    try:
+        os.link( get_object( directory, digest ), temp )
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+    os.rename( temp, path )
+    return True
+
+
+#=============================================================================
+def put( directory, path, value ):
+    """
+    Stores a task's result.
+    @param directory    The path of the store's directory
+    @param path         The path of the task's link to its result
+    @param value        The result (see encode())
+    @return             The result's digest
+    @throws IOError, OSError
+                        The result can not be stored
+    """
+
+    data   = encode( value )
+    digest = hashlib.sha1( data ).hexdigest()
+
+    # identical results are only stored once
+    if link( directory, digest, path ) == True:
+        return digest
+
+    # the result is written to a temporary file that becomes the stored
+    #   result (unless another task stored the same result first)
+    ( fd, temp ) = tempfile.mkstemp(
+        prefix = '.',
+        dir    = os.path.join( directory, _OBJECTS )
+    )
+    try:
+        with os.fdopen( fd, 'wb' ) as result:
+            result.write( data )
+        os.link( temp, path )
+        try:
+            os.link( temp, get_object( directory, digest ) )
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            link( directory, digest, path )
+    finally:
+        os.unlink( temp )
+
+    return digest
+
+
+#=============================================================================
+def read( path, offset = 0, length = READ_SIZE ):
+    """
+    Maps a range of a stored result.
+    @param path         The path of the result (or a link to it)
+    @param offset       The offset of the range
+    @param length       The maximum size of the range (at most MAX_READ)
+    @return             A tuple of the result's size, and a buffer of the
+                        range (the mapping is released with the buffer)
+    @throws IOError, OSError
+                        The result can not be read
+    """
+
+    with open( path, 'rb' ) as result:
+        size   = os.fstat( result.fileno() ).st_size
+        offset = min( offset, size )
+        length = max( 0, min( length, MAX_READ, size - offset ) )
+        if length == 0:
+            return ( size, buffer( '' ) )
+
+        # map the pages that hold the range
+        base = offset - ( offset % mmap.ALLOCATIONGRANULARITY )
+        view = mmap.mmap(
+            result.fileno(),
+            offset + length - base,
+            access = mmap.ACCESS_READ,
+            offset = base
+        )
+
+    return ( size, buffer( view, offset - base, length ) )
+
+
+#=============================================================================
+def remove( directory, path, digest ):
+    """
+    Removes a link to a stored result, and the result if nothing else links
+    to it.
+    @param directory    The path of the store's directory
+    @param path         The path of the link
+    @param digest       The result's digest
+    """
+
+    output.remove( path )
+    _release( get_object( directory, digest ) )
+
+
+#=============================================================================
+def _release( path ):
+    """
+    Removes a stored result if nothing links to it.
+    @param path         The path of the result
+    """
+
+    try:
+        if os.stat( path ).st_nlink == 1:
+            os.unlink( path )
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import shutil
+
+    directory = tempfile.mkdtemp( prefix = 'aptask' )
+    clear( directory )
+
+    # two tasks with the same result share one copy
+    first  = get_path( directory, '1', 'userkey' )
+    second = get_path( directory, '2', 'userkey' )
+    digest = put( directory, first, { 'answer' : 42 } )
+    print 'stored:', digest, put( directory, second, { 'answer' : 42 } )
+    print 'links:', os.stat( get_object( directory, digest ) ).st_nlink
+    print 'found:', find( directory, '1', 'userkey' ) == first
+    print 'other key:', find( directory, '1', 'otherkey' )
+    print 'read:', [ str( x ) for x in read( first, 2, 8 ) ]
+
+    # a large result is only mapped one range at a time
+    large = get_path( directory, '3', 'userkey' )
+    put( directory, large, os.urandom( 3 * 1048576 ) )
+    ( size, data ) = read( large, 2 * 1048576 + 1 )
+    print 'large:', size, len( data )
+
+    # results are removed with their last link
+    remove( directory, first, digest )
+    print 'after one:', os.path.exists( get_object( directory, digest ) )
+    remove( directory, second, digest )
+    print 'after both:', os.path.exists( get_object( directory, digest ) )
+
+    clear( directory )
+    print 'cleared:', os.listdir( os.path.join( directory, _OBJECTS ) )
+    shutil.rmtree( directory )
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    import sys
+    sys.exit( main( sys.argv ) )
@@ -52,12 +52,15 @@ class Report( data.Data ):
 
 
     #=========================================================================
-    def __init__( self, status = INIT, progress = 0.0, message = None ):
+    def __init__( self, status = INIT, progress = 0.0, message = None,
+        result = None ):
         """
         Constructor.
         @param status   Current task status (ERROR, INIT, RUNNING, DONE)
         @param progress Current task progress (0.0 to 1.0)
         @param message  User-friendly message about progress (string)
+        @param result   Digest of the task's stored result (set by the worker
+                        when the task is done, see the store module)
         """
 
         # load arguments into object state
@@ -84,10 +87,42 @@ class Task( object ):
         getargs         Used to describe acceptable arguments
         initialize      Called to initialize or start the task
         process         Called iteratively until the task is complete
+        run             Generator alternative to process (see below)
     abort, initialize, and process must all return a Report object.
+    Instead of process, child classes may implement run as a generator that
+    yields progress values (0.0 to 1.0), messages (strings), or Report
+    objects as the task advances, and returns when the task is complete.
+    Status reports from run are only sent to the daemon at a minimum
+    interval (or when the task's status or message changes), so the task
+    may yield after every small step.
+    Tasks may leave a result by setting the result attribute before they
+    finish: a string (stored as it is), or any JSON-able value (stored as
+    JSON text).  Clients fetch the result with a result request.
+    Child classes whose results depend only on their arguments may set the
+    cacheable attribute: the daemon then remembers their results (see the
+    cache module), and answers requests to start the same task with the
+    same arguments without executing it again.
+    Child classes may also set the mode attribute to choose how the task is
+    executed:
+        PROCESS         In its own worker process (the default)
+        THREAD          In a thread of a shared host process (for tasks that
+                        spend most of their time waiting)
+        COOPERATIVE     Taking turns with other tasks in one thread of a
+                        shared host process (process must never block)
     """
 
 
+    #=========================================================================
+    PROCESS     = 'process'         # executed in a worker process
+    THREAD      = 'thread'          # executed in a host process' thread
+    COOPERATIVE = 'cooperative'     # executed in turns in a host process
+
+
+    #=========================================================================
+    mode      = PROCESS
+    cacheable = False
+
+
     #=========================================================================
     def __init__( self, arguments = None ):
         """
@@ -98,6 +133,7 @@ class Task( object ):
 
         self.arguments       = None
         self.report          = Report()
+        self.result          = None
         self.valid_arguments = self._load_args( arguments )
 
 
@@ -167,17 +203,34 @@ class Task( object ):
 
 
     #=========================================================================
-    def _load_args( self, args ):
+    def run( self ):
+        """
+        Generator that executes this task one step at a time.
+        @return         A generator that yields progress values, messages, or
+                        Report objects until the task is complete
+        @throws NotSupported
+                        Descendant class does not support this method
+        """
+
+        raise NotSupported()
+
+
+    #=========================================================================
+    def _load_args( self, args, arg_list = None ):
         """
         Load given arguments into object state.
         @param args     List or dict of requested argument values
+        @param arg_list The list of arguments expected by this task driver
+                        (default is the list from getargs())
         """
 
         # flag to indicate valid argument input
         result = True
 
         # build a list of arguments expected by this task driver
-        self._arg_list = self.getargs()
+        if arg_list is None:
+            arg_list = self.getargs()
+        self._arg_list = arg_list
 
         # build a lookup table of known arguments
         self._arg_table = dict( ( a[ 'name' ], a ) for a in self._arg_list )
@@ -265,6 +318,23 @@ class Task( object ):
         return True
 
 
+#=============================================================================
+def normalize_args( arg_list, arguments ):
+    """
+    Loads requested argument values the way a task instance would, from the
+    task's argument list alone (so the task's module is not needed).
+    @param arg_list     The task's argument list (see Task.getargs())
+    @param arguments    Argument values requested for task execution
+    @return             A dict of the argument values (with defaults), or
+                        None if the arguments are not valid
+    """
+
+    loader = Task()
+    if loader._load_args( arguments, arg_list ) == False:
+        return None
+    return loader.arguments
+
+
 #=============================================================================
 def main( argv ):
     """
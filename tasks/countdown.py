@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""
+External Program Example Task
+"""
+
+
+import sys
+
+import external
+
+
+_script = '''
+import sys, time
+total = int( sys.argv[ 1 ] )
+for second in range( total ):
+    print '%d of %d seconds' % ( second, total )
+    sys.stdout.flush()
+    time.sleep( 1.0 )
+print '@aptask message liftoff'
+'''
+
+
+class Countdown( external.ExternalTask ):
+    """
+    Counts down in an external program (an example of an external program
+    task driver).
+    """
+
+    patterns = [ r'(?P<done>\d+) of (?P<total>\d+) seconds' ]
+    timeout  = 600.0
+
+    @classmethod
+    def getargs( cls ):
+        return [
+            {
+                "name" : "seconds",
+                "default" : 10,
+                "help" : "Number of seconds to count down"
+            }
+        ]
+
+    def get_command( self ):
+        return [
+            sys.executable,
+            '-c',
+            _script,
+            str( self.arguments[ 'seconds' ] )
+        ]
@@ -5,11 +5,14 @@ Worker Process
 """
 
 
+import cPickle
 import importlib
-import multiprocessing
-import Queue
+import os
+import sys
+import time
 
 import data
+import store
 import task
 import watchdog
 
@@ -40,21 +43,30 @@ class Command( data.Data ):
 #=============================================================================
 ABORT = Command( Command.ABORT )
 
+UPDATED = 1                         # message sent when the status slot has
+                                    #   a new report
+
+_idle_poll = 1.0                    # time between checks while a task waits
+                                    #   for commands
+_join_poll = 0.1                    # time between process checks in join()
+
 
 #=============================================================================
-class Worker( multiprocessing.Process ):
+class Worker( object ):
     """
-    Worker process interface object.
+    Worker interface object.
     Instances of this object are intended to be used to control and interact
-    with worker processes from a parent process.  No memory is shared with the
-    worker process.
+    with a task from the parent process.  The task runs in a worker process
+    from the pool (see the pool module), or in a host process (see the host
+    module), which is assigned when the task is started.  The only memory
+    shared with the process is the task's status slot.
     """
 
 
     #=========================================================================
     INIT     = 0                    # initialized, ready to run
     RUNNING  = 1                    # running
-    STOPPING = 2                    # shutting down process
+    STOPPING = 2                    # shutting down task
 
 
     #=========================================================================
@@ -62,29 +74,33 @@ class Worker( multiprocessing.Process ):
 
 
     #=========================================================================
-    def __init__( self, descriptor, authkey = None ):
+    def __init__( self, descriptor, authkey = None, mode = task.Task.PROCESS ):
         """
         Constructor.
         @param descriptor
                         Task execution descriptor
         @param authkey  Task owner's authentication key
+        @param mode     The task's execution mode (see task.Task)
         """
 
-        # create the IPC message queues
-        self.command_queue = multiprocessing.Queue()
-        self.status_queue  = multiprocessing.Queue()
-
-        # initialize the parent
-        super( Worker, self ).__init__(
-            target = worker,
-            args   = ( self.command_queue, self.status_queue, descriptor ),
-            name   = 'aptaskworker'
-        )
+        # the worker process is assigned when the task is started so queued
+        #   tasks do not hold any system resources
+        self.process = None
 
         # initialize object state
-        self.authkey = authkey
-        self.state   = Worker.INIT
-        self.status  = None
+        self.descriptor = descriptor
+        self.authkey    = authkey
+        self.mode       = mode
+        self.state      = Worker.INIT
+        self.status     = None
+        self.finished   = False
+
+        # time taken to start the task (until its first status report)
+        self.latency  = None
+        self._started = None
+
+        # sequence number of the last report read from the status slot
+        self._seq = 0
 
 
     #=========================================================================
@@ -94,24 +110,30 @@ class Worker( multiprocessing.Process ):
         @return         A Report object describing the status
         """
 
-        # set invalid status to detect if there was a status update
-        status = None
-
-        # loop until the status queue is empty
-        while True:
-            try:
-                status = self.status_queue.get_nowait()
-            except Queue.Empty:
-                break
-
-        # check for an update
-        if status is not None:
-            self.status = status
+        # receive any status updates from the worker process
+        self._receive()
 
         # return most recent status update
         return self.status
 
 
+    #=========================================================================
+    def get_waitables( self ):
+        """
+        Get the objects that become readable when the worker needs attention.
+        The process' connection is readable when there is a status update (or
+        the task is finished).  The sentinel is readable when the worker
+        process has exited.
+        @return         A list of objects or descriptors to wait on
+        """
+
+        # workers that are not running a task have nothing to wait on
+        if ( self.process is None ) or ( self.finished == True ):
+            return []
+
+        return [ self.process.conn, self.process.sentinel ]
+
+
     #=========================================================================
     def is_active( self ):
         """
@@ -123,13 +145,74 @@ class Worker( multiprocessing.Process ):
 
 
     #=========================================================================
-    def start( self ):
+    def is_alive( self ):
+        """
+        Check to see if the task is still executing in its worker process.
+        @return         True until the task is finished (or its worker
+                        process has exited)
+        """
+
+        # tasks that were never started have nothing executing
+        if self.process is None:
+            return False
+
+        # check for the end of the task, or of the process
+        self._receive()
+        if ( self.finished == False ) and ( self.process.is_alive() == False ):
+            self._receive()
+            self.finished = True
+
+        return self.finished == False
+
+
+    #=========================================================================
+    def join( self, timeout = None ):
+        """
+        Wait for the task to finish.
+        @param timeout  Maximum time to wait in seconds (None to block)
+        """
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        # poll the connection (the process is checked between polls in case
+        #   it exited without finishing the task)
+        while self.is_alive() == True:
+            wait = _join_poll
+            if timeout is not None:
+                wait = min( wait, deadline - time.time() )
+                if wait <= 0.0:
+                    break
+            try:
+                self.process.conn.poll( wait )
+            except ( EOFError, IOError, OSError ):
+                # the process exited while waiting
+                self._receive()
+                self.finished = True
+
+
+    #=========================================================================
+    def start( self, process, output = None, result = None ):
         """
         Start executing the task.
+        @param process  The idle worker process that will execute the task
+        @param output   A tuple of the path of the file that captures the
+                        task's output, and its maximum size (None to discard
+                        the task's output)
+        @param result   A tuple of the path of the result store, and the path
+                        of the task's link to its result (None to discard the
+                        task's result)
         """
 
-        self.state = Worker.RUNNING
-        super( Worker, self ).start()
+        self.process  = process
+        self.state    = Worker.RUNNING
+        self._started = time.time()
+        self._seq     = process.slot.get_seq()
+
+        descriptor = self.descriptor
+        if ( output is not None ) or ( result is not None ):
+            descriptor = dict( descriptor, output = output, result = result )
+        process.run_task( descriptor )
 
 
     #=========================================================================
@@ -138,35 +221,95 @@ class Worker( multiprocessing.Process ):
         Stop executing the task.
         """
 
-        if self.state == Worker.RUNNING:
-            self.command_queue.send( ABORT )
+        if ( self.state == Worker.RUNNING ) and ( self.finished == False ):
+            try:
+                self.process.conn.send( ABORT )
+            except ( IOError, OSError ):
+                pass
 
         self.state = Worker.STOPPING
 
 
+    #=========================================================================
+    def _receive( self ):
+        """
+        Receives status updates from the worker process.  The process
+        publishes reports in its status slot, and sends UPDATED when there is
+        a new one.  Reports too large for the slot are sent with the slot's
+        sequence number at the time, so older reports in the slot are not
+        read after them.  The process sends None after the task is finished.
+        """
+
+        if ( self.process is None ) or ( self.finished == True ):
+            return
+
+        updated = False
+        try:
+            while self.process.conn.poll() == True:
+                message = self.process.conn.recv()
+                if message is None:
+                    self.finished = True
+                    updated       = True
+                    break
+                elif type( message ) is tuple:
+                    ( self._seq, report ) = message
+                    self._set_status( report )
+                else:
+                    updated = True
+        except ( EOFError, IOError, OSError ):
+            self.finished = True
+            updated       = True
+
+        # read the latest report from the slot
+        if updated == True:
+            ( self._seq, value ) = self.process.slot.get( self._seq )
+            if value is not None:
+                self._set_status( cPickle.loads( value ) )
+
+
+    #=========================================================================
+    def _set_status( self, report ):
+        """
+        Stores the latest status report.
+        @param report   The report
+        """
+
+        if self.status is None:
+            self.latency = time.time() - self._started
+        self.status = report
+
+
 #=============================================================================
-def create_task_descriptor( name, arguments ):
+def create_task_descriptor( name, arguments, interval = 0.0 ):
     """
     Decouples the structure of a task descriptor from code outside this
     module.  Don't count on the returned object having a consistent type or
     format.
     @param name         Task identifier
     @param arguments    Arguments to pass to the task
+    @param interval     Minimum time between status reports from a task that
+                        implements run() (seconds)
     """
 
     # for now, just use a dict
-    return { 'name' : name, 'arguments' : arguments }
+    return { 'name' : name, 'arguments' : arguments, 'interval' : interval }
 
 
 #=============================================================================
-def worker( command_queue, status_queue, task_descriptor ):
+def execute( conn, status_slot, task_descriptor ):
     """
-    Function to execute as a worker process.
-    @param command_queue
-                        IPC command queue from parent process
-    @param status_queue IPC status queue to parent process
+    Generator that executes a task one step at a time.  Each step checks for
+    commands, and calls the task's process() method once.  The caller waits
+    for a command (or not) between steps, so many tasks can take turns in one
+    thread (see the host module).
+    @param conn         IPC connection to the parent process (receives
+                        commands, and sends status notifications)
+    @param status_slot  Shared memory slot for the latest status report
     @param task_descriptor
                         Task descriptor
+    @return             A generator that yields the time the caller may wait
+                        for a command on the connection before the next step
+                        (0.0 when the task has more work to do)
     """
 
     # set up a watchdog timer
@@ -184,34 +327,89 @@ def worker( command_queue, status_queue, task_descriptor ):
     except task.NotSupported:
         report = task.Report()
 
+    # send the initial status (tasks that finish here only send this one)
+    _send_status( conn, status_slot, report )
+    published = ( report.status, report.message )
+
+    # tasks that implement run() are driven through its generator, and only
+    #   check for commands and publish their status once per interval (or
+    #   when the task's status or message changes)
+    try:
+        steps = tsk.run()
+    except task.NotSupported:
+        steps = None
+    interval = task_descriptor.get( 'interval', 0.0 )
+    deadline = time.time() + interval
+
+    # the parent may exit without asking while the task is waiting
+    parent = os.getppid()
+
+    # tasks that do not implement process() make no progress here, so the
+    #   caller waits for commands instead of calling it again
+    idle = False
+
     # loop until the task reports completion
     while report.is_done() == False:
 
+        # let the caller wait for a command (idle tasks wake up periodically
+        #   to check the watchdog and the parent)
+        if idle == True:
+            yield _idle_poll
+        else:
+            yield 0.0
+
         # check the watchdog timer for a timeout after a stuck abort
         if dog.check() == False:
             break
 
+        # generator tasks run steps until their interval is over
+        due = True
+        if steps is not None:
+            due = time.time() >= deadline
+
         # check for any pending messages
+        command = None
         try:
-            command = command_queue.get_nowait()
-        except Queue.Empty:
-            pass
-        else:
+            if ( due == True ) and ( conn.poll() == True ):
+                command = conn.recv()
+            elif ( idle == True ) and ( os.getppid() != parent ):
+                break
+        except ( EOFError, IOError ):
+            break
 
-            # check for an abort command
-            if command.id == Command.ABORT:
+        # check for an abort command
+        if ( isinstance( command, Command ) == True ) \
+            and ( command.command_id == Command.ABORT ):
 
-                # try to abort the task
-                try:
-                    report = tsk.abort()
+            # try to abort the task
+            try:
+                report = tsk.abort()
 
-                # not supported, just stop processing
-                except task.NotSupported:
-                    break
+            # not supported, just stop processing
+            except task.NotSupported:
+                break
 
-                # start a timer to make sure we abort the process
-                else:
-                    dog.start()
+            # start a timer to make sure we abort the process, and check
+            #   if the task stopped right away
+            else:
+                dog.start()
+                _send_status( conn, status_slot, report )
+                continue
+
+        # idle tasks only respond to commands
+        if idle == True:
+            continue
+
+        # run one step of a generator task, and publish its status when it
+        #   is due or changed
+        if steps is not None:
+            report = _step( tsk, steps )
+            if ( due == True ) \
+                or ( ( report.status, report.message ) != published ):
+                _send_status( conn, status_slot, report )
+                published = ( report.status, report.message )
+                deadline  = time.time() + interval
+            continue
 
         # spend time executing task
         #   some tasks will quickly update status here
@@ -220,13 +418,96 @@ def worker( command_queue, status_queue, task_descriptor ):
         try:
             report = tsk.process()
         except task.NotSupported:
-            pass
+            idle = True
+            continue
 
         # send status and progress to manager
+        _send_status( conn, status_slot, report )
+
+    # let a generator task clean up (if it stopped early)
+    if steps is not None:
+        steps.close()
+
+    # store the task's result, and report its digest
+    if ( tsk.result is not None ) \
+        and ( task_descriptor.get( 'result' ) is not None ):
+        ( directory, path ) = task_descriptor[ 'result' ]
         try:
-            status_queue.put_nowait( report )
-        except Queue.Full:
-            pass
+            report.result = store.put( directory, path, tsk.result )
+        except ( IOError, OSError, TypeError, ValueError ) as e:
+            sys.stderr.write( 'unable to store result: %s\n' % e )
+        else:
+            _send_status( conn, status_slot, report )
+
+
+#=============================================================================
+def worker( conn, status_slot, task_descriptor ):
+    """
+    Function to execute a task in a worker process (or a thread).
+    @param conn         IPC connection to the parent process (receives
+                        commands, and sends status notifications)
+    @param status_slot  Shared memory slot for the latest status report
+    @param task_descriptor
+                        Task descriptor
+    """
+
+    # block on the connection whenever the task has nothing to do
+    for wait in execute( conn, status_slot, task_descriptor ):
+        if wait > 0.0:
+            try:
+                conn.poll( wait )
+            except ( EOFError, IOError ):
+                pass
+
+
+#=============================================================================
+def _step( tsk, steps ):
+    """
+    Runs a generator task until it yields its next value.
+    @param tsk          The task object
+    @param steps        The generator returned by the task's run() method
+    @return             The task's report after the step (the task's own
+                        report, updated with the value, unless the task
+                        yielded a report)
+    """
+
+    report = tsk.report
+
+    # the task is done when its generator is exhausted
+    try:
+        value = next( steps )
+    except StopIteration:
+        report.status   = task.Report.DONE
+        report.progress = 1.0
+        return report
+
+    # the task may yield a whole report, its progress, or a message
+    if isinstance( value, task.Report ) == True:
+        return value
+    if isinstance( value, ( int, long, float ) ) == True:
+        report.progress = float( value )
+    elif isinstance( value, basestring ) == True:
+        report.message = value
+    if report.status == task.Report.INIT:
+        report.status = task.Report.RUNNING
+    return report
+
+
+#=============================================================================
+def _send_status( conn, status_slot, report ):
+    """
+    Publishes a status report to the parent process.
+    @param conn         IPC connection to the parent process
+    @param status_slot  Shared memory slot for the latest status report
+    @param report       The report
+    """
+
+    value  = cPickle.dumps( report, cPickle.HIGHEST_PROTOCOL )
+    notify = status_slot.put( value )
+    if notify is None:
+        conn.send( ( status_slot.get_seq(), report ) )
+    elif notify == True:
+        conn.send( UPDATED )
 
 
 #=============================================================================
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+"""
+Worker Process Forkserver
+
+The zygote is a small process that is started before the daemon opens any
+sockets or log files.  It imports every task module once, then forks new
+worker processes on request.  Each worker process starts from this warm
+image, so it does not need to import its task modules, and it does not
+inherit the daemon's sockets, rings, or log database.
+
+The daemon also gets the task index from the zygote, so the daemon never
+imports task modules itself.
+
+The daemon asks the zygote for a worker process over a control connection.
+The zygote forks the process, and passes the daemon's end of the worker's
+connection, the worker's exit sentinel, and the worker's status slot back over
+the same connection (as file descriptors).
+"""
+
+
+import multiprocessing
+import multiprocessing.reduction
+import os
+import signal
+import sys
+import traceback
+
+import _multiprocessing
+
+import host
+import poller
+import pool
+import slot
+
+
+#=============================================================================
+_parent_poll = 1.0                  # time between checks for the parent
+
+
+#=============================================================================
+class Child( object ):
+    """
+    A worker process forked by the zygote.  This provides the same interface
+    as a pool.Process for the worker pool.
+    """
+
+
+    #=========================================================================
+    def __init__( self, pid, conn, sentinel, status_slot ):
+        """
+        Constructor.
+        @param pid      The worker process' ID
+        @param conn     The connection to the worker process
+        @param sentinel File descriptor that becomes readable (EOF) when the
+                        worker process exits
+        @param status_slot
+                        The worker process' status slot
+        """
+
+        self.pid      = pid
+        self.conn     = conn
+        self.sentinel = sentinel
+        self.slot     = status_slot
+        self.tasks    = 0
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Asks the process to exit (once it is idle).
+        """
+
+        try:
+            self.conn.send( None )
+        except ( IOError, OSError ):
+            pass
+
+
+    #=========================================================================
+    def is_alive( self ):
+        """
+        Check to see if the process is still running.
+        @return         True if the process has not exited
+        """
+
+        if self.sentinel is None:
+            return False
+        return self._wait( 0 ) == False
+
+
+    #=========================================================================
+    def join( self, timeout = None ):
+        """
+        Wait for the process to exit.  The zygote reaps the process.
+        @param timeout  Maximum time to wait in seconds (None to block)
+        """
+
+        if self.sentinel is None:
+            return
+
+        # wait for the sentinel, then release the connection, sentinel, and
+        #   slot
+        if self._wait( timeout ) == True:
+            self.conn.close()
+            os.close( self.sentinel )
+            self.sentinel = None
+            self.slot.close()
+
+
+    #=========================================================================
+    def run_task( self, descriptor ):
+        """
+        Sends a task to the (idle) process.
+        @param descriptor
+                        Task execution descriptor
+        """
+
+        self.tasks += 1
+        self.conn.send( descriptor )
+
+
+    #=========================================================================
+    def _wait( self, timeout ):
+        """
+        Waits for the process' exit sentinel.  The daemon holds descriptors
+        for every worker and host process, so the sentinel may be beyond the
+        reach of select().
+        @param timeout  Maximum time to wait in seconds (None to block)
+        @return         True if the process has exited
+        """
+
+        try:
+            return len( poller.wait( [ self.sentinel ], timeout ) ) > 0
+        except IOError as e:
+            if poller.is_interrupt( e ) == True:
+                return False
+            raise
+
+
+#=============================================================================
+class Zygote( multiprocessing.Process ):
+    """
+    The forkserver process (and its interface for the daemon).
+    """
+
+
+    #=========================================================================
+    def __init__( self, config ):
+        """
+        Constructor.
+        @param config   Application configuration object
+        """
+
+        # initialize the parent
+        super( Zygote, self ).__init__( name = 'aptaskzygote' )
+
+        self.config = config
+        self.conn   = None
+
+        # the zygote's end of the control connection
+        self._child = None
+
+
+    #=========================================================================
+    def close( self ):
+        """
+        Stops the zygote.  Worker processes it started exit on their own
+        when they are asked to, or when they notice the zygote is gone.
+        """
+
+        try:
+            self.conn.send( None )
+        except ( IOError, OSError ):
+            pass
+        self.join()
+        self.conn.close()
+
+
+    #=========================================================================
+    def fork( self, mode = None ):
+        """
+        Starts a new worker process.
+        @param mode     The execution mode of a host process (None for a
+                        worker process)
+        @return         The worker process (Child object)
+        """
+
+        self.conn.send( ( 'fork', mode ) )
+        pid      = self.conn.recv()
+        fd       = multiprocessing.reduction.recv_handle( self.conn )
+        sentinel = multiprocessing.reduction.recv_handle( self.conn )
+        slot_fd  = multiprocessing.reduction.recv_handle( self.conn )
+        return Child(
+            pid,
+            _multiprocessing.Connection( fd ),
+            sentinel,
+            slot.Slot( fd = slot_fd )
+        )
+
+
+    #=========================================================================
+    def get_task_index( self ):
+        """
+        Get the task index built from the task modules the zygote imported.
+        @return         The task index (see Configuration.get_task_index())
+        """
+
+        self.conn.send( ( 'index', None ) )
+        return self.conn.recv()
+
+
+    #=========================================================================
+    def run( self ):
+        """
+        Zygote process entry point.
+        """
+
+        self.conn.close()
+        serve( self._child, self.config )
+
+
+    #=========================================================================
+    def start( self ):
+        """
+        Start the zygote.
+        """
+
+        ( self.conn, self._child ) = multiprocessing.Pipe( True )
+        super( Zygote, self ).start()
+        self._child.close()
+        self._child = None
+
+
+#=============================================================================
+def serve( conn, config ):
+    """
+    Function to execute as the zygote process.
+    @param conn         Control connection to the daemon
+    @param config       Application configuration object
+    """
+
+    # import every task module into the image the workers are forked from
+    index = config.get_task_index()
+
+    # worker processes are reaped automatically
+    signal.signal( signal.SIGCHLD, signal.SIG_IGN )
+
+    # the daemon may exit without asking
+    parent = os.getppid()
+
+    while True:
+
+        # wait for a request (None asks the zygote to exit)
+        try:
+            if conn.poll( _parent_poll ) == False:
+                if os.getppid() != parent:
+                    break
+                continue
+            message = conn.recv()
+        except ( EOFError, IOError ):
+            break
+        if message is None:
+            break
+
+        # send the task index
+        if message[ 0 ] == 'index':
+            conn.send( index )
+            continue
+
+        # create the worker's connection, exit sentinel, and status slot,
+        #   then fork
+        ( worker_conn, child_conn ) = multiprocessing.Pipe( True )
+        ( sentinel, writer ) = os.pipe()
+        status_slot = slot.Slot()
+        pid = os.fork()
+
+        # the worker process only keeps its own ends
+        if pid == 0:
+            conn.close()
+            worker_conn.close()
+            os.close( sentinel )
+            _run_child( child_conn, status_slot, message[ 1 ] )
+
+        # pass the daemon's ends to the daemon
+        child_conn.close()
+        os.close( writer )
+        conn.send( pid )
+        multiprocessing.reduction.send_handle(
+            conn,
+            worker_conn.fileno(),
+            None
+        )
+        multiprocessing.reduction.send_handle( conn, sentinel, None )
+        multiprocessing.reduction.send_handle(
+            conn,
+            status_slot.fileno(),
+            None
+        )
+        worker_conn.close()
+        os.close( sentinel )
+        status_slot.close()
+
+
+#=============================================================================
+def _run_child( conn, status_slot, mode ):
+    """
+    Runs a forked worker process, and never returns.
+    @param conn         Connection to the daemon
+    @param status_slot  Shared memory slot for the latest status report
+    @param mode         The execution mode of a host process (None for a
+                        worker process)
+    """
+
+    signal.signal( signal.SIGCHLD, signal.SIG_DFL )
+    code = 0
+    try:
+        if mode is None:
+            pool.serve( conn, status_slot )
+        else:
+            host.serve( conn, mode )
+    except:
+        traceback.print_exc()
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit( code )
+
+
+#=============================================================================
+def main( argv ):
+    """
+    Script execution entry point
+    @param argv         Arguments passed to the script
+    @return             Exit code (0 = success)
+    """
+
+    import time
+
+    import configuration
+    import worker
+
+    config = configuration.load_configuration( 'aptaskd.json' )
+
+    zygote = Zygote( config )
+    zygote.start()
+
+    workers = pool.Pool( max_tasks = 2, zygote = zygote )
+    workers.resize( 2 )
+
+    for index in range( 5 ):
+        start = time.time()
+        wrkr  = worker.Worker(
+            worker.create_task_descriptor( 'DevTask', { 'devarg' : index } )
+        )
+        wrkr.start( workers.acquire() )
+        wrkr.stop()
+        wrkr.join()
+        print 'task %d: %s (pid %d, %.1f ms)' % (
+            index,
+            wrkr.get_status().message,
+            wrkr.process.pid,
+            ( time.time() - start ) * 1000.0
+        )
+        workers.release( wrkr.process )
+    print 'pool:', workers.get_stats()
+
+    workers.close()
+    zygote.close()
+
+    # return success
+    return 0
+
+
+#=============================================================================
+if __name__ == "__main__":
+    sys.exit( main( sys.argv ) )